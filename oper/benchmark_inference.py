@@ -0,0 +1,221 @@
+'''
+Description: CPU-runnable inference benchmark of GraphCastModel, without the 0.25 degree weights or a GPU.
+             A reduced-resolution ModelConfig with random params is combined with the operational TaskConfig
+             (13 or 37 levels) and a synthetic IC with the real variable set, written in the IC layout of
+             gen_gefs_ics.py. The IC is read with load_gdas_data and the forecast runs through the same
+             load_model + rollout path (run_rollout) as an operational run, timed with utils/profiling.py.
+             Every (forecast length, batch size) case runs in a fresh process, so compilation and the
+             process peak memory are measured per case:
+                 python benchmark_inference.py -l 2,4,8 -b 1,2 -r 4.0 -o benchmark.json
+             JAX runs on the cpu unless JAX_PLATFORMS is set.
+Revision history:
+    -20261019: initial code
+    -20261019: synchronized step timings, rollout time outside the steps reported and checked
+'''
+import os
+# Set before jax is imported (also in the spawned case processes)
+os.environ.setdefault('JAX_PLATFORMS', 'cpu')
+
+import json
+import socket
+import argparse
+import resource
+import tempfile
+import dataclasses
+import multiprocessing
+from time import perf_counter
+from concurrent.futures import ProcessPoolExecutor
+
+import jax
+import numpy as np
+import xarray
+
+from graphcast import graphcast
+
+from run_graphcast_ens import GraphCastModel
+from utils.profiling import Profiler
+
+STATIC_VARIABLES = ('geopotential_at_surface', 'land_sea_mask')
+
+# Rough mean and standard deviation of the fields that are not normalized to O(1) by the synthetic values,
+# so that random weights see inputs of a realistic scale
+STATS = {'toa_incident_solar_radiation': (1.1e6, 1.4e6)}
+
+
+def model_config(resolution=4.0, mesh_size=2, latent_size=32, gnn_msg_steps=2, hidden_layers=1):
+    """Reduced GraphCast ModelConfig, the operational model is 0.25 degree, mesh 2to6, latent 512, 16 steps."""
+    return graphcast.ModelConfig(resolution=resolution, mesh_size=mesh_size, latent_size=latent_size,
+                                 gnn_msg_steps=gnn_msg_steps, hidden_layers=hidden_layers,
+                                 radius_query_fraction_edge_length=0.6)
+
+
+def task_config(num_pressure_levels=13):
+    """The TaskConfig of the operational weights for the number of pressure levels."""
+    return graphcast.TASK_13_PRECIP_OUT if num_pressure_levels == 13 else graphcast.TASK
+
+
+def synthetic_ic(task, resolution, forecast_length, batch_size=1, start='2025-01-01T00', seed=0):
+    """
+    Random IC in the layout of gen_gefs_ics.py with all input and target variables of the task, with the
+    times of the whole forecast for every batch member (so load_gdas_data does not need to extend it).
+    """
+    rng = np.random.default_rng(seed)
+    lat = np.linspace(-90, 90, int(round(180 / resolution)) + 1, dtype=np.float32)
+    lon = np.arange(0, 360, resolution, dtype=np.float32)
+    level = np.array(task.pressure_levels, dtype=np.int32)
+    num_times = forecast_length + 2
+    time = (np.arange(num_times) * np.timedelta64(6, 'h')).astype('timedelta64[ns]')
+    datetimes = np.datetime64(start, 'ns') + np.arange(batch_size)[:, np.newaxis] * np.timedelta64(1, 'D') + time[np.newaxis, :]
+
+    data_vars = {}
+    variables = (set(task.input_variables) | set(task.target_variables)) - set(task.forcing_variables)
+    for var in sorted(variables):
+        if var in STATIC_VARIABLES:
+            values = rng.uniform(0, 1, (len(lat), len(lon)))
+            data_vars[var] = (('lat', 'lon'), values.astype(np.float32))
+        elif var in graphcast.ALL_ATMOSPHERIC_VARS:
+            values = rng.standard_normal((batch_size, num_times, len(level), len(lat), len(lon)))
+            data_vars[var] = (('batch', 'time', 'level', 'lat', 'lon'), values.astype(np.float32))
+        else:
+            values = rng.standard_normal((batch_size, num_times, len(lat), len(lon)))
+            data_vars[var] = (('batch', 'time', 'lat', 'lon'), values.astype(np.float32))
+
+    coords = {'lat': lat, 'lon': lon, 'level': level, 'time': time, 'datetime': (('batch', 'time'), datetimes)}
+    return xarray.Dataset(data_vars, coords=coords)
+
+
+def synthetic_stats(task):
+    """(diffs_stddev_by_level, mean_by_level, stddev_by_level) matching the synthetic IC."""
+    level = np.array(task.pressure_levels, dtype=np.int32)
+    variables = set(task.input_variables) | set(task.target_variables) | set(task.forcing_variables)
+    datasets = []
+    for statistic in ('diffs_stddev', 'mean', 'stddev'):
+        data_vars = {}
+        for var in sorted(variables):
+            mean, stddev = STATS.get(var, (0.0, 1.0))
+            value = mean if statistic == 'mean' else stddev
+            if var in graphcast.ALL_ATMOSPHERIC_VARS:
+                data_vars[var] = (('level',), np.full(len(level), value, dtype=np.float32))
+            else:
+                data_vars[var] = ((), np.float32(value))
+        datasets.append(xarray.Dataset(data_vars, coords={'level': level}))
+    return tuple(datasets)
+
+
+def run_case(forecast_length, batch_size, num_pressure_levels=13, seed=0, **model_kwargs):
+    """
+    Benchmark one forecast length and batch size, meant to run in its own process.
+        Args:
+          model_kwargs: arguments of model_config
+        Returns:
+          dict with the timings and memory statistics of the case
+    """
+    task = task_config(num_pressure_levels)
+    config = model_config(**model_kwargs)
+    resolution = config.resolution
+    with tempfile.TemporaryDirectory() as tmpdir:
+        ic = synthetic_ic(task, resolution, forecast_length, batch_size, seed=seed)
+        cycle = np.datetime_as_string(ic['datetime'].values[0, 1], unit='h').replace('-', '').replace('T', '')
+        ic_file = os.path.join(tmpdir, f'source-gec00_date-{cycle}_res-{resolution}_levels-{num_pressure_levels}_steps-{forecast_length}.nc')
+        ic.to_netcdf(ic_file)
+
+        runner = GraphCastModel(tmpdir, ic_file, 'c00', None, tmpdir, num_pressure_levels, forecast_length)
+        runner.profiler = Profiler(True, 'c00', runner.cycle)
+        runner.model_config = config
+        runner.task_config = task
+        runner.load_gdas_data()
+        runner.extract_inputs_targets_forcings()
+        runner.diffs_stddev_by_level, runner.mean_by_level, runner.stddev_by_level = synthetic_stats(task)
+
+        # Random params, initialized on a single step (the params do not depend on the number of steps)
+        start = perf_counter()
+        runner.load_model()
+        runner.params, runner.state = runner.model_init(rng=jax.random.PRNGKey(seed), inputs=runner.inputs,
+                                                        targets_template=runner.targets.isel(time=[0]),
+                                                        forcings=runner.forcings.isel(time=[0]))
+        jax.block_until_ready(runner.params)
+        init_seconds = perf_counter() - start
+        # Rebuild with the params bound, the rollout reuses the model
+        runner.load_model()
+
+        start = perf_counter()
+        runner.run_rollout()
+        rollout_seconds = perf_counter() - start
+
+    summary = runner.profiler.summary()
+    median = summary['median_step_seconds']
+    # The profiler waits for every step, so the steps account for the rollout apart from the host
+    # transfer and concatenation of the steps
+    step_seconds = [r['seconds'] for r in summary['steps']]
+    warnings = list(summary['warnings'])
+    if sum(step_seconds) > rollout_seconds:
+        warnings.append(f'steps take {sum(step_seconds):.2f} s, more than the {rollout_seconds:.2f} s rollout')
+    return {
+        'forecast_length': forecast_length,
+        'batch_size': batch_size,
+        'init_seconds': init_seconds,
+        'compile_seconds': summary['compile_seconds'],
+        'first_step_seconds': summary['steps'][0]['seconds'] if summary['steps'] else None,
+        'median_step_seconds': median,
+        'steps_per_second': None if not median else 1 / median,
+        'member_steps_per_second': None if not median else batch_size / median,
+        'rollout_seconds': rollout_seconds,
+        'rollout_overhead_seconds': rollout_seconds - sum(step_seconds),
+        'step_seconds': step_seconds,
+        'phases': summary['phases'],
+        # ru_maxrss is in kilobytes on linux
+        'peak_rss_bytes': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        'device_memory': summary['memory'],
+        'warnings': warnings,
+    }
+
+
+def run_benchmark(forecast_lengths, batch_sizes, num_pressure_levels=13, seed=0, **model_kwargs):
+    """Run every (forecast length, batch size) case in a fresh process, returns the json report."""
+    cases = []
+    for forecast_length in forecast_lengths:
+        for batch_size in batch_sizes:
+            # spawn, not fork: jax is not fork-safe and every case compiles from scratch
+            with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+                result = executor.submit(run_case, forecast_length, batch_size, num_pressure_levels, seed, **model_kwargs).result()
+            cases.append(result)
+            print(f"length {forecast_length:>3}, batch {batch_size:>2}: compile {result['compile_seconds'] or 0:.2f} s, "
+                  f"step {result['median_step_seconds'] or 0:.3f} s, {result['steps_per_second'] or 0:.2f} steps/s, "
+                  f"rollout {result['rollout_seconds']:.2f} s ({result['rollout_overhead_seconds']:.2f} s outside the steps), "
+                  f"peak rss {result['peak_rss_bytes'] / 1024**3:.2f} GB")
+            for warning in result['warnings']:
+                print(f"  warning: {warning}")
+
+    return {
+        'host': socket.gethostname(),
+        'jax_version': jax.__version__,
+        'platform': os.environ['JAX_PLATFORMS'],
+        'model_config': dataclasses.asdict(model_config(**model_kwargs)),
+        'num_pressure_levels': num_pressure_levels,
+        'cases': cases,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark GraphCast inference with a tiny random-weight model")
+    parser.add_argument("-l", "--lengths", help="comma separated forecast lengths (6-hourly steps)", default="2,4,8")
+    parser.add_argument("-b", "--batch-sizes", help="comma separated batch sizes", default="1,2")
+    parser.add_argument("-p", "--pressure", help="number of pressure levels of the task (13 or 37)", default=13)
+    parser.add_argument("-r", "--resolution", help="grid resolution in degrees", default=4.0)
+    parser.add_argument("--mesh-size", help="number of mesh refinements", default=2)
+    parser.add_argument("--latent-size", help="latent size of the processor", default=32)
+    parser.add_argument("--msg-steps", help="number of message passing steps", default=2)
+    parser.add_argument("--seed", help="seed of the random params and IC", default=0)
+    parser.add_argument("-o", "--output", help="write the report to a json file", default=None)
+    args = parser.parse_args()
+
+    report = run_benchmark([int(n) for n in args.lengths.split(',')], [int(n) for n in args.batch_sizes.split(',')],
+                           num_pressure_levels=int(args.pressure), resolution=float(args.resolution), mesh_size=int(args.mesh_size),
+                           latent_size=int(args.latent_size), gnn_msg_steps=int(args.msg_steps), seed=int(args.seed))
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=4)
+        print(f"Saved benchmark report to {args.output}")
+    else:
+        print(json.dumps(report, indent=4))
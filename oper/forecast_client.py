@@ -0,0 +1,129 @@
+'''
+Description: Thin client of the warm inference service (inference_service.py), replacing run_graphcast_ens.py
+             in the cycle scripts when a service is running. Jobs are json files in a spool directory:
+                 <spool>/queue/<job id>.json      submitted, written atomically by the client
+                 <spool>/running/<job id>.json    claimed by a service (atomic rename)
+                 <spool>/done/<job id>.json       job and result (output directory, timings)
+                 <spool>/failed/<job id>.json     job and error
+             Only the standard library is imported, so a submission costs no jax/iris start-up, e.g.
+                 python forecast_client.py -s /lustre/mlgefs_spool -i source-gec00_date-2025010100_res-0.25_levels-13_steps-2.nc \
+                     -m c00 -c c00.pkl -l 64 -o ./2025010100/ --wait yes
+Revision history:
+    -20261019: initial code
+'''
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+
+QUEUE, RUNNING, DONE, FAILED = 'queue', 'running', 'done', 'failed'
+
+
+def spool_dirs(spool):
+    """Create the state directories of a spool directory."""
+    for state in (QUEUE, RUNNING, DONE, FAILED):
+        os.makedirs(os.path.join(spool, state), exist_ok=True)
+
+
+def write_json(path, data):
+    """Write to a temporary file and rename, so a reader never sees a partial job."""
+    tmp_file = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump(data, f, indent=4)
+    os.replace(tmp_file, path)
+
+
+def submit_job(spool, job):
+    """
+    Queue a job, see inference_service.InferenceService.run_job for its keys.
+        Returns:
+          job id, the submission time in ns first so the queue is served in order
+    """
+    spool_dirs(spool)
+    job = dict(job, submitted=time.time(), client=f'{socket.gethostname()}:{os.getpid()}')
+    job_id = f"{time.time_ns()}_{job.get('member', 'job')}_{os.getpid()}"
+    write_json(os.path.join(spool, QUEUE, f'{job_id}.json'), job)
+    return job_id
+
+
+def job_status(spool, job_id):
+    """(state, record) of a job, record is the job (queue, running) or job and result (done, failed)."""
+    for state in (DONE, FAILED, RUNNING, QUEUE):
+        path = os.path.join(spool, state, f'{job_id}.json')
+        try:
+            with open(path, 'r') as f:
+                return state, json.load(f)
+        except FileNotFoundError:
+            continue
+    return None, None
+
+
+def wait_job(spool, job_id, timeout=None, poll_interval=2.0):
+    """Wait until the job is done or failed, returns (state, record)."""
+    start = time.time()
+    while True:
+        state, record = job_status(spool, job_id)
+        if state in (DONE, FAILED):
+            return state, record
+        if timeout is not None and time.time() - start > timeout:
+            raise TimeoutError(f"Job {job_id} is still {state} after {timeout} s")
+        time.sleep(poll_interval)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Submit a forecast to the warm inference service.")
+    parser.add_argument("-s", "--spool", help="spool directory of the service", required=True)
+    parser.add_argument("-i", "--input", help="input file path (including file name)", default=None)
+    parser.add_argument("-l", "--length", help="length of forecast (6-hourly steps)", default=None)
+    parser.add_argument("-m", "--member", help="gefs member [c00, p01, ..., p30]", default=None)
+    parser.add_argument("-c", "--config", help="GC weight member file", default=None)
+    parser.add_argument("-o", "--output", help="output directory", default=None)
+    parser.add_argument("-u", "--upload", help="upload input data as well as forecasts to noaa s3 bucket (yes or no)", default="no")
+    parser.add_argument("-k", "--keep", help="keep input and output after uploading to noaa s3 bucket (yes or no)", default="no")
+    parser.add_argument("--packing", help="grib2 packing: simple, complex or ccsds", default="simple")
+    parser.add_argument("--precision", help="json file with bitsPerValue per variable", default=None)
+    parser.add_argument("--publish", help="s3 prefix in the noaa s3 bucket to publish each forecast lead to as soon as it is written", default=None)
+    parser.add_argument("--profile", help="aws profile used for publishing", default=None)
+    parser.add_argument("--products", help="comma separated subset products written ahead of the full files", default=None)
+    parser.add_argument("--wait", help="wait for the job and exit with its status (yes or no)", default="yes")
+    parser.add_argument("--timeout", help="seconds to wait for the job", default=None)
+    parser.add_argument("--stop", help="ask the service to stop after the jobs queued before (yes or no)", default="no")
+    args = parser.parse_args()
+
+    if args.stop.lower() == "yes":
+        job_id = submit_job(args.spool, {'stop': True})
+        print(f"Submitted stop request {job_id}")
+        sys.exit(0)
+
+    for name in ('input', 'length', 'member', 'config'):
+        if getattr(args, name) is None:
+            parser.error(f"--{name} is required")
+
+    job = {
+        'input': os.path.abspath(args.input),
+        'member': args.member,
+        'config': os.path.abspath(args.config),
+        'length': int(args.length),
+        'output': os.path.abspath(args.output or os.getcwd()),
+        'packing': args.packing,
+        'precision': None if args.precision is None else os.path.abspath(args.precision),
+        'publish': args.publish,
+        'profile': args.profile,
+        'products': None if args.products is None else args.products.split(','),
+        'upload': args.upload.lower() == "yes",
+        'keep': args.keep.lower() == "yes",
+    }
+    job_id = submit_job(args.spool, job)
+    print(f"Submitted job {job_id}")
+    if args.wait.lower() != "yes":
+        sys.exit(0)
+
+    state, record = wait_job(args.spool, job_id, None if args.timeout is None else float(args.timeout))
+    if state == FAILED:
+        print(f"Job {job_id} failed: {record.get('error')}")
+        sys.exit(1)
+    result = record.get('result', {})
+    print(f"Job {job_id} done in {result.get('seconds', 0):.1f} s (queued {result.get('queued_seconds', 0):.1f} s), "
+          f"forecasts in {result.get('output_dir')}")
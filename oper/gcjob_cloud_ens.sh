@@ -60,8 +60,14 @@ echo "Execution time for gdas_utility.py: $execution_time seconds"
 
 start_time=$(date +%s)
 echo "start runing graphcast to get real time 10-days forecasts for: $curr_datetime"
-# Run another Python script
-python3 run_graphcast_ens.py -i /lustre/EAGLE_ensemble/"$curr_datetime"/source-ge"$gefs_member"_date-"$curr_datetime"_res-0.25_levels-"$num_pressure_levels"_steps-2.nc -o /lustre/EAGLE_ensemble/"$curr_datetime"/ -w /lustre/EAGLE_ensemble -m "$gefs_member" -c "$config_path" -l "$forecast_length" -p "$num_pressure_levels" -u no -k yes
+# With mlgefs_spool set, the forecast is submitted to a warm inference_service.py serving that spool directory
+# (started with -w /lustre/EAGLE_ensemble) instead of starting run_graphcast_ens.py, the client waits for the job
+input_file=/lustre/EAGLE_ensemble/"$curr_datetime"/source-ge"$gefs_member"_date-"$curr_datetime"_res-0.25_levels-"$num_pressure_levels"_steps-2.nc
+if [ -n "$mlgefs_spool" ]; then
+    python3 forecast_client.py -s "$mlgefs_spool" -i "$input_file" -o /lustre/EAGLE_ensemble/"$curr_datetime"/ -m "$gefs_member" -c "$config_path" -l "$forecast_length" -u no -k yes --wait yes
+else
+    python3 run_graphcast_ens.py -i "$input_file" -o /lustre/EAGLE_ensemble/"$curr_datetime"/ -w /lustre/EAGLE_ensemble -m "$gefs_member" -c "$config_path" -l "$forecast_length" -p "$num_pressure_levels" -u no -k yes
+fi
 
 # Upload to s3 bucekt
 cd /lustre/EAGLE_ensemble/"$curr_datetime"
@@ -76,8 +82,8 @@ cd ..
 ymd=${curr_datetime:0:8}
 hour=${curr_datetime:8:2}
 
-#upload to noaa-nws-graphcastgfs-pds
-aws s3 --profile gcgfs sync $curr_datetime/forecasts_13_levels_${gefs_member}_model_${model_id}/ s3://noaa-nws-graphcastgfs-pds/EAGLE_ensemble/pmlgefs."$ymd"/"$hour"/forecasts_13_levels_${gefs_member}_model_${model_id}/
+#upload to noaa-nws-graphcastgfs-pds (parallel, unchanged objects are skipped on reruns)
+python3 /lustre/EAGLE_ensemble/oper/utils/s3_upload.py -s $curr_datetime/forecasts_13_levels_${gefs_member}_model_${model_id}/ -b noaa-nws-graphcastgfs-pds -p EAGLE_ensemble/pmlgefs."$ymd"/"$hour"/forecasts_13_levels_${gefs_member}_model_${model_id} --profile gcgfs -n 16
 
 # Delete outputs
 rm -r $curr_datetime/forecasts_13_levels_${gefs_member}_model_${model_id}
@@ -0,0 +1,287 @@
+'''
+Description: Streaming ensemble products (mean, spread and exceedance probabilities) for MLGEFS.
+             Member forecasts are consumed as they finish, either as in-memory forecast datasets
+             from run_graphcast_ens.py or from the written pmlgefs<member> grib2 files. Statistics
+             are accumulated per lead time with Welford's algorithm, so memory does not grow with
+             the number of members, and the products are written to grib2 with Netcdf2Grib:
+                 pmlgefsavg.tHHz.pgrb2.0p25.fXXX    ensemble mean
+                 pmlgefsspr.tHHz.pgrb2.0p25.fXXX    ensemble spread (standard deviation)
+                 pmlgefsprob.tHHz.0p25.fXXX.nc      exceedance probabilities (netcdf)
+Revision history:
+    -20261019: initial code
+    -20261019: precipitation messages classified by accumulation length
+    -20261019: products written by a module-level function, without pickling the accumulators of all leads
+'''
+import os
+import glob
+import json
+import time
+import argparse
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+import numpy as np
+import xarray as xr
+import pygrib
+
+from utils.nc2grib import Netcdf2Grib
+
+# (shortName, typeOfLevel) of pmlgefs grib2 messages -> GraphCast variable names
+GRIB_VARIABLES = {
+    ('gh', 'isobaricInhPa'): 'geopotential',
+    ('t', 'isobaricInhPa'): 'temperature',
+    ('q', 'isobaricInhPa'): 'specific_humidity',
+    ('w', 'isobaricInhPa'): 'vertical_velocity',
+    ('u', 'isobaricInhPa'): 'u_component_of_wind',
+    ('v', 'isobaricInhPa'): 'v_component_of_wind',
+    ('2t', 'heightAboveGround'): '2m_temperature',
+    ('10u', 'heightAboveGround'): '10m_u_component_of_wind',
+    ('10v', 'heightAboveGround'): '10m_v_component_of_wind',
+    ('prmsl', 'meanSea'): 'mean_sea_level_pressure',
+}
+
+
+class WelfordAccumulator:
+    """Running count, mean, M2 and threshold exceedance counts of one lead time."""
+
+    def __init__(self, thresholds=None):
+        self.thresholds = thresholds or {}
+        self.count = 0
+        self.mean = None
+        self.m2 = None
+        self.exceed = None
+
+    def update(self, ds):
+        """Add one member (xarray dataset without time dimension)."""
+        ds = ds.astype('float32')
+        self.count += 1
+        if self.mean is None:
+            self.mean = ds
+            self.m2 = xr.zeros_like(ds)
+            self.exceed = {var: [(ds[var] > thr).astype('int32') for thr in thrs]
+                           for var, thrs in self.thresholds.items() if var in ds}
+            return
+
+        delta = ds - self.mean
+        self.mean = self.mean + delta / self.count
+        self.m2 = self.m2 + delta * (ds - self.mean)
+        for var, counts in self.exceed.items():
+            for i, thr in enumerate(self.thresholds[var]):
+                counts[i] = counts[i] + (ds[var] > thr)
+
+    def merge(self, other):
+        """Combine with another accumulator of the same lead (Chan et al.)."""
+        if other.count == 0:
+            return self
+        if self.count == 0:
+            self.count, self.mean, self.m2, self.exceed = other.count, other.mean, other.m2, other.exceed
+            return self
+
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean = self.mean + delta * (other.count / count)
+        self.m2 = self.m2 + other.m2 + delta ** 2 * (self.count * other.count / count)
+        for var, counts in self.exceed.items():
+            for i in range(len(counts)):
+                counts[i] = counts[i] + other.exceed[var][i]
+        self.count = count
+        return self
+
+    def spread(self):
+        """Ensemble standard deviation (n-1 normalized)."""
+        if self.count < 2:
+            return xr.zeros_like(self.mean)
+        return np.sqrt(self.m2 / (self.count - 1))
+
+    def probabilities(self):
+        probs = xr.Dataset()
+        for var, counts in self.exceed.items():
+            thrs = self.thresholds[var]
+            da = xr.concat([c / self.count for c in counts], dim=xr.DataArray(thrs, dims='threshold', name='threshold'))
+            probs[f'{var}_exceedance_probability'] = da.astype('float32')
+        return probs
+
+
+class EnsembleStatistics:
+    def __init__(self, forecast_datetime, forecast_length, output_dir, thresholds=None, num_workers=8, packing='simple', precision=None):
+        """
+            Args:
+              forecast_datetime: datetime of the cycle (t0)
+              forecast_length: number of 6-hourly steps
+              output_dir: directory to write the products
+              thresholds: dict of {variable: [thresholds]} in model units (e.g. m for precipitation)
+              num_workers: number of lead times processed in parallel
+        """
+        self.forecast_datetime = forecast_datetime
+        self.forecast_length = forecast_length
+        self.output_dir = output_dir
+        self.thresholds = thresholds or {}
+        self.num_workers = num_workers
+        self.packing = packing
+        self.precision = precision
+        self.leads = [6 * step for step in range(forecast_length + 1)]
+        # Only used for in-memory members, grib2 members are accumulated one lead per worker
+        self.accumulators = {lead: WelfordAccumulator(self.thresholds) for lead in self.leads}
+        self.members = []
+        os.makedirs(self.output_dir, exist_ok=True)
+
+    def add_member(self, forecasts, member=None):
+        """
+        Accumulate an in-memory forecast dataset (output of rollout.chunked_prediction).
+        Leads are updated in parallel; the dataset can be dropped afterwards.
+        """
+        forecasts = forecasts.squeeze('batch', drop=True) if 'batch' in forecasts.dims else forecasts
+        if 'total_precipitation_6hr' in forecasts:
+            forecasts = forecasts.assign(total_precipitation_cumsum=forecasts['total_precipitation_6hr'].clip(min=0).cumsum('time'))
+
+        def update(step):
+            lead = int(forecasts['time'][step].values / np.timedelta64(1, 'h'))
+            if lead in self.accumulators:
+                self.accumulators[lead].update(forecasts.isel(time=step, drop=True).drop_vars('datetime', errors='ignore'))
+
+        with ThreadPoolExecutor(max_workers=self.num_workers) as executor:
+            list(executor.map(update, range(forecasts.sizes['time'])))
+
+        self.members.append(member)
+
+    def grib_file(self, member_dir, member, lead):
+        return os.path.join(member_dir, f'pmlgefs{member}.t{self.forecast_datetime.hour:02d}z.pgrb2.0p25.f{lead:03d}')
+
+    def process_grib_lead(self, lead, member_dirs, timeout=3600, poll_interval=30):
+        """
+        Accumulate one lead time over all members as their grib2 files appear and write
+        its products. A member's lead file is complete once its index file exists
+        (save_grib2 writes the .idx after closing each grib2 file).
+        """
+        acc = WelfordAccumulator(self.thresholds)
+        pending = dict(member_dirs)
+        members = []
+        start = time.time()
+        while pending:
+            for member, member_dir in list(pending.items()):
+                grib_file = self.grib_file(member_dir, member, lead)
+                if os.path.exists(grib_file + '.idx'):
+                    acc.update(read_grib_lead(grib_file))
+                    members.append(member)
+                    del pending[member]
+
+            if pending:
+                if time.time() - start > timeout:
+                    print(f'f{lead:03d}: timed out waiting for members {sorted(pending)}')
+                    break
+                time.sleep(poll_interval)
+
+        if acc.count > 0:
+            self.members = members
+            write_lead(lead, acc.mean, acc.spread(), acc.probabilities(), self.forecast_datetime, self.packing, self.precision,
+                       self.output_dir, len(members))
+        print(f'f{lead:03d}: ensemble products written from {acc.count} members')
+
+        return lead, acc.count
+
+    def run_grib(self, member_dirs, timeout=3600, poll_interval=30):
+        """Stream members from grib2 files, parallel over leads; each worker holds one lead."""
+        with ProcessPoolExecutor(max_workers=self.num_workers) as executor:
+            futures = [executor.submit(self.process_grib_lead, lead, member_dirs, timeout, poll_interval) for lead in self.leads]
+            return dict(future.result() for future in futures)
+
+    def write_products(self):
+        """Write products of the in-memory accumulators, parallel over leads."""
+        print(f'Writing ensemble products from {len(self.members)} members to {self.output_dir}')
+        # Only the lead's statistics are sent to a worker, not the accumulators of every lead
+        with ProcessPoolExecutor(max_workers=self.num_workers) as executor:
+            futures = [executor.submit(write_lead, lead, acc.mean, acc.spread(), acc.probabilities(), self.forecast_datetime,
+                                       self.packing, self.precision, self.output_dir, len(self.members))
+                       for lead, acc in self.accumulators.items() if acc.count > 0]
+            for future in futures:
+                future.result()
+
+
+def write_lead(lead, mean, spread, probs, forecast_datetime, packing, precision, output_dir, n_members):
+    """Write the mean and spread grib2 files and the probabilities of one lead."""
+    dates = [[forecast_datetime - timedelta(hours=6), forecast_datetime]]
+    converter = Netcdf2Grib(packing=packing, precision=precision)
+    for product, ds in [('avg', mean), ('spr', spread)]:
+        ds = ds.astype('float32').expand_dims(time=[np.timedelta64(lead, 'h').astype('timedelta64[ns]')])
+        ds['time'].encoding['units'] = 'hours'
+        converter.save_grib2(dates, ds, product, output_dir)
+
+    if probs.data_vars:
+        probs = probs.assign_coords(time=forecast_datetime + timedelta(hours=lead))
+        probs.attrs['members'] = n_members
+        probs.to_netcdf(os.path.join(output_dir, f'pmlgefsprob.t{forecast_datetime.hour:02d}z.0p25.f{lead:03d}.nc'))
+
+
+def read_grib_lead(grib_file):
+    """
+    Read a pmlgefs grib2 file back into a dataset in GraphCast units and orientation
+    (geopotential in m2/s2, precipitation in m, ascending latitude).
+    """
+    data_vars = {}
+    levels = {}
+    with pygrib.open(grib_file) as grbs:
+        for grb in grbs:
+            if grb.shortName == 'tp':
+                # The 6 h accumulation is written before the accumulation from the forecast start, at f006
+                # both span 0-6 h and only their order tells them apart
+                if grb.endStep - grb.startStep == 6 and 'total_precipitation_6hr' not in data_vars:
+                    var_name = 'total_precipitation_6hr'
+                else:
+                    var_name = 'total_precipitation_cumsum'
+                values = grb.values / 1000
+            else:
+                var_name = GRIB_VARIABLES.get((grb.shortName, grb.typeOfLevel))
+                if var_name is None:
+                    continue
+                values = grb.values * 9.80665 if var_name == 'geopotential' else grb.values
+
+            if 'lat' not in levels:
+                lats, lons = grb.latlons()
+                levels['lat'], levels['lon'] = lats[:, 0], lons[0, :]
+
+            if grb.typeOfLevel == 'isobaricInhPa':
+                data_vars.setdefault(var_name, {})[grb.level] = values
+            else:
+                data_vars[var_name] = values
+
+    lat, lon = levels['lat'], levels['lon']
+    ds = xr.Dataset(coords={'lat': lat.astype('float32'), 'lon': lon.astype('float32')})
+    for var_name, values in data_vars.items():
+        if isinstance(values, dict):
+            plevels = sorted(values)
+            ds[var_name] = xr.DataArray(np.stack([values[p] for p in plevels]), dims=['level', 'lat', 'lon'],
+                                        coords={'level': np.array(plevels, dtype='int32')})
+        else:
+            ds[var_name] = (['lat', 'lon'], values)
+
+    return ds.sortby('lat')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate ensemble mean, spread and probability products")
+    parser.add_argument("datetime", help="forecast cycle in the format 'YYYYMMDDHH'")
+    parser.add_argument("-i", "--input", help="directory with forecasts_<levels>_levels_<member>_model_<id> folders", required=True)
+    parser.add_argument("-o", "--output", help="output directory for the products", default=None)
+    parser.add_argument("-l", "--length", help="length of forecast (6-hourly steps)", default=64)
+    parser.add_argument("-p", "--pressure", help="number of pressure levels", default=13)
+    parser.add_argument("-t", "--thresholds", help="json file with exceedance thresholds per variable, in model units", default=None)
+    parser.add_argument("-n", "--workers", help="number of lead times processed in parallel", default=8)
+    parser.add_argument("--timeout", help="seconds to wait for unfinished members", default=3600)
+
+    args = parser.parse_args()
+
+    forecast_datetime = datetime.strptime(args.datetime, "%Y%m%d%H")
+    output_dir = args.output if args.output is not None else os.path.join(args.input, 'ensemble_products')
+
+    thresholds = None
+    if args.thresholds is not None:
+        with open(args.thresholds, 'r') as file:
+            thresholds = json.load(file)
+
+    member_dirs = {}
+    for member_dir in sorted(glob.glob(os.path.join(args.input, f'forecasts_{args.pressure}_levels_*_model_*'))):
+        member = os.path.basename(member_dir).split('_')[3]
+        member_dirs[member] = member_dir
+
+    stats = EnsembleStatistics(forecast_datetime, int(args.length), output_dir, thresholds, int(args.workers))
+    stats.run_grib(member_dirs, timeout=int(args.timeout))
@@ -3,6 +3,10 @@ Description: This script gets ensemble GEFS members for GraphCast initialization
 @uthor: Sadegh Sadeghi Tabas (sadegh.tabas@noaa.gov)
 Revision history: Sadegh Tabas, initial code
                   4/29/2025, Linlin Cui, enable two AWS buckets, the input files are on noaa-ncepdev-none-ca-ufs-cpldcld
+                  10/19/2026, skip IC generation if a previous run's IC is recorded in the stage manifest
+                  10/19/2026, range mode: one IC per cycle, each analysis time downloaded and decoded once
+                  10/19/2026, paginated listing of each cycle prefix, cached on disk and shared by the members
+                  10/19/2026, bucket, prefix and file formats at module level, shared with the input watcher
 
 '''
 import os
@@ -10,7 +14,10 @@ import sys
 from time import time
 import glob
 import argparse
+import shutil
 import subprocess
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
 import re
 import boto3
@@ -22,6 +29,19 @@ import pygrib
 import requests
 from bs4 import BeautifulSoup
 
+from utils.manifest import StageManifest
+from utils.s3_listing import S3ListingIndex
+
+# Source of the GEFS files, a cycle's files are under S3_PREFIX.format(root=ROOT_DIRECTORY, date='YYYYMMDD', hour='HH')
+BUCKET_NAME = 'noaa-ncepdev-none-ca-ufs-cpldcld'
+ROOT_DIRECTORY = 'gefs'
+S3_PREFIX = 'Linlin.Cui/gefs_wcoss2/{root}.{date}/{hour}/atmos/'
+# Files of each member and analysis time (ge<member>.tHHz.<format>) per number of pressure levels
+FILE_FORMATS = {
+    13: ['pgrb2.0p25.f000', 'pgrb2s.0p25.f000'],
+    37: ['pgrb2.0p25.f000', 'pgrb2b.0p25.f000', 'pgrb2.0p25.f006'],
+}
+
 
 class GFSDataProcessor:
     def __init__(self, start_datetime, end_datetime, member, num_pressure_levels=13, output_directory=None, download_directory=None, keep_downloaded_data=True, aws=None):
@@ -44,9 +64,13 @@ class GFSDataProcessor:
         )
     
         # Specify the S3 bucket name and root directory
-        self.bucket_name = 'noaa-ncepdev-none-ca-ufs-cpldcld'
+        self.bucket_name = BUCKET_NAME
         
-        self.root_directory = 'gefs'
+        self.root_directory = ROOT_DIRECTORY
+
+        # Listings of the cycle prefixes, cached next to the download directories of all members
+        self.listings = {}
+        self.listing_cache = os.path.join(self.download_directory or os.getcwd(), 's3_listings')
 
         # Specify the local directory where you want to save the files
         if self.download_directory is None:
@@ -55,28 +79,29 @@ class GFSDataProcessor:
             self.local_base_directory = os.path.join(self.download_directory, self.bucket_name+'_'+str(self.num_levels)+'_'+str(self.member))
 
         # List of file formats to download
-        if self.num_levels == 13:     
-            self.file_formats = ['pgrb2.0p25.f000', 'pgrb2s.0p25.f000'] # , '0p25.f001'
-        else:
-            self.file_formats = ['pgrb2.0p25.f000', 'pgrb2b.0p25.f000', 'pgrb2.0p25.f006'] # , '0p25.f001'
+        self.file_formats = FILE_FORMATS[13] if self.num_levels == 13 else FILE_FORMATS[37]
     
     def s3bucket(self, date_str, time_str, local_directory):
         # Construct the S3 prefix for the directory
-        s3_prefix = f"Linlin.Cui/gefs_wcoss2/{self.root_directory}.{date_str}/{time_str}/atmos/"
+        s3_prefix = S3_PREFIX.format(root=self.root_directory, date=date_str, hour=time_str)
+
+        # The prefix is listed once per cycle, by one of the member processes
+        if s3_prefix not in self.listings:
+            self.listings[s3_prefix] = S3ListingIndex(self.s3, self.bucket_name, s3_prefix, self.listing_cache)
+        listing = self.listings[s3_prefix]
 
         def get_data(s3_prefix, file_format, local_directory):
-            # List objects in the S3 directory
-            s3_objects = self.s3.list_objects_v2(Bucket=self.bucket_name, Prefix=s3_prefix)
-            for obj in s3_objects.get('Contents', []):
-                obj_key = obj['Key']
-                if obj_key.endswith(f'{file_format}'):
+            obj_key = listing.get(file_format)
+            if obj_key is None:
+                print(f"{file_format} not found under s3://{self.bucket_name}/{s3_prefix}")
+                return
 
-                    # Define the local file path
-                    local_file_path = os.path.join(local_directory, os.path.basename(obj_key))
+            # Define the local file path
+            local_file_path = os.path.join(local_directory, os.path.basename(obj_key))
 
-                    # Download the file from S3 to the local path
-                    self.s3.download_file(self.bucket_name, obj_key, local_file_path)
-                    print(f"Downloaded {obj_key} to {local_file_path}")
+            # Download the file from S3 to the local path
+            self.s3.download_file(self.bucket_name, obj_key, local_file_path)
+            print(f"Downloaded {obj_key} to {local_file_path}")
 
                  
         for file_format in self.file_formats:
@@ -110,10 +135,8 @@ class GFSDataProcessor:
 
         print("Download completed.")
 
-    def process_data_with_wgrib2(self):
-        # Define the directory where your GRIB2 files are located
-        data_directory = self.local_base_directory
-
+    def wgrib2_variables(self):
+        """Variables and levels extracted with wgrib2 from each file of an analysis time."""
         # Create a dictionary to specify the variables, levels, and whether to extract only the first time step (if needed)
         variables_to_extract = {
             '.pgrb2s.0p25.f000': {
@@ -146,75 +169,69 @@ class GFSDataProcessor:
             variables_to_extract['.pgrb2b.0p25.f000'] = {}
             variables_to_extract['.pgrb2b.0p25.f000'][':SPFH|VVEL|VGRD|UGRD|HGT|TMP:'] = {}
             variables_to_extract['.pgrb2b.0p25.f000'][':SPFH|VVEL|VGRD|UGRD|HGT|TMP:']['levels'] = [':(125|175|225|775|825|875) mb:']
-       
-        # Create an empty list to store the extracted datasets
+
+        return variables_to_extract
+
+    def decode_time_with_wgrib2(self, date_folder, hour, statics=True):
+        """
+        Extract the variables of one analysis time (download folder <date>/<hour>) with wgrib2.
+            Args:
+              statics: also extract the static fields (orography, land-sea mask), only needed from the first time of an IC
+            Returns:
+              (list of datasets, list of intermediate netcdf files)
+        """
+        subfolder_path = os.path.join(self.local_base_directory, date_folder, hour)
+        intermediate_directory = self.download_directory or self.local_base_directory
         extracted_datasets = []
         files = []
-        print("Start extracting variables and associated levels from grib2 files:")
-        # Loop through each folder (e.g., gdas.yyyymmdd)
-        date_folders = sorted(next(os.walk(data_directory))[1])
-        for date_folder in date_folders:
-            date_folder_path = os.path.join(data_directory, date_folder)
+        for file_extension, variable_data in self.wgrib2_variables().items():
+            for variable, data in variable_data.items():
+                levels = data['levels']
+                first_time_step_only = data.get('first_time_step_only', False)  # Default to False if not specified
+                if first_time_step_only and not statics:
+                    continue
+
+                pattern = os.path.join(subfolder_path, f'ge{self.member}.t*z{file_extension}')
+                # Use glob to search for files matching the pattern
+                matching_files = glob.glob(pattern)
+                
+                # Check if there's exactly one matching file
+                if len(matching_files) == 1:
+                    grib2_file = matching_files[0]
+                    print("Found file:", grib2_file)
+                else:
+                    print("Error: Found multiple or no matching files.")
+                    
+                # Extract the specified variables with levels from the GRIB2 file
+                for level in levels:
+                    output_file = os.path.join(intermediate_directory, f'{variable}_{level}_{date_folder}_{hour}{file_extension}_{self.num_levels}_{self.member}.nc')
+                    files.append(output_file)
+                    
+                    # Extracting levels using regular expression
+                    matches = re.findall(r'\d+', level)
+                    
+                    # Convert the extracted matches to integers
+                    curr_levels = [int(match) for match in matches]
+                    
+                    # Get the number of levels
+                    number_of_levels = len(curr_levels)
+                    
+                    # Use wgrib2 to extract the variable with level
+                    wgrib2_command = ['wgrib2', '-nc_nlev', f'{number_of_levels}', grib2_file, '-match', f'{variable}', '-match', f'{level}', '-netcdf', output_file]
+                    subprocess.run(wgrib2_command, check=True)
 
-            # Loop through each hour (e.g., '00', '06', '12', '18')
-            for hour in ['00', '06', '12', '18']:
-                subfolder_path = os.path.join(date_folder_path, hour)
+                    # Open the extracted netcdf file as an xarray dataset
+                    ds = xr.open_dataset(output_file)
 
-                # Check if the subfolder exists before processing
-                if os.path.exists(subfolder_path):
-                    # Loop through each GRIB2 file (.f000, .f001, .f006)
-                    for file_extension, variable_data in variables_to_extract.items():
-                        for variable, data in variable_data.items():
-                            levels = data['levels']
-                            first_time_step_only = data.get('first_time_step_only', False)  # Default to False if not specified
-
-                            pattern = os.path.join(subfolder_path, f'ge{self.member}.t*z{file_extension}')
-                            # Use glob to search for files matching the pattern
-                            matching_files = glob.glob(pattern)
-                            
-                            # Check if there's exactly one matching file
-                            if len(matching_files) == 1:
-                                grib2_file = matching_files[0]
-                                print("Found file:", grib2_file)
-                            else:
-                                print("Error: Found multiple or no matching files.")
-                                
-                            # Extract the specified variables with levels from the GRIB2 file
-                            for level in levels:
-                                output_file = os.path.join(self.download_directory,f'{variable}_{level}_{date_folder}_{hour}{file_extension}_{self.num_levels}_{self.member}.nc')
-                                files.append(output_file)
-                                
-                                # Extracting levels using regular expression
-                                matches = re.findall(r'\d+', level)
-                                
-                                # Convert the extracted matches to integers
-                                curr_levels = [int(match) for match in matches]
-                                
-                                # Get the number of levels
-                                number_of_levels = len(curr_levels)
-                                
-                                # Use wgrib2 to extract the variable with level
-                                wgrib2_command = ['wgrib2', '-nc_nlev', f'{number_of_levels}', grib2_file, '-match', f'{variable}', '-match', f'{level}', '-netcdf', output_file]
-                                subprocess.run(wgrib2_command, check=True)
-
-                                # Open the extracted netcdf file as an xarray dataset
-                                ds = xr.open_dataset(output_file)
-
-                                # if variable == '^(597):':
-                                #    ds['time'] = ds['time'] - np.timedelta64(6, 'h')
-
-                                # If specified, extract only the first time step
-                                if variable not in [':LAND:', ':HGT:']:
-                                    extracted_datasets.append(ds)
-                                else:
-                                    if first_time_step_only:
-                                        # Append the dataset to the list
-                                        ds = ds.isel(time=0)
-                                        extracted_datasets.append(ds)
-                                        variables_to_extract[file_extension][variable]['first_time_step_only'] = False
-                                
-                                # Optionally, remove the intermediate GRIB2 file
-                                # os.remove(output_file)
+                    # Static fields are taken from the first time step only
+                    if first_time_step_only:
+                        ds = ds.isel(time=0)
+                    extracted_datasets.append(ds)
+
+        return extracted_datasets, files
+
+    def merge_extracted(self, extracted_datasets):
+        """Merge the datasets extracted from the analysis times of an IC into the GraphCast input layout."""
         print("Merging grib2 files:")
         ds = xr.merge(extracted_datasets)
         
@@ -277,18 +294,47 @@ class GFSDataProcessor:
 
         # Add the zeros array as a new variable in the dataset
         ds['total_precipitation_6hr'] = (other_dims, zeros_array)
-        
-        # Define the output NetCDF file
-        date = (self.start_datetime + timedelta(hours=6)).strftime('%Y%m%d%H')
+
+        return ds
+
+    def save_ic(self, ds, date):
+        """Save an IC dataset, named after its forecast start date 'YYYYMMDDHH'."""
         steps = str(len(ds['time']))
 
         if self.output_directory is None:
             self.output_directory = os.getcwd()  # Use current directory if not specified
         output_netcdf = os.path.join(self.output_directory, f"source-ge{self.member}_date-{date}_res-0.25_levels-{self.num_levels}_steps-{steps}.nc")
 
-        # Save the merged dataset as a NetCDF file
-        ds.to_netcdf(output_netcdf)
+        # Write to a temporary file and rename, so a reader never sees a partial IC
+        tmp_file = f'{output_netcdf}.tmp'
+        ds.to_netcdf(tmp_file)
+        os.replace(tmp_file, output_netcdf)
         print(f"Saved output to {output_netcdf}")
+        return output_netcdf
+
+    def process_data_with_wgrib2(self):
+        # Create an empty list to store the extracted datasets
+        extracted_datasets = []
+        files = []
+        print("Start extracting variables and associated levels from grib2 files:")
+        # Loop through each folder (e.g., gdas.yyyymmdd)
+        date_folders = sorted(next(os.walk(self.local_base_directory))[1])
+        statics = True
+        for date_folder in date_folders:
+            # Loop through each hour (e.g., '00', '06', '12', '18')
+            for hour in ['00', '06', '12', '18']:
+                # Check if the subfolder exists before processing
+                if os.path.exists(os.path.join(self.local_base_directory, date_folder, hour)):
+                    datasets, time_files = self.decode_time_with_wgrib2(date_folder, hour, statics)
+                    extracted_datasets.extend(datasets)
+                    files.extend(time_files)
+                    statics = False
+
+        ds = self.merge_extracted(extracted_datasets)
+        
+        # Define the output NetCDF file
+        date = (self.start_datetime + timedelta(hours=6)).strftime('%Y%m%d%H')
+        output_netcdf = self.save_ic(ds, date)
         for file in files:
             os.remove(file)
             
@@ -298,6 +344,8 @@ class GFSDataProcessor:
 
         print(f"Process completed successfully, your inputs for GraphCast model generated at:\n {output_netcdf}")
 
+        return output_netcdf
+
     def process_data_with_pygrib(self):
         # Define the directory where your GRIB2 files are located
         data_directory = self.local_base_directory
@@ -465,6 +513,8 @@ class GFSDataProcessor:
             self.remove_downloaded_data()
 
         print(f"Process completed successfully, your inputs for GraphCast model generated at:\n {output_netcdf}")
+
+        return output_netcdf
             
     def remove_downloaded_data(self):
         # Remove downloaded data from the specified directory
@@ -533,6 +583,87 @@ class GFSDataProcessor:
     
         return da
 
+# Processor of a range mode worker process, created once per worker
+_range_processor = None
+
+
+def _init_range_worker(member, num_pressure_levels, download_directory, keep_downloaded_data):
+    global _range_processor
+    _range_processor = GFSDataProcessor(None, None, member, num_pressure_levels, None, download_directory, keep_downloaded_data)
+
+
+def _decode_analysis_time(analysis_time):
+    """Download and decode one analysis time in a worker, returns (analysis time, loaded datasets)."""
+    processor = _range_processor
+    date_str, time_str = analysis_time.strftime("%Y%m%d"), analysis_time.strftime("%H")
+    local_directory = os.path.join(processor.local_base_directory, date_str, time_str)
+    os.makedirs(local_directory, exist_ok=True)
+    processor.s3bucket(date_str, time_str, local_directory)
+
+    datasets, files = processor.decode_time_with_wgrib2(date_str, time_str, statics=True)
+    datasets = [ds.load() for ds in datasets]
+    for file in files:
+        os.remove(file)
+    if not processor.keep_downloaded_data:
+        shutil.rmtree(local_directory, ignore_errors=True)
+    return analysis_time, datasets
+
+
+def generate_ic_range(first_cycle, last_cycle, member, num_pressure_levels=13, output_directory=None, download_directory=None,
+                      keep_downloaded_data=False, num_workers=4, resume=True):
+    """
+    Generate one IC per 6-hourly cycle from first_cycle to last_cycle (forecast start times), e.g. for hindcasts.
+    The IC of cycle t holds the analyses at t-6h and t, so consecutive ICs share an analysis time: every
+    analysis time is downloaded and decoded once, by a pool of worker processes, and consumed in order
+    through a two-time sliding window. Each IC is written as soon as its window is complete.
+        Args:
+          resume: skip the cycles whose IC is recorded in their stage manifest (and the analyses only they need)
+        Returns:
+          list of the IC files written
+    """
+    output_directory = output_directory or os.getcwd()
+    cycles = []
+    cycle = first_cycle
+    while cycle <= last_cycle:
+        cycles.append(cycle)
+        cycle += timedelta(hours=6)
+
+    manifests = {cycle: StageManifest(output_directory, cycle.strftime("%Y%m%d%H"), member) for cycle in cycles}
+    todo = [cycle for cycle in cycles if not (resume and manifests[cycle].is_done('ic'))]
+    if len(todo) < len(cycles):
+        print(f"{len(cycles) - len(todo)} of {len(cycles)} ICs were generated by a previous run, skipping them.")
+    analysis_times = sorted({t for cycle in todo for t in (cycle - timedelta(hours=6), cycle)})
+    print(f"Generating {len(todo)} ICs from {len(analysis_times)} analysis times with {num_workers} workers")
+
+    writer = GFSDataProcessor(None, None, member, num_pressure_levels, output_directory, download_directory, keep_downloaded_data)
+    todo = set(todo)
+    written = []
+    start = time()
+    previous = None
+    with ProcessPoolExecutor(max_workers=num_workers, initializer=_init_range_worker,
+                             initargs=(member, num_pressure_levels, download_directory, keep_downloaded_data)) as executor:
+        # At most num_workers analysis times are decoded ahead of the window
+        remaining = iter(analysis_times)
+        pending = deque(executor.submit(_decode_analysis_time, t) for t in [next(remaining) for _ in range(min(num_workers, len(analysis_times)))])
+        while pending:
+            analysis_time, datasets = pending.popleft().result()
+            next_time = next(remaining, None)
+            if next_time is not None:
+                pending.append(executor.submit(_decode_analysis_time, next_time))
+
+            if previous is not None and analysis_time in todo and analysis_time - previous[0] == timedelta(hours=6):
+                # Time-varying fields of both times, static fields of the first one
+                current = [ds for ds in datasets if 'time' in ds.dims]
+                ds = writer.merge_extracted(previous[1] + current)
+                output_netcdf = writer.save_ic(ds, analysis_time.strftime('%Y%m%d%H'))
+                manifests[analysis_time].mark_done('ic', [output_netcdf])
+                written.append(output_netcdf)
+                print(f"[{len(written)}/{len(todo)}] ICs written, {time() - start:.1f} s")
+            previous = (analysis_time, datasets)
+
+    return written
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Download and process GEFS data")
     parser.add_argument("start_datetime", help="Start datetime in the format 'YYYYMMDDHH'")
@@ -543,6 +674,9 @@ if __name__ == "__main__":
     parser.add_argument("-o", "--output", help="Output directory for processed data")
     parser.add_argument("-d", "--download", help="Download directory for raw data")
     parser.add_argument("-k", "--keep", help="Keep downloaded data (yes or no)", default="no")
+    parser.add_argument("-r", "--resume", help="skip if the IC of a previous run is recorded in the manifest and unchanged (yes or no)", default="yes")
+    parser.add_argument("--range", help="write one IC per cycle from start_datetime to end_datetime (forecast start times), wgrib2 only (yes or no)", default="no")
+    parser.add_argument("-n", "--num-workers", help="analysis times decoded in parallel in range mode", default=4)
 
     args = parser.parse_args()
 
@@ -554,13 +688,30 @@ if __name__ == "__main__":
     output_directory = args.output
     download_directory = args.download
     keep_downloaded_data = args.keep.lower() == "yes"
+
+    if args.range.lower() == "yes":
+        if method != "wgrib2":
+            raise NotImplementedError(f"Method {method} is not supported in range mode!")
+        generate_ic_range(start_datetime, end_datetime, member, num_pressure_levels, output_directory, download_directory,
+                          keep_downloaded_data, int(args.num_workers), args.resume.lower() == "yes")
+        sys.exit(0)
     
+    manifest = None
+    if args.resume.lower() == "yes":
+        manifest = StageManifest(output_directory or os.getcwd(), end_datetime.strftime("%Y%m%d%H"), member)
+        if manifest.is_done('ic'):
+            print(f"IC for {member} at {args.end_datetime} was generated by a previous run, skipping.")
+            sys.exit(0)
+
     data_processor = GFSDataProcessor(start_datetime, end_datetime, member, num_pressure_levels, output_directory, download_directory, keep_downloaded_data)
     data_processor.download_data()
     
     if method == "wgrib2":
-      data_processor.process_data_with_wgrib2()
+      output_netcdf = data_processor.process_data_with_wgrib2()
     elif method == "pygrib":
-      data_processor.process_data_with_pygrib()
+      output_netcdf = data_processor.process_data_with_pygrib()
     else:
       raise NotImplementedError(f"Method {method} is not supported!")
+
+    if manifest is not None:
+        manifest.mark_done('ic', [output_netcdf])
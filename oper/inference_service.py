@@ -0,0 +1,204 @@
+'''
+Description: Warm GraphCast inference service. Every run_graphcast_ens.py launch pays the interpreter start-up,
+             the jax/haiku/iris/boto3 imports, the checkpoint and statistics loading and the jit compilation.
+             The service pays them once: it keeps the model configs, the normalization statistics, the
+             jitted forward function (params are passed as arguments, so members share the compilation) and
+             the params of recently used members, and serves forecast jobs queued in a spool directory by
+             forecast_client.py, one at a time, so a member costs essentially its rollout and encoding:
+                 python inference_service.py -w /path/to/gc_weights -s /lustre/mlgefs_spool \
+                     --warmup-input source-gec00_date-2025010100_res-0.25_levels-13_steps-2.nc --warmup-config c00.pkl
+             Everything is local files, so the service and its clients can be tested on one machine.
+             A job left in running/ by a killed service is not retried, submit it again.
+Revision history:
+    -20261019: initial code
+'''
+import os
+import re
+import sys
+import glob
+import json
+import time
+import signal
+import argparse
+import tempfile
+import traceback
+from collections import OrderedDict
+
+from run_graphcast_ens import GraphCastModel
+from utils.profiling import Profiler
+from forecast_client import QUEUE, RUNNING, DONE, FAILED, spool_dirs, write_json
+
+
+class InferenceService:
+    def __init__(self, weights, spool, num_pressure_levels=13, poll_interval=1.0, params_cache_size=32):
+        """
+            Args:
+              weights: parent directory of the graphcast params and stats
+              spool: spool directory of the jobs (see forecast_client.py)
+              poll_interval: seconds between checks of an empty queue
+              params_cache_size: number of member params kept in memory
+        """
+        self.weights = weights
+        self.spool = spool
+        self.num_pressure_levels = num_pressure_levels
+        self.poll_interval = poll_interval
+        self.params_cache_size = params_cache_size
+        spool_dirs(spool)
+
+        # Loaded by the first job, shared by all later ones
+        self.model_config = None
+        self.task_config = None
+        self.stats = None
+        self.forward_apply = None
+        self.params = OrderedDict()
+        self.stopping = False
+        self.jobs_done = 0
+
+    def claim(self):
+        """Move the oldest queued job to running/, returns (job id, job) or None if the queue is empty."""
+        for path in sorted(glob.glob(os.path.join(self.spool, QUEUE, '*.json'))):
+            job_id = os.path.basename(path)[:-len('.json')]
+            running = os.path.join(self.spool, RUNNING, f'{job_id}.json')
+            try:
+                # Atomic, so a job is claimed by one service only
+                os.rename(path, running)
+            except FileNotFoundError:
+                continue
+            with open(running, 'r') as f:
+                return job_id, json.load(f)
+        return None
+
+    def member_params(self, runner):
+        """Params of the member's weight file, from the cache if they were used recently."""
+        key = os.path.abspath(runner.config_file_path)
+        if key in self.params:
+            self.params.move_to_end(key)
+        else:
+            runner.load_params()
+            self.params[key] = runner.params
+            if len(self.params) > self.params_cache_size:
+                self.params.popitem(last=False)
+        return self.params[key]
+
+    def make_runner(self, job):
+        grib_precision = None
+        if job.get('precision') is not None:
+            with open(job['precision'], 'r') as f:
+                grib_precision = json.load(f)
+        return GraphCastModel(self.weights, job['input'], job['member'], job['config'], job.get('output'), self.num_pressure_levels,
+                              int(job['length']), job.get('packing', 'simple'), grib_precision, job.get('publish'), job.get('profile'),
+                              job.get('resume', True), async_transfer=job.get('async_transfer', False),
+                              transfer_dtype=job.get('transfer_dtype', 'float32'), products=job.get('products'))
+
+    def run_job(self, job):
+        """
+        Run one forecast job, with the keys
+            input, member, config, length (required), output, packing, precision (json file), publish, profile,
+            products (list), upload, keep, resume, async_transfer, transfer_dtype
+            Returns:
+              result dict: output directory and timings
+        """
+        start = time.time()
+        runner = self.make_runner(job)
+        runner.profiler = Profiler(True, job['member'], runner.cycle)
+        result = {'output_dir': runner.output_dir, 'skipped': False}
+
+        if runner.forecast_complete():
+            print(f"All {runner.forecast_length} steps were completed by a previous run, skipping the forecast.")
+            result['skipped'] = True
+        else:
+            if self.model_config is None:
+                runner.load_pretrained_model()
+                runner.load_normalization_stats()
+                self.model_config, self.task_config = runner.model_config, runner.task_config
+                self.stats = (runner.diffs_stddev_by_level, runner.mean_by_level, runner.stddev_by_level)
+            else:
+                runner.model_config, runner.task_config = self.model_config, self.task_config
+                runner.diffs_stddev_by_level, runner.mean_by_level, runner.stddev_by_level = self.stats
+            runner.params = self.member_params(runner)
+            runner.forward_apply = self.forward_apply
+
+            runner.load_gdas_data()
+            runner.extract_inputs_targets_forcings()
+            runner.get_predictions()
+            # Compiled by the first rollout, kept warm for the next jobs
+            self.forward_apply = runner.forward_apply
+
+        if job.get('upload', False):
+            with runner.profiler.timer('upload'):
+                runner.upload_to_s3(job.get('keep', False))
+
+        summary = runner.profiler.summary()
+        result.update({
+            'seconds': time.time() - start,
+            'queued_seconds': start - job.get('submitted', start),
+            'phases': summary['phases'],
+            'compile_seconds': summary['compile_seconds'],
+            'median_step_seconds': summary['median_step_seconds'],
+            'num_steps': summary['num_steps'],
+        })
+        return result
+
+    def warmup(self, ic_file, config_file):
+        """Load everything and compile with a one-step forecast of an IC, written to a temporary directory."""
+        print(f"Warming up with {ic_file}")
+        with tempfile.TemporaryDirectory() as tmpdir:
+            match = re.search(r"source-ge(\w+?)_date", os.path.basename(ic_file))
+            member = match.group(1) if match else 'c00'
+            result = self.run_job({'input': ic_file, 'member': member, 'config': config_file, 'length': 1, 'output': tmpdir, 'resume': False})
+        print(f"Warm-up done in {result['seconds']:.1f} s")
+
+    def stop(self, *args):
+        print("Stopping after the current job")
+        self.stopping = True
+
+    def serve(self):
+        """Serve queued jobs until a stop request or SIGTERM/SIGINT."""
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        print(f"Serving jobs from {self.spool}")
+        while not self.stopping:
+            claimed = self.claim()
+            if claimed is None:
+                time.sleep(self.poll_interval)
+                continue
+
+            job_id, job = claimed
+            running = os.path.join(self.spool, RUNNING, f'{job_id}.json')
+            if job.get('stop'):
+                write_json(os.path.join(self.spool, DONE, f'{job_id}.json'), dict(job, result={}))
+                os.remove(running)
+                self.stopping = True
+                break
+
+            print(f"Running job {job_id}: {job.get('member')} {os.path.basename(job.get('input', ''))}, {job.get('length')} steps")
+            try:
+                result = self.run_job(job)
+                write_json(os.path.join(self.spool, DONE, f'{job_id}.json'), dict(job, result=result))
+                self.jobs_done += 1
+                print(f"Job {job_id} done in {result['seconds']:.1f} s")
+            except Exception as e:
+                traceback.print_exc()
+                write_json(os.path.join(self.spool, FAILED, f'{job_id}.json'), dict(job, error=f'{type(e).__name__}: {e}'))
+            os.remove(running)
+        print(f"Service stopped after {self.jobs_done} jobs")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Warm GraphCast inference service serving jobs from a spool directory.")
+    parser.add_argument("-w", "--weights", help="parent directory of the graphcast params and stats", required=True)
+    parser.add_argument("-s", "--spool", help="spool directory of the jobs", required=True)
+    parser.add_argument("-p", "--pressure", help="number of pressure levels", default=13)
+    parser.add_argument("--poll-interval", help="seconds between checks of an empty queue", default=1.0)
+    parser.add_argument("--params-cache", help="number of member params kept in memory", default=32)
+    parser.add_argument("--warmup-input", help="IC used to load and compile the model before serving", default=None)
+    parser.add_argument("--warmup-config", help="GC weight member file of the warm-up", default=None)
+    args = parser.parse_args()
+
+    service = InferenceService(args.weights, args.spool, int(args.pressure), float(args.poll_interval), int(args.params_cache))
+    if args.warmup_input is not None:
+        if args.warmup_config is None:
+            parser.error("--warmup-config is required with --warmup-input")
+        service.warmup(args.warmup_input, args.warmup_config)
+    service.serve()
+    sys.exit(0)
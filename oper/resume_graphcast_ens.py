@@ -0,0 +1,73 @@
+'''
+Description: Resume or extend a GraphCast ensemble member forecast from a rollout checkpoint written by
+             run_graphcast_ens.py --checkpoint-interval. Only the leads after the checkpoint are computed,
+             named from the original cycle, with the precipitation accumulated from the forecast start, e.g.
+             a run that failed at step 60 with checkpoints every 8 steps restarts at step 56:
+                 python resume_graphcast_ens.py -k /path/to/checkpoints -w /path/to/stats -m c00 -c c00.pkl -l 64 -o /path/to/output
+             and a finished 64-step run with a checkpoint at its last step is extended to 80 steps with -l 80.
+Revision history:
+    -20261019: initial code
+'''
+import os
+import re
+import glob
+import json
+import argparse
+
+from run_graphcast_ens import GraphCastModel
+
+
+def latest_checkpoint(path, gefs_member, cycle=None, num_pressure_levels=13):
+    """The checkpoint with the largest lead time for the member (and cycle) in a directory, or path itself if it is a file."""
+    if os.path.isfile(path):
+        return path
+
+    date = '*' if cycle is None else cycle
+    pattern = os.path.join(path, f"ckpt-ge{gefs_member}_date-{date}_lead-*_res-0.25_levels-{num_pressure_levels}.nc")
+    checkpoints = glob.glob(pattern)
+    if not checkpoints:
+        raise FileNotFoundError(f"No checkpoint matching {pattern}")
+    return max(checkpoints, key=lambda f: (re.search(r"date-(\d{10})", f).group(1), int(re.search(r"lead-(\d+)", f).group(1))))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Resume or extend a GraphCast forecast from a rollout checkpoint.")
+    parser.add_argument("-k", "--checkpoint", help="checkpoint file, or directory to take the member's latest checkpoint from", required=True)
+    parser.add_argument("-w", "--weights", help="parent directory of the graphcast params and stats", required=True)
+    parser.add_argument("-l", "--length", help="total length of forecast from the forecast start (6-hourly steps)", required=True)
+    parser.add_argument("-m", "--member", help="gefs member [c00, p01, ..., p30]", required=True)
+    parser.add_argument("-c", "--config", help="GC weight member file", required=True)
+    parser.add_argument("-d", "--datetime", help="forecast cycle 'YYYYMMDDHH' when a directory is given, default: the latest", default=None)
+    parser.add_argument("-o", "--output", help="output directory", default=None)
+    parser.add_argument("-p", "--pressure", help="number of pressure levels", default=13)
+    parser.add_argument("--packing", help="grib2 packing: simple, complex or ccsds", default="simple")
+    parser.add_argument("--precision", help="json file with bitsPerValue per variable, e.g. {\"specific_humidity\": 16}", default=None)
+    parser.add_argument("--publish", help="s3 prefix in the noaa s3 bucket to publish each forecast lead to as soon as it is written", default=None)
+    parser.add_argument("--profile", help="aws profile used for publishing", default=None)
+    parser.add_argument("--checkpoint-interval", help="keep saving the rollout state every n steps, default: no checkpoints", default=None)
+
+    args = parser.parse_args()
+
+    grib_precision = None
+    if args.precision is not None:
+        with open(args.precision, 'r') as file:
+            grib_precision = json.load(file)
+
+    checkpoint = latest_checkpoint(args.checkpoint, args.member, args.datetime, int(args.pressure))
+    print(f"Starting from checkpoint {checkpoint}")
+
+    runner = GraphCastModel(args.weights, checkpoint, args.member, args.config, args.output, int(args.pressure), int(args.length),
+                            args.packing, grib_precision, args.publish, args.profile, resume=True,
+                            checkpoint_interval=None if args.checkpoint_interval is None else int(args.checkpoint_interval),
+                            checkpoint_dir=os.path.dirname(os.path.abspath(checkpoint)))
+
+    runner.load_gdas_data()
+    if runner.rollout_steps <= 0:
+        print(f"The checkpoint is at lead time {runner.lead_offset}h, nothing to do for {runner.forecast_length} steps.")
+    elif runner.forecast_complete():
+        print(f"All {runner.forecast_length} steps were completed by a previous run, skipping the forecast.")
+    else:
+        runner.load_pretrained_model()
+        runner.extract_inputs_targets_forcings()
+        runner.load_normalization_stats()
+        runner.get_predictions()
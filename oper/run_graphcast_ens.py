@@ -4,20 +4,33 @@ Author: Sadegh Sadeghi Tabas (sadegh.tabas@noaa.gov)
 Revision history:
     -20240307: Sadegh Tabas, initial code
     -20250506: Linlin Cui, moved hard coded model weights to a json file
+    -20261019: added grib2 packing and precision options
+    -20261019: parallel multipart upload with skip-unchanged
+    -20261019: incremental publishing of forecast leads as they are written
+    -20261019: resumable runs with a per-cycle stage manifest
+    -20261019: rollout checkpoints, resume/extension from a saved lead time
+    -20261019: optional timings, device memory statistics and profiler traces
+    -20261019: asynchronous, optionally reduced-precision host transfer of the rollout steps
+    -20261019: subset products (e.g. for the cyclone tracker) written ahead of the full grib2 files
+    -20261019: batched inference of multiple initial dates, split into per-date output directories
+    -20261019: member params loaded separately and jitted forward reusable, for the inference service
+    -20261019: fail the run when forecast leads could not be published
 '''
 import os
+import time
 import argparse
 from datetime import timedelta
 import dataclasses
 import functools
 import re
+import glob
 import haiku as hk
 import jax
 import numpy as np
 import xarray
-import boto3
 import pandas as pd
 import pickle
+import json
 
 from graphcast import autoregressive
 from graphcast import casting
@@ -27,25 +40,51 @@ from graphcast import graphcast
 from graphcast import normalization
 from graphcast import rollout
 
-from utils.nc2grib import Netcdf2Grib
+from utils.nc2grib import Netcdf2Grib, load_product, write_ready_marker
+from utils.s3_upload import S3Uploader, IncrementalPublisher
+from utils.manifest import StageManifest
+from utils.profiling import Profiler, timed
+from utils.device_transfer import HostTransfer
 
 class GraphCastModel:
-    def __init__(self, pretrained_model_path, gdas_data_path, gefs_member, config_file, output_dir=None, num_pressure_levels=13, forecast_length=40):
+    def __init__(self, pretrained_model_path, gdas_data_path, gefs_member, config_file, output_dir=None, num_pressure_levels=13, forecast_length=40, grib_packing='simple', grib_precision=None, publish_prefix=None, aws_profile=None, resume=False, checkpoint_interval=None, checkpoint_dir=None, profiler=None, async_transfer=False, transfer_dtype='float32', products=None):
         self.pretrained_model_path = pretrained_model_path
         self.gdas_data_path = gdas_data_path
         self.forecast_length = forecast_length
         self.num_pressure_levels = num_pressure_levels
         self.gefs_member = gefs_member
         self.config_file_path = config_file
-        
+        self.grib_packing = grib_packing
+        self.grib_precision = grib_precision
+        self.publish_prefix = publish_prefix
+        self.aws_profile = aws_profile
+        self.checkpoint_interval = checkpoint_interval
+        # Copy each step to the host while the next one computes, optionally in bfloat16/float16
+        self.async_transfer = async_transfer
+        self.transfer_dtype = transfer_dtype
+        # Subset products (names in nc2grib.PRODUCTS or json specs), each lead is written to
+        # <output_dir>/<product name>/ before the full file, with a ready marker once all leads are done
+        self.products = [load_product(product) for product in (products or [])]
+
         if output_dir is None:
             self.output_dir = os.path.join(os.getcwd(), f"forecasts_{str(self.num_pressure_levels)}_levels_{self.gefs_member}_model_{int(gefs_member[1:])}")  # Use current directory if not specified
         else:
             self.output_dir = os.path.join(output_dir, f"forecasts_{str(self.num_pressure_levels)}_levels_{self.gefs_member}_model_{int(gefs_member[1:])}")
         os.makedirs(self.output_dir, exist_ok=True)
-        
+
+        # Checkpoints are kept next to the output directory, so they are not uploaded with the forecasts
+        if checkpoint_dir is None:
+            checkpoint_dir = os.path.join(os.path.dirname(self.output_dir), 'checkpoints')
+        self.checkpoint_dir = checkpoint_dir
+
         self.params = None
         self.state = {}
+        self.model = None
+        # Jitted forward function, params are passed as arguments, so it can be shared by models of
+        # different members (same configs and stats) without recompiling
+        self.forward_apply = None
+        # Steps per yielded rollout segment when not checkpointing, default: the whole rollout
+        self.segment_steps = None
         self.model_config = None
         self.task_config = None
         self.diffs_stddev_by_level = None
@@ -57,8 +96,41 @@ class GraphCastModel:
         self.forcings = None
         self.s3_bucket_name = "noaa-nws-graphcastgfs-pds"
         self.dates = None
+        # Lead time (hours) of the last input state, non-zero when starting from a rollout checkpoint
+        self.lead_offset = 0
+        self.precip_accumulation = None
+
+        # Completed stages are recorded next to the output directory, so a rerun skips verified work
+        self.cycle = self.cycle_from_input()
+        self.manifest = None
+        if resume and self.cycle is not None:
+            self.manifest = StageManifest(os.path.dirname(self.output_dir), self.cycle, self.gefs_member)
+
+        # A disabled profiler passes everything through
+        self.profiler = profiler if profiler is not None else Profiler(enabled=False)
+
+    @staticmethod
+    def cycle_of(path):
+        """Forecast cycle 'YYYYMMDDHH' from an IC file name (source-ge<member>_date-YYYYMMDDHH_...), None if not found."""
+        match = re.search(r"date-(\d{10})", os.path.basename(path))
+        return match.group(1) if match else None
+
+    def cycle_from_input(self):
+        return self.cycle_of(self.gdas_data_path)
+
+    def grib_files(self):
+        """All grib2 files of a complete forecast, f000 to the forecast length."""
+        return [os.path.join(self.output_dir, f'pmlgefs{self.gefs_member}.t{self.cycle[8:]}z.pgrb2.0p25.f{6 * step:03d}')
+                for step in range(self.forecast_length + 1)]
+
+    def forecast_complete(self):
+        """True if every lead was encoded by a previous run and is unchanged."""
+        if self.manifest is None:
+            return False
+        return all(self.manifest.is_done(f'grib2:{os.path.basename(f)}') for f in self.grib_files())
         
 
+    @timed('checkpoint_load')
     def load_pretrained_model(self):
         """Load pre-trained GraphCast model."""
         if self.num_pressure_levels==13:
@@ -72,20 +144,35 @@ class GraphCastModel:
             self.state = {}
             self.model_config = ckpt.model_config
             self.task_config = ckpt.task_config
-            with open(self.config_file_path, 'rb') as f:
-                self.params = pickle.load(f)
+        self.load_params()
+
+    def load_params(self):
+        """Load the params of the member (GC weight member file)."""
+        with open(self.config_file_path, 'rb') as f:
+            self.params = pickle.load(f)
 
+    @timed('ic_load')
     def load_gdas_data(self):
         """Load GDAS data."""
         #with open(gdas_data_path, "rb") as f:
         #    self.current_batch = xarray.load_dataset(f).compute()
         self.current_batch = xarray.load_dataset(self.gdas_data_path).compute()
-        self.dates =  pd.to_datetime(self.current_batch.datetime.values)
+
+        # A rollout checkpoint has the same layout as an IC, plus the lead time of its last state
+        # and the precipitation accumulated up to that lead
+        self.lead_offset = int(self.current_batch.attrs.get('lead_hours', 0))
+        if 'total_precipitation_cumsum' in self.current_batch:
+            self.precip_accumulation = self.current_batch['total_precipitation_cumsum']
+            self.current_batch = self.current_batch.drop_vars('total_precipitation_cumsum')
+            print(f'Resuming forecast from lead time {self.lead_offset}h')
+
+        # Dates are kept relative to the forecast start, so that leads are named from the original cycle
+        self.dates =  pd.to_datetime(self.current_batch.datetime.values) - pd.Timedelta(hours=self.lead_offset)
         
-        if (self.forecast_length + 2) > len(self.current_batch['time']):
+        if (self.rollout_steps + 2) > len(self.current_batch['time']):
             print('Updating batch dataset to account for forecast length')
             
-            diff = int(self.forecast_length + 2 - len(self.current_batch['time']))
+            diff = int(self.rollout_steps + 2 - len(self.current_batch['time']))
             ds = self.current_batch
 
             # time and datetime update
@@ -100,12 +187,19 @@ class GraphCastModel:
             print('batch dataset updated')
             
         
+    @property
+    def rollout_steps(self):
+        """Number of steps still to run, the forecast length minus the leads covered by a checkpoint."""
+        return self.forecast_length - self.lead_offset // 6
+
+    @timed('extract_inputs_targets_forcings')
     def extract_inputs_targets_forcings(self):
         """Extract inputs, targets, and forcings from the loaded data."""
         self.inputs, self.targets, self.forcings = data_utils.extract_inputs_targets_forcings(
-            self.current_batch, target_lead_times=slice("6h", f"{self.forecast_length*6}h"), **dataclasses.asdict(self.task_config)
+            self.current_batch, target_lead_times=slice("6h", f"{self.rollout_steps*6}h"), **dataclasses.asdict(self.task_config)
         )
 
+    @timed('stats_load')
     def load_normalization_stats(self):
         """Load normalization stats."""
         
@@ -159,18 +253,109 @@ class GraphCastModel:
             predictor = construct_wrapped_graphcast(model_config, task_config)
             return predictor(inputs, targets_template=targets_template, forcings=forcings,)
         
-        jax.jit(self._with_configs(run_forward.init))
-        self.model = self._drop_state(self._with_params(jax.jit(self._with_configs(run_forward.apply))))
+        # Kept for initializing params from scratch (e.g. random weights in benchmark_inference.py)
+        self.model_init = jax.jit(self._with_configs(run_forward.init))
+        if self.forward_apply is None:
+            self.forward_apply = jax.jit(self._with_configs(run_forward.apply))
+        self.model = self._drop_state(self._with_params(self.forward_apply))
     
  
-    def get_predictions(self):
-        """Run GraphCast and save forecasts to a NetCDF file."""
-
-        print (f"start running GraphCast for {self.forecast_length} steps --> {self.forecast_length*6} hours.")
-        self.load_model()
+    def rollout_segments(self):
+        """
+        Run GraphCast and yield the forecasts in segments of checkpoint_interval steps (one segment
+        without checkpointing). Time coordinates are relative to the forecast start and
+        total_precipitation_cumsum is accumulated from the forecast start. A checkpoint is written
+        once the consumer asks for the next segment, i.e. after the segment has been saved.
+        """
+
+        print (f"start running GraphCast for {self.rollout_steps} steps --> {self.forecast_length*6} hours.")
+        # Built once, so the jit compilation is reused by later rollouts of the same shapes
+        if self.model is None:
+            with self.profiler.timer('model_build'):
+                self.load_model()
            
         # output = self.model(self.model ,rng=jax.random.PRNGKey(0), inputs=self.inputs, targets_template=self.targets * np.nan, forcings=self.forcings,)
-        forecasts = rollout.chunked_prediction(self.model, rng=jax.random.PRNGKey(0), inputs=self.inputs, targets_template=self.targets * np.nan, forcings=self.forcings,)
+        predictions = rollout.chunked_prediction_generator(self.model, rng=jax.random.PRNGKey(0), inputs=self.inputs, targets_template=self.targets * np.nan, forcings=self.forcings,)
+        transfer = None
+        if self.async_transfer or self.transfer_dtype != 'float32':
+            transfer = HostTransfer(self.transfer_dtype, self.mean_by_level, self.stddev_by_level, lookahead=1 if self.async_transfer else 0)
+            predictions = transfer(predictions)
+
+        interval = self.checkpoint_interval or self.segment_steps or self.rollout_steps
+        accumulation = self.precip_accumulation
+        # The last state of the inputs, the first of the two states saved with a checkpoint after one step
+        previous = self.current_batch[list(self.targets.data_vars)].isel(time=[1])
+        segment = []
+        # Step timings wait for the computation of each step, the first one includes the jit compilation.
+        # The device_get below is not included; with HostTransfer a step is timed until it is on the host,
+        # with the asynchronous transfer overlapped with the computation of the next step
+        for step, prediction in enumerate(self.profiler.steps(predictions), start=1):
+            if transfer is None:
+                # Move the step to the host, so the device holds no more than the rollout state
+                prediction = jax.device_get(prediction)
+            prediction = prediction.assign_coords(time=prediction['time'] + pd.Timedelta(hours=self.lead_offset))
+            segment.append(prediction)
+            if step % interval != 0 and step != self.rollout_steps:
+                continue
+
+            forecasts = xarray.concat(segment, dim='time')
+            if 'total_precipitation_6hr' in forecasts:
+                cumsum = forecasts['total_precipitation_6hr'].clip(min=0).cumsum('time')
+                if accumulation is not None:
+                    cumsum = cumsum + accumulation
+                forecasts['total_precipitation_cumsum'] = cumsum
+                accumulation = cumsum.isel(time=-1, drop=True)
+            yield forecasts
+
+            if self.checkpoint_interval is not None:
+                frames = [segment[-2] if len(segment) > 1 else previous, segment[-1]]
+                with self.profiler.timer('checkpoint_save'):
+                    self.save_checkpoint(frames, self.lead_offset + 6 * step, accumulation)
+            previous = segment[-1]
+            segment = []
+
+    def checkpoint_file(self, lead_hours=None):
+        """Checkpoint file of the member and cycle at lead_hours, a glob pattern of all its checkpoints if None."""
+        forecast_start = self.dates[0][1].strftime('%Y%m%d%H')
+        lead = '*' if lead_hours is None else f'{lead_hours:03d}'
+        return os.path.join(self.checkpoint_dir, f"ckpt-ge{self.gefs_member}_date-{forecast_start}_lead-{lead}_res-0.25_levels-{self.num_pressure_levels}.nc")
+
+    def save_checkpoint(self, frames, lead_hours, accumulation=None):
+        """
+        Save the two most recent states in the IC layout, so the forecast can be resumed or extended from lead_hours.
+        Only the newest checkpoint of the member and cycle is kept.
+        """
+        state = xarray.concat([frame.drop_vars('datetime', errors='ignore') for frame in frames], dim='time')
+        state = state.assign_coords(time=np.array([0, 6], dtype='timedelta64[h]').astype('timedelta64[ns]'))
+        forecast_start = np.datetime64(self.dates[0][1], 'ns')
+        datetimes = forecast_start + np.array([lead_hours - 6, lead_hours], dtype='timedelta64[h]')
+        state = state.assign_coords(datetime=(('batch', 'time'), datetimes[np.newaxis, :]))
+        for var in self.current_batch.data_vars:
+            if 'time' not in self.current_batch[var].dims:
+                state[var] = self.current_batch[var]
+        if accumulation is not None:
+            state['total_precipitation_cumsum'] = accumulation
+        state.attrs['lead_hours'] = lead_hours
+
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        checkpoint_file = self.checkpoint_file(lead_hours)
+        # Write to a temporary file and rename, so an interrupted write never replaces a good checkpoint
+        tmp_file = f'{checkpoint_file}.tmp'
+        state.to_netcdf(tmp_file)
+        os.replace(tmp_file, checkpoint_file)
+        for old_file in glob.glob(self.checkpoint_file()):
+            if old_file != checkpoint_file:
+                os.remove(old_file)
+        print(f"Saved rollout checkpoint at lead time {lead_hours}h to {checkpoint_file}")
+
+    def run_rollout(self):
+        """Run GraphCast and return the forecasts dataset without saving it."""
+        return xarray.concat(list(self.rollout_segments()), dim='time')
+
+    def get_predictions(self):
+        """Run GraphCast and save forecasts to grib2 files, segment by segment when checkpointing."""
+
+        forecasts = xarray.concat(self.write_grib2(self.rollout_segments()), dim='time')
         
         filename = f"forecasts_levels-{self.num_pressure_levels}_steps-{self.forecast_length}.nc"
         output_netcdf = os.path.join(self.output_dir, filename)
@@ -179,13 +364,13 @@ class GraphCastModel:
         #forecasts.to_netcdf(output_netcdf)
         #print (f"GraphCast run completed successfully, you can find the GraphCast forecasts in the following directory:\n {output_netcdf}")
 
-        self.save_grib2(forecasts)
+        return forecasts
 
     def save_grib2(self, forecasts):
+        self.write_grib2([forecasts])
 
-        converter = Netcdf2Grib()
-
-        # Call and save f000 in grib2
+    def initial_state(self):
+        """The last input state as the f000 forecasts dataset."""
         ds = self.current_batch
         ds = ds.drop_vars(['geopotential_at_surface','land_sea_mask', 'total_precipitation_6hr'])
         for var in ds.data_vars:
@@ -193,15 +378,79 @@ class GraphCastModel:
                 del ds[var].attrs['long_name']
         ds = ds.isel(time=slice(1, 2))
         ds['time'] = ds['time'] - pd.Timedelta(hours=6)
+        return ds
+
+    def open_grib2_writer(self):
+        """
+        Returns (save, close): save(ds) writes the products and the full grib2 files of the leads of ds,
+        close() finishes publishing and returns False if files failed to publish (True without publishing).
+        """
+
+        converter = Netcdf2Grib(packing=self.grib_packing, precision=self.grib_precision)
+
+        # Publish each lead (grib2 + idx) to s3 as soon as it is written
+        publisher = None
+        if self.publish_prefix is not None:
+            uploader = S3Uploader(self.s3_bucket_name, profile_name=self.aws_profile, manifest=self.manifest)
+            publisher = IncrementalPublisher(uploader, self.output_dir, self.publish_prefix)
+
+        # Stages are named by the path relative to the output directory, so product files do not collide
+        def stage(file):
+            return f'grib2:{os.path.relpath(file, self.output_dir)}'
+
+        def on_file_written(*files):
+            if self.manifest is not None and not self.manifest.is_done(stage(files[0])):
+                self.manifest.mark_done(stage(files[0]), files)
+            if publisher is not None:
+                publisher.publish(*files)
+
+        skip_file = None
+        if self.manifest is not None:
+            skip_file = lambda outfile: self.manifest.is_done(stage(outfile))
+
+        def save(ds):
+            """Save the products of the leads of ds, then the full files."""
+            with self.profiler.timer('grib2_encode'):
+                for product in self.products:
+                    product_dir = os.path.join(self.output_dir, product['name'])
+                    os.makedirs(product_dir, exist_ok=True)
+                    converter.save_grib2(self.dates, ds, self.gefs_member, product_dir, on_file_written, skip_file, product=product)
+                    if ds['time'].values[-1] == np.timedelta64(6 * self.forecast_length, 'h'):
+                        files = [f for f in glob.glob(os.path.join(product_dir, f'pmlgefs{self.gefs_member}.*')) if not f.endswith('.idx')]
+                        on_file_written(write_ready_marker(product_dir, files))
+                        print(f"Product {product['name']} is complete")
+                converter.save_grib2(self.dates, ds, self.gefs_member, self.output_dir, on_file_written, skip_file)
+
+        def close():
+            return publisher is None or publisher.close()
+
+        return save, close
+
+    def write_grib2(self, segments):
+        """
+        Save f000 (unless resuming from a checkpoint) and each forecast segment as it arrives, returns the segments.
+        Raises RuntimeError if leads failed to publish, before anything can remove the local output.
+        """
+        save, close = self.open_grib2_writer()
 
-        converter.save_grib2(self.dates, ds, self.gefs_member, self.output_dir)
+        # Call and save f000 in grib2
+        if self.lead_offset == 0:
+            save(self.initial_state())
 
         # Call and save forecasts in grib2
-        converter.save_grib2(self.dates, forecasts, self.gefs_member, self.output_dir)
+        written = []
+        for forecasts in segments:
+            save(forecasts)
+            written.append(forecasts)
+
+        if not close():
+            # The bucket is missing leads and has no completion marker, the local files are needed to rerun the upload
+            raise RuntimeError(f"Forecast leads failed to publish to {self.publish_prefix}, local output kept in {self.output_dir}")
+        return written
         
     
-    def upload_to_s3(self, keep_data):
-        s3 = boto3.client('s3')
+    def upload_to_s3(self, keep_data, max_workers=16):
+        uploader = S3Uploader(self.s3_bucket_name, max_workers=max_workers, manifest=self.manifest)
         
         # Extract date and time information from the input file name
         input_file_name = os.path.basename(self.gdas_data_path)
@@ -220,22 +469,22 @@ class GraphCastModel:
         # Define S3 key paths for input and output files
         input_s3_key = f'graphcastgfs.{date}/{time}/input/{self.gdas_data_path}'
 
-        # Upload input file to S3
-        s3.upload_file(self.gdas_data_path, self.s3_bucket_name, input_s3_key)
-        
-        # Upload output files to S3
-        # Iterate over all files in the local directory and upload each one to S3
+        # Upload input file and output files to S3
+        # All files in the local output directory are uploaded in parallel, unchanged objects are skipped
         s3_prefix = f'graphcastgfs.{date}/{time}/forecasts_{self.num_pressure_levels}_levels'
-        
-        for root, dirs, files in os.walk(self.output_dir):
 
-            for file in files:
+        files = [(self.gdas_data_path, input_s3_key)]
+        for root, dirs, filenames in os.walk(self.output_dir):
+            for file in filenames:
                 local_path = os.path.join(root, file)
                 relative_path = os.path.relpath(local_path, self.output_dir)
-                s3_path = os.path.join(s3_prefix, relative_path)
-            
-                # Upload the file
-                s3.upload_file(local_path, self.s3_bucket_name, s3_path)
+                files.append((local_path, os.path.join(s3_prefix, relative_path)))
+
+        stats = uploader.upload_files(files)
+        if stats['failed']:
+            # Keep local data so that the upload can be rerun
+            print(f"{stats['failed']} files failed to upload.")
+            keep_data = True
 
         print("Upload to s3 bucket completed.")
 
@@ -252,9 +501,69 @@ class GraphCastModel:
 
 
 
+def expand_inputs(inputs, gefs_member):
+    """IC files from a list of files, glob patterns and directories (all ICs of the member in them), sorted by cycle."""
+    files = []
+    for item in inputs:
+        if os.path.isdir(item):
+            files.extend(glob.glob(os.path.join(item, f"source-ge{gefs_member}_date-*.nc")))
+        elif glob.has_magic(item):
+            files.extend(glob.glob(item))
+        else:
+            files.append(item)
+    files = sorted(set(files), key=lambda f: (GraphCastModel.cycle_of(f) or '', f))
+    if not files:
+        raise FileNotFoundError(f"No IC found in {inputs}")
+    return files
+
+
+def run_batched(runners, engine, batch_size):
+    """
+    Forecast several initial dates of a member with one rollout per group of batch_size dates.
+    The ICs of a group are concatenated along batch and run by engine (the params, stats and compiled model
+    are shared by all groups); each segment of the rollout is split back by batch and written by the
+    runner of its date to its own output directory. The last group is padded with copies of its last
+    IC, so every group has the same shapes and the compilation is reused.
+        Args:
+          runners: GraphCastModel per IC, for their output directories, dates and manifests
+          engine: GraphCastModel with the pretrained model and normalization stats loaded
+    """
+    todo = []
+    for runner in runners:
+        if runner.forecast_complete():
+            print(f"{runner.gdas_data_path}: all {runner.forecast_length} steps were completed by a previous run, skipping.")
+        else:
+            todo.append(runner)
+
+    for start in range(0, len(todo), batch_size):
+        group = todo[start:start + batch_size]
+        print(f"Running initial dates {', '.join(runner.cycle for runner in group)} in one batch")
+        for runner in group:
+            runner.load_gdas_data()
+            if runner.lead_offset:
+                raise ValueError(f"{runner.gdas_data_path} is a rollout checkpoint, resume it with resume_graphcast_ens.py")
+        padded = group + [group[-1]] * (batch_size - len(group))
+        engine.current_batch = xarray.concat([runner.current_batch for runner in padded], dim='batch',
+                                             data_vars='minimal', coords='minimal', compat='override')
+        engine.dates = group[0].dates
+        engine.extract_inputs_targets_forcings()
+
+        writers = [runner.open_grib2_writer() for runner in group]
+        for runner, (save, _) in zip(group, writers):
+            save(runner.initial_state())
+        for forecasts in engine.rollout_segments():
+            for i, (save, _) in enumerate(writers):
+                save(forecasts.isel(batch=[i]))
+        for _, close in writers:
+            close()
+        print(f"{min(start + batch_size, len(todo))}/{len(todo)} initial dates done")
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Run GraphCast model.")
-    parser.add_argument("-i", "--input", help="input file path (including file name)", required=True)
+    parser.add_argument("-i", "--input", nargs='+', help="input file path (including file name); several files, globs or directories run as a batch of initial dates", required=True)
+    parser.add_argument("-b", "--batch-size", help="initial dates per rollout when running several ICs", default=1)
+    parser.add_argument("--segment-steps", help="steps per encoded segment when running several ICs, bounds the host memory", default=8)
     parser.add_argument("-w", "--weights", help="parent directory of the graphcast params and stats", required=True)
     parser.add_argument("-l", "--length", help="length of forecast (6-hourly), an integer number in range [1, 40]", required=True)
     parser.add_argument("-m", "--member", help="gefs member [c00, p01, ..., p30]", required=True)
@@ -263,18 +572,83 @@ if __name__ == "__main__":
     parser.add_argument("-p", "--pressure", help="number of pressure levels", default=13)
     parser.add_argument("-u", "--upload", help="upload input data as well as forecasts to noaa s3 bucket (yes or no)", default = "no")
     parser.add_argument("-k", "--keep", help="keep input and output after uploading to noaa s3 bucket (yes or no)", default = "no")
+    parser.add_argument("--packing", help="grib2 packing: simple, complex or ccsds", default="simple")
+    parser.add_argument("--precision", help="json file with bitsPerValue per variable, e.g. {\"specific_humidity\": 16}", default=None)
+    parser.add_argument("--publish", help="s3 prefix in the noaa s3 bucket to publish each forecast lead to as soon as it is written", default=None)
+    parser.add_argument("--profile", help="aws profile used for publishing", default=None)
+    parser.add_argument("-r", "--resume", help="skip leads and uploads recorded as complete in the manifest of a previous run (yes or no)", default="yes")
+    parser.add_argument("--checkpoint-interval", help="save the rollout state every n steps for resume_graphcast_ens.py, default: no checkpoints", default=None)
+    parser.add_argument("--checkpoint-dir", help="directory of the rollout checkpoints, default: checkpoints next to the forecast directory", default=None)
+    parser.add_argument("--async-transfer", help="copy each rollout step to the host while the next one computes (yes or no)", default="no")
+    parser.add_argument("--transfer-dtype", help="dtype of the device to host copies: float32, bfloat16 or float16 (normalized on the device, restored in float32)", default="float32")
+    parser.add_argument("--products", help="comma separated subset products written ahead of the full files, names (tracker) or json specs", default=None)
+    parser.add_argument("--timings", help="write phase and step timings and device memory statistics to profile_<member>_<cycle>.json next to the forecast directory (yes or no)", default="no")
+    parser.add_argument("--trace-steps", help="record a jax.profiler trace of these rollout steps, e.g. 3-5 (implies --timings yes)", default=None)
+    parser.add_argument("--trace-dir", help="directory of the jax.profiler trace, default: trace_<member> next to the forecast directory", default=None)
     
     args = parser.parse_args()
-    runner = GraphCastModel(args.weights, args.input, args.member, args.config, args.output, int(args.pressure), int(args.length))
+
+    grib_precision = None
+    if args.precision is not None:
+        with open(args.precision, 'r') as file:
+            grib_precision = json.load(file)
+
+    ic_files = expand_inputs(args.input, args.member)
+
+    def make_runner(ic_file, output_dir):
+        return GraphCastModel(args.weights, ic_file, args.member, args.config, output_dir, int(args.pressure), int(args.length), args.packing, grib_precision, args.publish, args.profile, args.resume.lower() == "yes",
+                              None if args.checkpoint_interval is None else int(args.checkpoint_interval), args.checkpoint_dir,
+                              async_transfer=args.async_transfer.lower() == "yes", transfer_dtype=args.transfer_dtype,
+                              products=None if args.products is None else args.products.split(','))
+
+    batched = len(ic_files) > 1
+    if batched:
+        if args.checkpoint_interval is not None:
+            raise ValueError("Rollout checkpoints are not supported with several initial dates")
+        if args.publish is not None:
+            raise ValueError("Publishing to a single prefix is not supported with several initial dates")
+        # One output directory per initial date
+        root = args.output or os.getcwd()
+        runners = [make_runner(ic_file, os.path.join(root, GraphCastModel.cycle_of(ic_file))) for ic_file in ic_files]
+        runner = make_runner(ic_files[0], os.path.join(root, runners[0].cycle))
+        runner.segment_steps = int(args.segment_steps)
+        cycle = f'{runners[0].cycle}-{runners[-1].cycle}'
+        work_dir = root
+    else:
+        runner = make_runner(ic_files[0], args.output)
+        cycle = runner.cycle
+        work_dir = os.path.dirname(runner.output_dir)
+
+    if args.timings.lower() == "yes" or args.trace_steps is not None:
+        trace_steps = None
+        if args.trace_steps is not None:
+            first, _, last = args.trace_steps.partition('-')
+            trace_steps = (int(first), int(last or first))
+        runner.profiler = Profiler(True, args.member, cycle, os.path.join(work_dir, f'profile_{args.member}_{cycle}.json'),
+                                   trace_steps, args.trace_dir or os.path.join(work_dir, f'trace_{args.member}'))
     
-    runner.load_pretrained_model()
-    runner.load_gdas_data()
-    runner.extract_inputs_targets_forcings()
-    runner.load_normalization_stats()
-    runner.get_predictions()
+    if batched:
+        start = time.time()
+        runner.load_pretrained_model()
+        runner.load_normalization_stats()
+        run_batched(runners, runner, int(args.batch_size))
+        elapsed = time.time() - start
+        print(f"{len(runners)} forecasts in {elapsed:.0f} s, {3600 * len(runners) / max(elapsed, 1e-9):.1f} forecasts/hour")
+    elif runner.forecast_complete():
+        print(f"All {runner.forecast_length} steps were completed by a previous run, skipping the forecast.")
+    else:
+        runner.load_pretrained_model()
+        runner.load_gdas_data()
+        runner.extract_inputs_targets_forcings()
+        runner.load_normalization_stats()
+        runner.get_predictions()
     
     upload_data = args.upload.lower() == "yes"
     keep_data = args.keep.lower() == "yes"
     
     if upload_data:
-        runner.upload_to_s3(keep_data)
+        with runner.profiler.timer('upload'):
+            for member_runner in (runners if batched else [runner]):
+                member_runner.upload_to_s3(keep_data)
+
+    runner.profiler.write()
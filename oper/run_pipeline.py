@@ -0,0 +1,184 @@
+'''
+Description: In-node pipelined MLGEFS workflow, replacing the gen_gefs_ics.py -> run_graphcast_ens.py ->
+             aws s3 sync chain of gcjob_cloud_ens.sh for many members in one launch.
+             Stages run in long-lived workers connected by bounded queues (utils/pipeline.py):
+                 prep   (CPU pool)  download GEFS and write the IC
+                 run    (GPU)       rollout, forecasts handed over as a netcdf file
+                 encode (CPU pool)  grib2 + idx files
+                 upload (threads)   parallel upload to the noaa s3 bucket
+             so member k+1's prep overlaps member k's rollout, and encoding/upload overlap the next rollout.
+                 python run_pipeline.py -w /lustre/EAGLE_ensemble -o /lustre/EAGLE_ensemble/2025010100 -d 2025010100
+Revision history:
+    -20261019: initial code
+    -20261019: skip stages recorded in the per-member manifest
+    -20261019: upload with the member's manifest directly, without building a model
+    -20261019: one warm model per run worker, only the params are loaded per member
+'''
+import os
+import json
+import argparse
+import datetime
+
+from utils.pipeline import Pipeline, Stage
+
+
+def prep_member(job):
+    """Download GEFS data of the member and generate the IC."""
+    from gen_gefs_ics import GFSDataProcessor
+    from utils.manifest import StageManifest
+
+    manifest = StageManifest(job['work_dir'], job['curr_datetime'].strftime("%Y%m%d%H"), job['member'])
+    if manifest.is_done('ic'):
+        job['input'] = manifest.artifacts('ic')[0]
+        return job
+
+    processor = GFSDataProcessor(job['prev_datetime'], job['curr_datetime'], job['member'], job['num_pressure_levels'],
+                                 job['work_dir'], job['work_dir'], keep_downloaded_data=False)
+    processor.download_data()
+    job['input'] = processor.process_data_with_wgrib2()
+    manifest.mark_done('ic', [job['input']])
+    return job
+
+
+def _model(job):
+    from run_graphcast_ens import GraphCastModel
+
+    return GraphCastModel(job['weights'], job['input'], job['member'], job['config'], job['work_dir'],
+                          job['num_pressure_levels'], job['forecast_length'], job.get('packing', 'simple'), resume=True)
+
+
+# Model of the last member rolled out by this worker process, with the checkpoint configs, statistics and jitted
+# forward function (params are passed as arguments), so the worker loads and compiles them once
+_worker_model = None
+
+
+def _load_warm(runner):
+    """Load the model of a job, taking over the loaded state of the worker's model, so only the member's params are loaded."""
+    global _worker_model
+    if _worker_model is None:
+        runner.load_pretrained_model()
+        runner.load_normalization_stats()
+    else:
+        runner.model_config, runner.task_config = _worker_model.model_config, _worker_model.task_config
+        runner.diffs_stddev_by_level = _worker_model.diffs_stddev_by_level
+        runner.mean_by_level, runner.stddev_by_level = _worker_model.mean_by_level, _worker_model.stddev_by_level
+        runner.forward_apply = _worker_model.forward_apply
+        runner.load_params()
+    _worker_model = runner
+
+
+def run_member(job):
+    """Roll out the forecast and hand it over to the encode stage as a netcdf file."""
+    runner = _model(job)
+    job['output_dir'] = runner.output_dir
+    if runner.forecast_complete():
+        job['forecasts'] = None
+        return job
+
+    _load_warm(runner)
+    runner.load_gdas_data()
+    runner.extract_inputs_targets_forcings()
+    forecasts = runner.run_rollout()
+
+    job['forecasts'] = os.path.join(runner.output_dir, f"forecasts_levels-{job['num_pressure_levels']}_steps-{job['forecast_length']}.nc")
+    forecasts.to_netcdf(job['forecasts'])
+    return job
+
+
+def encode_member(job):
+    """Write grib2 and idx files from the handed over forecasts."""
+    import xarray
+
+    if job['forecasts'] is None:
+        return job
+
+    runner = _model(job)
+    runner.load_gdas_data()
+    forecasts = xarray.load_dataset(job['forecasts'])
+    os.remove(job['forecasts'])
+    runner.save_grib2(forecasts)
+    return job
+
+
+def upload_member(job):
+    """Upload the member's grib2 files, then remove the local input and outputs."""
+    from utils.s3_upload import S3Uploader
+    from utils.manifest import StageManifest
+
+    if job.get('s3_prefix') is None:
+        return job
+
+    # The manifest of GraphCastModel, kept next to the output directory
+    manifest = StageManifest(os.path.dirname(job['output_dir']), job['curr_datetime'].strftime("%Y%m%d%H"), job['member'])
+    uploader = S3Uploader(job['bucket'], profile_name=job.get('profile'), manifest=manifest)
+    stats = uploader.upload_directory(job['output_dir'], os.path.join(job['s3_prefix'], os.path.basename(job['output_dir'])))
+    if stats['failed']:
+        raise RuntimeError(f"{stats['failed']} files failed to upload")
+
+    if not job.get('keep', False):
+        os.system(f"rm -rf {job['output_dir']}")
+        os.remove(job['input'])
+    return job
+
+
+def build_stages(prep_workers=4, run_workers=1, encode_workers=2, upload_workers=2, queue_size=2):
+    return [
+        Stage('prep', prep_member, prep_workers, queue_size),
+        Stage('run', run_member, run_workers, queue_size),
+        Stage('encode', encode_member, encode_workers, queue_size),
+        Stage('upload', upload_member, upload_workers, queue_size),
+    ]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run prep, inference, encoding and upload for many members as one pipeline")
+    parser.add_argument("-w", "--weights", help="parent directory of the graphcast params, stats and ens_weights", required=True)
+    parser.add_argument("-o", "--output", help="work directory for inputs and forecasts", required=True)
+    parser.add_argument("-d", "--datetime", help="forecast cycle in the format 'YYYYMMDDHH'", required=True)
+    parser.add_argument("-m", "--members", help="comma separated members, default: all members of model_weights.json", default=None)
+    parser.add_argument("-l", "--length", help="length of forecast (6-hourly steps)", default=64)
+    parser.add_argument("-p", "--pressure", help="number of pressure levels", default=13)
+    parser.add_argument("-s", "--s3prefix", help="s3 prefix to upload to, e.g. EAGLE_ensemble/pmlgefs.YYYYMMDD/HH, no upload if not set", default=None)
+    parser.add_argument("--profile", help="aws profile used for uploading", default=None)
+    parser.add_argument("-k", "--keep", help="keep input and output after uploading (yes or no)", default="no")
+    parser.add_argument("--prep-workers", help="number of members prepared in parallel", default=4)
+    parser.add_argument("--run-workers", help="number of inference workers (one per accelerator)", default=1)
+    parser.add_argument("--encode-workers", help="number of members encoded in parallel", default=2)
+    parser.add_argument("--queue-size", help="maximum number of members waiting in front of each stage", default=2)
+    parser.add_argument("--backend", help="worker backend: process or thread", default="process")
+
+    args = parser.parse_args()
+
+    curr_datetime = datetime.datetime.strptime(args.datetime, "%Y%m%d%H")
+    prev_datetime = curr_datetime - datetime.timedelta(hours=6)
+    os.makedirs(args.output, exist_ok=True)
+
+    with open('model_weights.json', 'r') as file:
+        models = json.load(file)
+
+    selected = None if args.members is None else args.members.split(',')
+    jobs = []
+    for key, values in models.items():
+        member = f'c{int(key):02d}' if key == '0' else f'p{int(key):02d}'
+        if selected is not None and member not in selected:
+            continue
+        jobs.append({
+            'name': member,
+            'member': member,
+            'config': f'{args.weights}/{values.get("params")}',
+            'weights': args.weights,
+            'curr_datetime': curr_datetime,
+            'prev_datetime': prev_datetime,
+            'num_pressure_levels': int(args.pressure),
+            'forecast_length': int(args.length),
+            'work_dir': args.output,
+            'bucket': 'noaa-nws-graphcastgfs-pds',
+            's3_prefix': args.s3prefix,
+            'profile': args.profile,
+            'keep': args.keep.lower() == "yes",
+        })
+
+    stages = build_stages(int(args.prep_workers), int(args.run_workers), int(args.encode_workers), queue_size=int(args.queue_size))
+    results = Pipeline(stages, backend=args.backend).run(jobs)
+    if any('error' in job for job in results):
+        exit(1)
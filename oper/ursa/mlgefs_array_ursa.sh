@@ -0,0 +1,48 @@
+#!/bin/bash --login
+
+# Runs one task of a packed MLGEFS job array, submitted by submit_mlgefs_array_ursa.py.
+# Each line of $task_file lists the members of one array task as member:config_path:model_id,
+# the stage script is run for every member of the line of this task:
+#   stage=prep -> mlgefs_prepdata_ursa.sh (members of a task run concurrently)
+#   stage=run  -> mlgefs_runfcst_ursa.sh
+#   stage=post -> jAIGFS_cyclone_track_00.ecf_ursa, then mlgefs_datadissm_ursa.sh
+
+task_id=${SLURM_ARRAY_TASK_ID:-0}
+members=$(sed -n "$((task_id + 1))p" "$task_file")
+
+echo "Stage $stage, array task $task_id, members: $members"
+
+status=0
+pids=()
+for entry in $members; do
+    IFS=: read -r gefs_member config_path model_id <<< "$entry"
+    export gefs_member config_path model_id curr_datetime prev_datetime
+    export PDY=${curr_datetime:0:8} cyc=${curr_datetime:8:2}
+
+    start_time=$(date +%s)
+    case $stage in
+        prep)
+            bash mlgefs_prepdata_ursa.sh > slurm/getdata_${gefs_member}.out 2>&1 &
+            pids+=($!)
+            continue
+            ;;
+        run)
+            bash mlgefs_runfcst_ursa.sh || status=1
+            ;;
+        post)
+            ksh jAIGFS_cyclone_track_00.ecf_ursa && bash mlgefs_datadissm_ursa.sh || status=1
+            ;;
+        *)
+            echo "Unknown stage: $stage"
+            exit 1
+            ;;
+    esac
+    end_time=$(date +%s)
+    echo "Execution time for $stage of member $gefs_member: $((end_time - start_time)) seconds"
+done
+
+for pid in "${pids[@]}"; do
+    wait $pid || status=1
+done
+
+exit $status
@@ -6,6 +6,10 @@ module load stack-oneapi
 module load awscli-v2/2.15.53
 module list
 
+# Activate Conda environment
+source /scratch3/NCEPDEV/nems/Linlin.Cui/miniforge3/etc/profile.d/conda.sh
+conda activate graphcast
+
 COMROOT=/scratch3/NCEPDEV/stmp/Linlin.Cui/ptmp/com
 num_pressure_levels=13
 
@@ -18,9 +22,9 @@ echo "Uploading member $gefs_member for: $curr_datetime"
 ymd=${curr_datetime:0:8}
 hour=${curr_datetime:8:2}
 
-# upload forecast outputs
-aws s3 --profile gcgfs sync $curr_datetime/forecasts_13_levels_${gefs_member}_model_${model_id}/ s3://noaa-nws-graphcastgfs-pds/EAGLE_ensemble/pmlgefs."$ymd"/"$hour"/forecasts_13_levels_${gefs_member}_model_${model_id}/
-rm -r $curr_datetime/forecasts_13_levels_${gefs_member}_model_${model_id}
+# upload forecast outputs (parallel, unchanged objects are skipped on reruns)
+python utils/s3_upload.py -s $curr_datetime/forecasts_13_levels_${gefs_member}_model_${model_id}/ -b noaa-nws-graphcastgfs-pds -p EAGLE_ensemble/pmlgefs."$ymd"/"$hour"/forecasts_13_levels_${gefs_member}_model_${model_id} --profile gcgfs -n 16 \
+    && rm -r $curr_datetime/forecasts_13_levels_${gefs_member}_model_${model_id}
 
 # upload input file
 aws s3 --profile gcgfs cp $curr_datetime/source-ge"$gefs_member"_date-"$curr_datetime"_res-0.25_levels-"$num_pressure_levels"_steps-2.nc s3://noaa-nws-graphcastgfs-pds/EAGLE_ensemble/pmlgefs."$ymd"/"$hour"/forecasts_13_levels_${gefs_member}_model_${model_id}/input/
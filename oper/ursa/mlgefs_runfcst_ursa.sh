@@ -20,12 +20,30 @@ echo "number of pressure levels: $num_pressure_levels"
 source /scratch3/NCEPDEV/nems/Linlin.Cui/miniforge3/etc/profile.d/conda.sh
 conda activate graphcast
 
+# Forecast leads are published to the bucket as soon as they are written,
+# mlgefs_datadissm_ursa.sh then only uploads the input and tracker files (unchanged leads are skipped).
+# The tracker subset is written first to forecasts_*/tracker/, with a _READY marker the tracker job waits for
+ymd=${curr_datetime:0:8}
+hour=${curr_datetime:8:2}
+publish_prefix=EAGLE_ensemble/pmlgefs."$ymd"/"$hour"/forecasts_13_levels_${gefs_member}_model_${model_id}
+
 start_time=$(date +%s)
 echo "start runing graphcast to get real time 10-days forecasts for: $curr_datetime"
-# Run another Python script
-numactl --interleave=all python run_graphcast_ens.py -i ./"$curr_datetime"/source-ge"$gefs_member"_date-"$curr_datetime"_res-0.25_levels-"$num_pressure_levels"_steps-2.nc -o ./"$curr_datetime"/ -w /scratch3/NCEPDEV/nems/Linlin.Cui/gc_weights/ -m "$gefs_member" -c "$config_path" -l "$forecast_length" -p "$num_pressure_levels" -u no -k yes
+# With mlgefs_spool set (e.g. --export=...,mlgefs_spool=/path/to/spool), the forecast is submitted to a warm
+# inference_service.py serving that spool directory (started with -w on the same gc_weights) instead of
+# starting run_graphcast_ens.py, and the client waits for the job and exits with its status
+input_file=./"$curr_datetime"/source-ge"$gefs_member"_date-"$curr_datetime"_res-0.25_levels-"$num_pressure_levels"_steps-2.nc
+if [ -n "$mlgefs_spool" ]; then
+    python forecast_client.py -s "$mlgefs_spool" -i "$input_file" -o ./"$curr_datetime"/ -m "$gefs_member" -c "$config_path" -l "$forecast_length" -u no -k yes --publish "$publish_prefix" --profile gcgfs --products tracker --wait yes
+else
+    numactl --interleave=all python run_graphcast_ens.py -i "$input_file" -o ./"$curr_datetime"/ -w /scratch3/NCEPDEV/nems/Linlin.Cui/gc_weights/ -m "$gefs_member" -c "$config_path" -l "$forecast_length" -p "$num_pressure_levels" -u no -k yes --publish "$publish_prefix" --profile gcgfs --products tracker
+fi
+status=$?
 
 # Calculate and print the execution time
 end_time=$(date +%s)  # Record the end time in seconds since the epoch
 execution_time=$((end_time - start_time))
 echo "Execution time for running graphcast and uploading to the bucket: $execution_time seconds"
+
+# Dependent jobs (afterok) only start if the forecast succeeded
+exit $status
@@ -0,0 +1,193 @@
+'''
+Description: Submit MLGEFS members as packed Slurm job arrays instead of four chained jobs per member.
+             Members are grouped into array tasks per stage (prep, run, post = tracker + dissemination),
+             N members per prep task and K members per GPU task, with array-level dependencies:
+             aftercorr when two stages use the same packing (task i waits only for task i),
+             afterok on the whole array otherwise. Each task runs mlgefs_array_ursa.sh.
+                 python submit_mlgefs_array_ursa.py --prep-pack 8 --run-pack 2 --dry-run yes
+                 python submit_mlgefs_array_ursa.py --local yes    # run the DAG without Slurm
+Revision history:
+    -20261019: initial code
+'''
+import os
+import socket
+import datetime
+import argparse
+import subprocess
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+from submit_mlgefs_job_ursa import get_closest_cycle, get_job_id
+
+# sbatch options per stage, the time limit is per member and scaled by the pack size
+STAGE_OPTIONS = {
+    'prep': ['--nodes=1', '--ntasks=1', '--account=nems', '--partition=u1-service'],
+    'run': ['--nodes=1', '--account=nems', '--partition=u1-h100', '--qos=gpuwf', '--gres=gpu:h100:2', '--exclude=u22g[09-10]'],
+    'post': ['--nodes=1', '--ntasks=1', '--account=nems', '--partition=u1-compute', '--mem=90g'],
+}
+STAGE_MINUTES = {'prep': 30, 'run': 30, 'post': 30}
+PREP_MEM_GB = 10
+STAGES = ['prep', 'run', 'post']
+
+
+def pack_members(members, pack_size):
+    """Split the member list into groups of pack_size."""
+    return [members[i:i + pack_size] for i in range(0, len(members), pack_size)]
+
+
+def build_dag(members, pack_sizes):
+    """
+    Build the stage DAG.
+        Args:
+          members: list of (member, config_path, model_id)
+          pack_sizes: dict of {stage: members per array task}
+        Returns:
+          list of dicts with stage, member groups and dependency type on the previous stage
+    """
+    dag = []
+    for i, stage in enumerate(STAGES):
+        node = {'stage': stage, 'groups': pack_members(members, pack_sizes[stage]), 'dependency': None}
+        if i > 0:
+            previous = dag[-1]
+            node['dependency'] = 'aftercorr' if previous['groups'] == node['groups'] else 'afterok'
+        dag.append(node)
+    return dag
+
+
+def write_task_file(node, curr_datetime, slurm_dir='slurm'):
+    task_file = os.path.join(slurm_dir, f"{node['stage']}_{curr_datetime}.tasks")
+    with open(task_file, 'w') as f:
+        for group in node['groups']:
+            f.write(' '.join(f'{member}:{param}:{model_id}' for member, param, model_id in group) + '\n')
+    return task_file
+
+
+def sbatch_command(node, task_file, curr_datetime, prev_datetime, dependency_id=None, max_parallel=None):
+    stage = node['stage']
+    pack = max(len(group) for group in node['groups'])
+    array = f"0-{len(node['groups']) - 1}" + (f'%{max_parallel}' if max_parallel else '')
+
+    # prep members of a task run concurrently, run and post members one after another
+    minutes = STAGE_MINUTES[stage] if stage == 'prep' else STAGE_MINUTES[stage] * pack
+    command = ['sbatch', f'--array={array}'] + STAGE_OPTIONS[stage] + [f'--time={minutes}:00']
+    if stage == 'prep':
+        command.append(f'--mem={PREP_MEM_GB * pack}g')
+    if dependency_id is not None:
+        command.append(f"--dependency={node['dependency']}:{dependency_id}")
+    command += [
+        f'--job-name=mlgefs_{stage}', f'--output=slurm/{stage}_%a.out', f'--error=slurm/{stage}_%a.err',
+        f'--export=ALL,stage={stage},task_file={task_file},curr_datetime={curr_datetime},prev_datetime={prev_datetime}',
+        'mlgefs_array_ursa.sh',
+    ]
+    return command
+
+
+def print_dag(dag, commands):
+    print(f'{sum(len(node["groups"]) for node in dag)} array tasks in {len(dag)} jobs:')
+    for node, command in zip(dag, commands):
+        dependency = f"{node['dependency']} on {dag[dag.index(node) - 1]['stage']}" if node['dependency'] else 'none'
+        print(f"  {node['stage']}: {len(node['groups'])} tasks, dependency: {dependency}")
+        for i, group in enumerate(node['groups']):
+            print(f"    [{i}] {' '.join(member for member, _, _ in group)}")
+        print(f"    {' '.join(command)}")
+
+
+def submit_dag(dag, curr_datetime, prev_datetime, max_parallel=None, dry_run=False):
+    os.makedirs('slurm', exist_ok=True)
+    commands = []
+    job_id = None
+    for node in dag:
+        task_file = write_task_file(node, curr_datetime)
+        command = sbatch_command(node, task_file, curr_datetime, prev_datetime, job_id, max_parallel)
+        commands.append(command)
+        if dry_run:
+            job_id = f"<{node['stage']}_job_id>"
+        else:
+            job_id = get_job_id(command)
+            print(f"Submitted {node['stage']} array job {job_id}")
+
+    if dry_run:
+        print_dag(dag, commands)
+
+
+def run_local(dag, curr_datetime, prev_datetime, max_workers=4):
+    """
+    Execute the DAG on the local machine, honoring the array dependencies, so the
+    packing and the task scripts can be tested without Slurm.
+    """
+    os.makedirs('slurm', exist_ok=True)
+    previous = None
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for node in dag:
+            task_file = write_task_file(node, curr_datetime)
+
+            def run_task(task_id, stage=node['stage'], task_file=task_file, wait_for=previous, dependency=node['dependency']):
+                if dependency == 'aftercorr':
+                    wait_for[task_id].result()
+                elif dependency == 'afterok':
+                    for future in wait_for:
+                        future.result()
+                env = dict(os.environ, stage=stage, task_file=task_file, SLURM_ARRAY_TASK_ID=str(task_id),
+                           curr_datetime=curr_datetime, prev_datetime=prev_datetime)
+                with open(f'slurm/{stage}_{task_id}.out', 'w') as out:
+                    subprocess.run(['bash', 'mlgefs_array_ursa.sh'], env=env, stdout=out, stderr=subprocess.STDOUT, check=True)
+                print(f'Finished {stage} task {task_id}')
+
+            previous = [executor.submit(run_task, task_id) for task_id in range(len(node['groups']))]
+
+        for future in previous:
+            future.result()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Submit MLGEFS members as packed slurm job arrays")
+    parser.add_argument("--prep-pack", help="members per prep task", default=4)
+    parser.add_argument("--run-pack", help="members per GPU task (sized to the GPU memory and time limit)", default=1)
+    parser.add_argument("--post-pack", help="members per tracker/dissemination task, default: same as --run-pack", default=None)
+    parser.add_argument("--max-parallel", help="maximum number of simultaneously running tasks per array", default=None)
+    parser.add_argument("-d", "--datetime", help="forecast cycle 'YYYYMMDDHH', default: the closest cycle", default=None)
+    parser.add_argument("--dry-run", help="print the job DAG and sbatch commands without submitting (yes or no)", default="no")
+    parser.add_argument("--local", help="run the DAG on this machine instead of submitting to Slurm (yes or no)", default="no")
+    parser.add_argument("--local-workers", help="number of tasks run in parallel by the local executor", default=4)
+    args = parser.parse_args()
+
+    hostname = socket.gethostname()
+    if hostname.startswith('ufe'):
+        param_path = '/scratch3/NCEPDEV/nems/Linlin.Cui/Tests/MLGEFSv1.0/oper/graphcast_gefs_params'
+    elif hostname.startswith('linlincui'):
+        param_path = '/lustre2/Linlin.Cui/MLGEFSv1.0/weights'
+    elif args.dry_run.lower() == 'yes' or args.local.lower() == 'yes':
+        param_path = os.getcwd()
+    else:
+        raise NotImplementedError(f'{hostname} is not supported yet!')
+
+    with open('model_weights_ursa.json', 'r') as file:
+        models = json.load(file)
+
+    if args.datetime is None:
+        curr_datetime = get_closest_cycle(now=None, cycles=[0, 6, 12, 18])
+    else:
+        curr_datetime = datetime.datetime.strptime(args.datetime, "%Y%m%d%H")
+    prev_datetime = curr_datetime - datetime.timedelta(hours=6)
+    print(f'curr_datetime: {curr_datetime}')
+    print(f'prev_datetime: {prev_datetime}')
+
+    members = []
+    for key, values in models.items():
+        member = f'c{int(key):02d}' if key == '0' else f'p{int(key):02d}'
+        members.append((member, f'{param_path}/{values.get("params")}', key))
+
+    run_pack = int(args.run_pack)
+    pack_sizes = {
+        'prep': int(args.prep_pack),
+        'run': run_pack,
+        'post': run_pack if args.post_pack is None else int(args.post_pack),
+    }
+    dag = build_dag(members, pack_sizes)
+    max_parallel = None if args.max_parallel is None else int(args.max_parallel)
+
+    if args.local.lower() == 'yes':
+        run_local(dag, curr_datetime.strftime("%Y%m%d%H"), prev_datetime.strftime("%Y%m%d%H"), int(args.local_workers))
+    else:
+        submit_dag(dag, curr_datetime.strftime("%Y%m%d%H"), prev_datetime.strftime("%Y%m%d%H"), max_parallel,
+                   dry_run=args.dry_run.lower() == 'yes')
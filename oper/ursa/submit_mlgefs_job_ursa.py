@@ -1,4 +1,5 @@
 import os
+import sys
 import socket
 import datetime
 #from datetime import datetime, timedelta
@@ -36,15 +37,21 @@ def get_job_id(command):
         text=True
     )
     if result.returncode != 0:
-        print("Job submission failed:", result.stderr)
-        exit(1)
+        # Raised rather than exiting, so the input watcher records the member as failed and keeps watching the others
+        raise RuntimeError(f"Job submission failed: {result.stderr}")
 
     job_id = result.stdout.strip().split()[-1]
 
     return job_id
 
 
-def submit_slurm_run(member, param, model_id, curr_datetime, prev_datetime):
+# Wall time limits in minutes. The tracker starts with the forecast job and waits for the tracker subset,
+# so its limit covers the whole forecast job plus its own run, and it waits at most the forecast limit.
+FORECAST_MINUTES = 30
+TRACKER_MINUTES = 30
+
+
+def submit_slurm_run(member, param, model_id, curr_datetime, prev_datetime, spool=None):
 
     #Step 1 - generate input file
     command1 = [
@@ -55,28 +62,41 @@ def submit_slurm_run(member, param, model_id, curr_datetime, prev_datetime):
     ]
     job_id1 = get_job_id(command1)
 
-    #Step 2 - run graphcast
-    command2 = ['sbatch', f'--dependency=afterok:{job_id1}', '--nodes=1', '--account=nems', '--partition=u1-h100', \
-        '--qos=gpuwf', '--gres=gpu:h100:2', '--exclude=u22g[09-10]', '--time=30:00', f'--job-name=run_{member}', f'--output=slurm/gcgfs_{member}.out', \
-        f'--error=slurm/gcgfs_{member}.err', f'--export=gefs_member={member},config_path={param},model_id={model_id},curr_datetime={curr_datetime}', \
+    #Step 2 - run graphcast, or with a spool directory submit it to the warm inference service and wait for it
+    resources = ['--partition=u1-h100', '--qos=gpuwf', '--gres=gpu:h100:2', '--exclude=u22g[09-10]']
+    export = f'gefs_member={member},config_path={param},model_id={model_id},curr_datetime={curr_datetime}'
+    if spool is not None:
+        resources = ['--ntasks=1', '--mem=2g', '--partition=u1-service']
+        export += f',mlgefs_spool={spool}'
+    command2 = ['sbatch', f'--dependency=afterok:{job_id1}', '--nodes=1', '--account=nems'] + resources + \
+        [f'--time={FORECAST_MINUTES}:00', f'--job-name=run_{member}', f'--output=slurm/gcgfs_{member}.out', \
+        f'--error=slurm/gcgfs_{member}.err', f'--export={export}', \
         'mlgefs_runfcst_ursa.sh']
     job_id2 = get_job_id(command2)
 
-    #Step 3 - run TC_tracker
-    command3 = ['sbatch', f'--dependency=afterok:{job_id2}', '--nodes=1', '--ntasks=1', '--account=nems', \
-        '--partition=u1-compute', '--time=30:00', '--mem=90g', f'--job-name=tctracker_{member}', f'--output=slurm/tctracker_{member}.out', \
-        f'--error=slurm/tctracker_{member}.err', f'--export=gefs_member={member},PDY={curr_datetime[:8]},cyc={curr_datetime[8:]}', \
+    #Step 3 - run TC_tracker, started with the forecast job, it waits for the tracker subset's ready marker
+    command3 = ['sbatch', f'--dependency=after:{job_id2}', '--nodes=1', '--ntasks=1', '--account=nems', \
+        '--partition=u1-compute', f'--time={FORECAST_MINUTES + TRACKER_MINUTES}:00', '--mem=90g', f'--job-name=tctracker_{member}', \
+        f'--output=slurm/tctracker_{member}.out', f'--error=slurm/tctracker_{member}.err', \
+        f'--export=gefs_member={member},PDY={curr_datetime[:8]},cyc={curr_datetime[8:]},wait_for_product=YES,max_wait_seconds={FORECAST_MINUTES * 60}', \
         'jAIGFS_cyclone_track_00.ecf_ursa']
     job_id3 = get_job_id(command3)
 
     #Step 4 - upload data to s3 bucket
-    command4 = ['sbatch', f'--dependency=afterok:{job_id3}', '--nodes=1', '--ntasks=1', '--account=nems', \
+    command4 = ['sbatch', f'--dependency=afterok:{job_id2}:{job_id3}', '--nodes=1', '--ntasks=1', '--account=nems', \
         '--partition=u1-service', '--time=30:00', f'--job-name=datadissm_{member}', f'--output=slurm/datadissm_{member}.out', \
         f'--error=slurm/datadissm_{member}.err', f'--export=gefs_member={member},model_id={model_id},curr_datetime={curr_datetime}', \
         'mlgefs_datadissm_ursa.sh']
     job_id4 = get_job_id(command4)
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Submit the MLGEFS jobs of the current cycle")
+    parser.add_argument("--wait-for-inputs", help="submit each member as soon as its GEFS inputs arrive, see watch_gefs_inputs.py (yes or no)", default="no")
+    parser.add_argument("--local", help="local or Lustre mirror of the bucket watched instead of S3", default=None)
+    parser.add_argument("--timeout", help="seconds to wait for the inputs of all members", default=6 * 3600)
+    parser.add_argument("--metrics", help="json lines file of the input arrival and submission times", default='slurm/input_arrival.jsonl')
+    parser.add_argument("--spool", help="spool directory of a running inference_service.py, the run jobs submit to it instead of running the model", default=None)
+    args = parser.parse_args()
 
     hostname = socket.gethostname()
     if hostname.startswith('ufe'):
@@ -97,11 +117,31 @@ if __name__ == '__main__':
     print(f'curr_datetime: {curr_datetime}')
     print(f'prev_datetime: {prev_datetime}')
 
+    members = {}
     for key, values in models.items():
         if key == '0':
             member = f'c{int(key):02d}'
         else:
             member = f'p{int(key):02d}'
 
-        param = f'{param_path}/{values.get("params")}'
-        submit_slurm_run(member, param, key, curr_datetime.strftime("%Y%m%d%H"), prev_datetime.strftime("%Y%m%d%H"))
+        members[member] = (f'{param_path}/{values.get("params")}', key)
+
+    def submit(member):
+        param, key = members[member]
+        submit_slurm_run(member, param, key, curr_datetime.strftime("%Y%m%d%H"), prev_datetime.strftime("%Y%m%d%H"), args.spool)
+
+    if args.wait_for_inputs.lower() == 'yes':
+        # The job chain of a member is submitted the moment its inputs are complete, instead of at the cron time
+        sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        from watch_gefs_inputs import InputWatcher, LocalSource, S3Source
+
+        source = LocalSource(args.local) if args.local is not None else S3Source(profile_name=os.environ.get('AWS_PROFILE'))
+        watcher = InputWatcher(source, curr_datetime, timeout=float(args.timeout), metrics_file=args.metrics)
+        # Members whose inputs timed out or whose submission failed
+        not_launched = watcher.run(list(members), submit)
+        if not_launched:
+            print(f"Members not submitted: {not_launched}")
+            exit(1)
+    else:
+        for member in members:
+            submit(member)
@@ -0,0 +1,112 @@
+""" Asynchronous, optionally reduced-precision device to host transfer of rollout predictions.
+
+    rollout.chunked_prediction_generator keeps the autoregressive state on the device (the predictions
+    are fed back as jax arrays) and computes a step only when it is asked for the next one. Without a
+    transfer, run_graphcast_ens moves every step to the host with a synchronous jax.device_get as it is
+    yielded: the call waits for the step, then for the copy, and the next step is dispatched only after
+    the copy and the numpy/xarray handling of the segment buffer, so the accelerator idles meanwhile.
+
+    HostTransfer adds two things over that. The first is overlap: with lookahead=1 each step is cast
+    on the device and copy_to_host_async is started, the numpy conversion waits for the copy in a
+    background thread, and the generator is advanced (dispatching the next step) before the oldest
+    step is handed to the consumer, so the transfer runs while the next step computes. With
+    lookahead=0 the steps are handed over in order without overlap, which run_graphcast_ens uses for a
+    reduced dtype alone.
+
+    The second is a reduced transfer dtype (bfloat16 or float16): the fields are normalized on the
+    device with the model's mean_by_level/stddev_by_level before the cast and restored in float32 on
+    the host, so the rounding error is relative to the variability of a field rather than its
+    magnitude (e.g. about 0.06 K for temperature in bfloat16) and geopotential or pressure cannot
+    overflow float16. The state fed back to the model is not affected.
+
+    History:
+        10/19/2026: initial code
+        10/19/2026: describe the transfer against the synchronous per-step device_get of the default path
+"""
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import jax
+import jax.numpy as jnp
+import numpy as np
+import xarray
+
+from graphcast import xarray_jax
+
+TRANSFER_DTYPES = {
+    'float32': None,
+    'bfloat16': jnp.bfloat16,
+    'float16': jnp.float16,
+}
+
+
+class HostTransfer:
+    def __init__(self, dtype='float32', mean_by_level=None, stddev_by_level=None, lookahead=1):
+        """
+            Args:
+              dtype: transfer dtype, one of 'float32', 'bfloat16' or 'float16'
+              mean_by_level, stddev_by_level: normalization stats, required for a reduced dtype;
+                                              variables without stats are transferred in float32
+              lookahead: number of steps dispatched before the oldest step is handed to the consumer
+        """
+        if dtype not in TRANSFER_DTYPES:
+            raise ValueError(f"Transfer dtype {dtype} is not supported, options: {list(TRANSFER_DTYPES)}")
+        if TRANSFER_DTYPES[dtype] is not None and (mean_by_level is None or stddev_by_level is None):
+            raise ValueError(f"Transfer dtype {dtype} needs the normalization stats")
+        self.dtype = TRANSFER_DTYPES[dtype]
+        self.mean_by_level = mean_by_level
+        self.stddev_by_level = stddev_by_level
+        self.lookahead = lookahead
+
+    def _stats(self, var, da):
+        """(mean, stddev) of a variable broadcastable to its array, None if it is transferred in float32."""
+        if self.dtype is None or var not in self.mean_by_level or var not in self.stddev_by_level:
+            return None
+        mean, stddev = self.mean_by_level[var], self.stddev_by_level[var]
+        shape = [1] * da.ndim
+        if 'level' in mean.dims:
+            mean, stddev = mean.sel(level=da['level']), stddev.sel(level=da['level'])
+            shape[da.dims.index('level')] = len(da['level'])
+        return (mean.values.astype(np.float32).reshape(shape), stddev.values.astype(np.float32).reshape(shape))
+
+    def start(self, prediction):
+        """Cast the step on the device and start copying it to the host, returns what finish() needs."""
+        arrays = {}
+        for var, da in prediction.data_vars.items():
+            array = xarray_jax.unwrap_data(da, require_jax=False)
+            stats = self._stats(var, da)
+            if stats is not None and isinstance(array, jax.Array):
+                array = ((array - stats[0]) / stats[1]).astype(self.dtype)
+            if isinstance(array, jax.Array):
+                array.copy_to_host_async()
+            arrays[var] = (da.dims, array, stats)
+        return prediction.coords, arrays
+
+    @staticmethod
+    def finish(coords, arrays):
+        """Wait for the copies and build the float32 numpy dataset (runs in the background thread)."""
+        data_vars = {}
+        for var, (dims, array, stats) in arrays.items():
+            values = np.asarray(array).astype(np.float32)
+            if stats is not None:
+                values = values * stats[1] + stats[0]
+            data_vars[var] = (dims, values)
+        return xarray.Dataset(data_vars, coords=coords)
+
+    def __call__(self, predictions):
+        """Yield the predictions of a rollout generator as host datasets, in order."""
+        executor = ThreadPoolExecutor(max_workers=1)
+        pending = deque()
+        try:
+            for prediction in predictions:
+                pending.append(executor.submit(self.finish, *self.start(prediction)))
+                # Hand over the oldest step only once the next one is dispatched
+                if len(pending) > self.lookahead:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=False)
@@ -0,0 +1,122 @@
+'''
+Description: Benchmark grib2 packing options (simple, complex, ccsds) on an existing grib2 file.
+             Every message is re-encoded with each packing type and the encode time, the
+             resulting file size and the largest decoding error against the source values are
+             reported (so a precision setting that corrupts the data shows up), e.g.
+                 python utils/grib_packing_benchmark.py -i pmlgefsc00.t00z.pgrb2.0p25.f006
+Revision history:
+    -20261019: initial code
+    -20261019: repack through nc2grib.repack, decode the output and report the maximum error
+'''
+import os
+import argparse
+import json
+import tempfile
+from time import perf_counter
+
+import eccodes
+import numpy as np
+
+from nc2grib import PACKING_TYPES, repack
+
+
+def encode_file(infile, outfile, packing, bits_per_value=None):
+    """
+    Re-encode every message of infile with the given packing and write to outfile.
+        Returns:
+          encode time in seconds (excluding reading the source messages)
+    """
+    encode_time = 0.0
+    with open(infile, 'rb') as fin, open(outfile, 'wb') as fout:
+        while True:
+            gid = eccodes.codes_grib_new_from_file(fin)
+            if gid is None:
+                break
+            try:
+                start = perf_counter()
+                repack(gid, None if packing == 'simple' else PACKING_TYPES[packing], bits_per_value)
+                message = eccodes.codes_get_message(gid)
+                encode_time += perf_counter() - start
+                fout.write(message)
+            finally:
+                eccodes.codes_release(gid)
+
+    return encode_time
+
+
+def decode_errors(infile, outfile):
+    """
+    Decode every message of outfile and compare it with the same message of infile.
+        Returns:
+          (maximum absolute error, maximum error relative to the value range of a message)
+    """
+    max_error, max_relative_error = 0.0, 0.0
+    with open(infile, 'rb') as fsrc, open(outfile, 'rb') as fout:
+        while True:
+            src = eccodes.codes_grib_new_from_file(fsrc)
+            out = eccodes.codes_grib_new_from_file(fout)
+            if src is None or out is None:
+                for gid in (src, out):
+                    if gid is not None:
+                        eccodes.codes_release(gid)
+                if src is not out:
+                    raise ValueError(f"{outfile} and {infile} have a different number of messages")
+                break
+            try:
+                expected = eccodes.codes_get_values(src)
+                error = float(np.max(np.abs(eccodes.codes_get_values(out) - expected)))
+                value_range = float(np.ptp(expected))
+                max_error = max(max_error, error)
+                if value_range > 0:
+                    max_relative_error = max(max_relative_error, error / value_range)
+            finally:
+                eccodes.codes_release(src)
+                eccodes.codes_release(out)
+
+    return max_error, max_relative_error
+
+
+def run_benchmark(infile, packings, bits_per_value=None, repeats=1):
+    results = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for packing in packings:
+            outfile = os.path.join(tmpdir, f'{os.path.basename(infile)}.{packing}')
+            times = [encode_file(infile, outfile, packing, bits_per_value) for _ in range(repeats)]
+            max_error, max_relative_error = decode_errors(infile, outfile)
+            results.append({
+                'packing': packing,
+                'bits_per_value': bits_per_value,
+                'encode_seconds': min(times),
+                'size_bytes': os.path.getsize(outfile),
+                'max_abs_error': max_error,
+                'max_relative_error': max_relative_error,
+            })
+
+    simple = next((r for r in results if r['packing'] == 'simple'), None)
+    for r in results:
+        r['size_ratio_vs_simple'] = r['size_bytes'] / simple['size_bytes'] if simple else None
+
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark grib2 packing options")
+    parser.add_argument("-i", "--input", help="grib2 file to re-encode", required=True)
+    parser.add_argument("-p", "--packing", help="comma separated packing types", default=",".join(PACKING_TYPES))
+    parser.add_argument("-b", "--bits", help="bitsPerValue for all messages (default: keep source precision)", default=None)
+    parser.add_argument("-r", "--repeats", help="number of repeats, best time is reported", default=1)
+    parser.add_argument("-o", "--output", help="write results to a json file", default=None)
+
+    args = parser.parse_args()
+    bits_per_value = None if args.bits is None else int(args.bits)
+    results = run_benchmark(args.input, args.packing.split(','), bits_per_value, int(args.repeats))
+
+    print(f"{'packing':>10} {'encode (s)':>12} {'size (MB)':>12} {'ratio':>8} {'max error':>12} {'rel error':>10}")
+    for r in results:
+        ratio = '' if r['size_ratio_vs_simple'] is None else f"{r['size_ratio_vs_simple']:.3f}"
+        print(f"{r['packing']:>10} {r['encode_seconds']:>12.3f} {r['size_bytes'] / 1e6:>12.2f} {ratio:>8} "
+              f"{r['max_abs_error']:>12.4g} {r['max_relative_error']:>10.2e}")
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=4)
@@ -0,0 +1,120 @@
+""" Per (cycle, member) stage manifest for resumable runs.
+
+    Completed stages are recorded in a json file together with the artifacts they
+    produced (size and md5). On restart a stage is skipped only if every artifact still
+    exists and matches, so recovery redoes only the work that was lost. grib2 stages are
+    named by the file's path relative to the output directory (subset products are in a
+    subdirectory), upload stages by the s3 key, e.g.
+        {
+            "cycle": "2025010100", "member": "c00",
+            "stages": {
+                "ic": {"completed": "...", "artifacts": {"/path/source-gec00_...nc": {"size": ..., "md5": ...}}},
+                "grib2:pmlgefsc00.t00z.pgrb2.0p25.f006": {"completed": "...", "artifacts": {
+                    "/path/pmlgefsc00.t00z.pgrb2.0p25.f006": {...}, "/path/pmlgefsc00.t00z.pgrb2.0p25.f006.idx": {...}}},
+                "grib2:tracker/pmlgefsc00.t00z.pgrb2.0p25.f006": {...},
+                "upload:EAGLE_ensemble/.../pmlgefsc00.t00z.pgrb2.0p25.f006": {...}
+            }
+        }
+
+    History:
+        10/19/2026: initial code
+        10/19/2026: artifacts of a completed stage
+"""
+
+import os
+import json
+import fcntl
+import hashlib
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+
+def file_md5(path, blocksize=8 * 1024 * 1024):
+    md5 = hashlib.md5()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(blocksize), b''):
+            md5.update(block)
+    return md5.hexdigest()
+
+
+class StageManifest:
+    def __init__(self, directory, cycle, member, verify_checksum=True):
+        """
+            Args:
+              directory: where the manifest file is kept (outside of any uploaded directory)
+              cycle: forecast cycle 'YYYYMMDDHH'
+              member: gefs member, e.g. c00
+              verify_checksum: compare md5 of artifacts on restart, otherwise only the size
+        """
+        self.path = os.path.join(directory, f'mlgefs_manifest_{cycle}_{member}.json')
+        self.verify_checksum = verify_checksum
+        self.lock = threading.Lock()
+        self.data = {'cycle': cycle, 'member': member, 'stages': {}}
+        self._load()
+
+    def _load(self):
+        if os.path.isfile(self.path):
+            with open(self.path, 'r') as f:
+                self.data = json.load(f)
+
+    @contextmanager
+    def _update(self):
+        """
+        Reload, modify and save the manifest under a thread and file lock, so that stages
+        recorded by other processes (e.g. prep and upload jobs of the same member) are kept.
+        """
+        with self.lock, open(f'{self.path}.lock', 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            self._load()
+            yield self.data['stages']
+            # Write to a temporary file and rename, so a crash never leaves a truncated manifest
+            tmp_path = f'{self.path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(self.data, f, indent=4)
+            os.replace(tmp_path, self.path)
+
+    def artifact_matches(self, path, record, md5=None):
+        if not os.path.isfile(path) or os.path.getsize(path) != record['size']:
+            return False
+        if md5 is not None:
+            return md5 == record['md5']
+        return not self.verify_checksum or file_md5(path) == record['md5']
+
+    def is_done(self, stage, checksums=None):
+        """
+        True if the stage was completed and all of its artifacts are unchanged.
+            Args:
+              checksums: optional dict of already computed {path: md5}
+        """
+        checksums = checksums or {}
+        record = self.data['stages'].get(stage)
+        if record is None:
+            return False
+        return all(self.artifact_matches(path, artifact, checksums.get(path)) for path, artifact in record['artifacts'].items())
+
+    def artifacts(self, stage):
+        """Paths of the artifacts recorded for a completed stage, in the order they were recorded, empty if not recorded."""
+        record = self.data['stages'].get(stage)
+        return [] if record is None else list(record['artifacts'])
+
+    def mark_done(self, stage, artifacts=(), checksums=None, **info):
+        """
+        Record a completed stage.
+            Args:
+              artifacts: paths of the files produced by the stage
+              checksums: optional dict of already computed {path: md5}
+              info: extra json-serializable values stored with the stage
+        """
+        checksums = checksums or {}
+        record = {
+            'completed': datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'artifacts': {path: {'size': os.path.getsize(path), 'md5': checksums.get(path) or file_md5(path)} for path in artifacts},
+        }
+        record.update(info)
+        with self._update() as stages:
+            stages[stage] = record
+
+    def invalidate(self, stage):
+        with self._update() as stages:
+            stages.pop(stage, None)
@@ -5,19 +5,115 @@
         02/05/2024: Sadegh Tabas update the utility to a object-oriented format
         04/25/2024: Sadegh Tabas, generate grib2 index files
         07/03/2024: Sadegh Tabas, sorted grib2 variables
+        10/19/2026: configurable grib2 packing (simple, complex, ccsds) and per-variable precision
+        10/19/2026: keep precomputed total_precipitation_cumsum, per-process intermediate nc file
+        10/19/2026: on_file_written callback for incremental publishing
+        10/19/2026: skip_file callback for resumable runs, start each lead from an empty file
+        10/19/2026: optional phase timings (utils/profiling.py) for nc2grib_benchmark.py
+        10/19/2026: product specs (variable, level, lead and lat/lon subsets), e.g. the tracker subset, and ready markers
+        10/19/2026: repack the encoded values when changing the packing or precision of a message
 """
 
 import os
+import json
 from datetime import datetime, timedelta
 import glob
 import subprocess
+from contextlib import nullcontext
 import cf_units
 import iris
 import iris_grib
 import eccodes
+import numpy as np
+
+# GRIB2 packing options, mapped to the eccodes packingType key
+PACKING_TYPES = {
+    'simple': 'grid_simple',
+    'complex': 'grid_complex_spatial_differencing',
+    'ccsds': 'grid_ccsds',
+}
+
+
+# Product specs: variables, pressure levels (hPa) of the atmospheric variables, leads (hours, None for all)
+# and an optional box [lat_min, lat_max, lon_min, lon_max] in degrees (lon in [0, 360), may wrap around 0).
+# The tracker subset has what the cyclone tracker reads: MSLP, 10m winds, and heights, winds and temperature
+# at the levels used for vorticity, steering and the warm core.
+PRODUCTS = {
+    'tracker': {
+        'variables': ['mean_sea_level_pressure', '10m_u_component_of_wind', '10m_v_component_of_wind',
+                      'geopotential', 'u_component_of_wind', 'v_component_of_wind', 'temperature'],
+        'levels': [850, 700, 500, 300, 200],
+        'leads': None,
+        'box': None,
+    },
+}
+
+# Written into a product directory once all leads of the product are complete
+READY_MARKER = '_READY'
+
+
+def repack(gid, packing_type=None, bits_per_value=None):
+    """
+    Change the packing type and/or bitsPerValue of an encoded GRIB message. Setting bitsPerValue alone only
+    changes section 5 and leaves the data packed with the old width, so the values are set again to repack them.
+        Args:
+          gid: eccodes handle of the message
+          packing_type: eccodes packingType, e.g. 'grid_ccsds', None to keep it
+          bits_per_value: bits per packed value, None to keep it
+    """
+    if packing_type is None and bits_per_value is None:
+        return
+    values = eccodes.codes_get_values(gid)
+    if packing_type is not None:
+        eccodes.codes_set(gid, 'packingType', packing_type)
+    if bits_per_value is not None:
+        eccodes.codes_set(gid, 'bitsPerValue', bits_per_value)
+    eccodes.codes_set_values(gid, values)
+
+
+def load_product(product):
+    """
+    Product spec by name (see PRODUCTS) or from a json file with the same keys, named after the file by default.
+    """
+    if product in PRODUCTS:
+        spec = dict(PRODUCTS[product], name=product)
+    else:
+        with open(product, 'r') as f:
+            spec = json.load(f)
+        spec.setdefault('name', os.path.splitext(os.path.basename(product))[0])
+    for key in ('levels', 'leads', 'box'):
+        spec.setdefault(key, None)
+    if 'variables' not in spec:
+        raise ValueError(f"Product {spec['name']} has no variables")
+    return spec
+
+
+def write_ready_marker(directory, files):
+    """Write the ready marker of a product directory, listing its files (atomic, so a reader never sees it partially written)."""
+    marker = os.path.join(directory, READY_MARKER)
+    tmp_file = f'{marker}.tmp'
+    with open(tmp_file, 'w') as f:
+        f.write('\n'.join(os.path.basename(file) for file in sorted(files)) + '\n')
+    os.replace(tmp_file, marker)
+    return marker
+
 
 class Netcdf2Grib:
-    def __init__(self):
+    def __init__(self, packing='simple', precision=None, profiler=None):
+        """
+            Args:
+              packing: grib2 packing, one of 'simple', 'complex' (complex packing with
+                       spatial differencing) or 'ccsds' (CCSDS/AEC, needs eccodes built with libaec)
+              precision: optional dict of {variable name: bitsPerValue}, e.g. {'specific_humidity': 16}
+              profiler: optional utils.profiling.Profiler, times the phases of save_grib2
+                        (preprocess, netcdf_write, iris_load, encode_fXXX per lead, idx)
+        """
+        if packing not in PACKING_TYPES:
+            raise ValueError(f"Packing {packing} is not supported, options: {list(PACKING_TYPES)}")
+        self.packing = packing
+        self.precision = precision or {}
+        self.profiler = profiler
+
         self.ATTR_MAPS = {
             '10m_u_component_of_wind': [10, 'x_wind', 'm s**-1'],
             '10m_v_component_of_wind': [10, 'y_wind', 'm s**-1'],
@@ -33,7 +129,56 @@ class Netcdf2Grib:
             'v_component_of_wind': [None, 'y_wind', 'm s**-1'],
         }
 
-    def tweaked_messages(self, cube, time_range):
+    @staticmethod
+    def subset(forecasts, product):
+        """
+        Select the variables, levels, leads and lat/lon box of a product spec from a forecasts dataset.
+            Returns:
+              the subset, None if none of the product leads are in the dataset
+        """
+        variables = [var for var in product['variables'] if var in forecasts]
+        forecasts = forecasts[variables]
+        if product['levels'] is not None and 'level' in forecasts.dims:
+            forecasts = forecasts.sel(level=product['levels'])
+        if product['leads'] is not None:
+            hours = forecasts['time'].values // np.timedelta64(1, 'h')
+            forecasts = forecasts.isel(time=np.isin(hours, product['leads']))
+            if len(forecasts['time']) == 0:
+                return None
+        if product['box'] is not None:
+            lat_min, lat_max, lon_min, lon_max = product['box']
+            lat, lon = forecasts['lat'].values, forecasts['lon'].values
+            if lon_min <= lon_max:
+                lon_mask = (lon >= lon_min) & (lon <= lon_max)
+            else:
+                lon_mask = (lon >= lon_min) | (lon <= lon_max)
+            forecasts = forecasts.isel(lat=(lat >= lat_min) & (lat <= lat_max), lon=lon_mask)
+            if lon_min > lon_max:
+                # Keep the longitudes of a box across 0 increasing, from lon_min - 360 to lon_max
+                lon = forecasts['lon'].values
+                forecasts = forecasts.assign_coords(lon=np.where(lon >= lon_min, lon - 360, lon)).sortby('lon')
+        return forecasts
+
+    def timer(self, phase):
+        return nullcontext() if self.profiler is None else self.profiler.timer(phase)
+
+    def set_packing(self, grib_message, var_name):
+        """
+        Apply the configured packing type and precision to a GRIB message.
+        """
+        packing_type = None if self.packing == 'simple' else PACKING_TYPES[self.packing]
+        bits_per_value = int(self.precision[var_name]) if var_name in self.precision else None
+        repack(grib_message, packing_type, bits_per_value)
+
+    def packed_messages(self, cube, var_name):
+        """
+        Generate GRIB messages from cube with the configured packing.
+        """
+        for cube, grib_message in iris_grib.save_pairs_from_cube(cube):
+            self.set_packing(grib_message, var_name)
+            yield grib_message
+
+    def tweaked_messages(self, cube, time_range, var_name=None):
         """
         Adjust GRIB messages based on cube properties.
         """
@@ -55,41 +200,61 @@ class Netcdf2Grib:
                 eccodes.codes_set(grib_message, 'parameterCategory', 3)
                 eccodes.codes_set(grib_message, 'parameterNumber', 1)
                 eccodes.codes_set(grib_message, 'typeOfFirstFixedSurface', 101)
+            self.set_packing(grib_message, var_name)
         yield grib_message
 
     #def save_grib2(self, dates, forecasts, outdir):
-    def save_grib2(self, dates, forecasts, gefs_member, outdir):
+    def save_grib2(self, dates, forecasts, gefs_member, outdir, on_file_written=None, skip_file=None, product=None):
         """
         Convert netCDF file to GRIB2 format file.
             Args:
               dates: array of datetime object, from the source file
               forecasts: xarray forecasts dataset
               outdir: output directory
+              on_file_written: optional callable, called with the paths of each lead's grib2
+                               file and its index file as soon as both are closed
+              skip_file: optional callable, returns True for grib2 files that are already
+                         complete (e.g. verified by a manifest) and need not be encoded again
+              product: optional product spec (see load_product), only its subset is saved
         
             Returns:
               No return values, will save to grib2 file
         """
-        forecasts = forecasts.reindex(lat=list(reversed(forecasts.lat)))
+        if product is not None:
+            forecasts = self.subset(forecasts, product)
+            if forecasts is None:
+                return
+
+        with self.timer('preprocess'):
+            forecasts = forecasts.reindex(lat=list(reversed(forecasts.lat)))
 
-        for var in forecasts.variables:
-            if 'batch' in forecasts[var].dims:
-                forecasts[var] = forecasts[var].squeeze(dim='batch')
+            for var in forecasts.variables:
+                if 'batch' in forecasts[var].dims:
+                    forecasts[var] = forecasts[var].squeeze(dim='batch')
 
-        # Update units
-        forecasts['level'] = forecasts['level'] * 100
-        forecasts['level'].attrs['long_name'] = 'pressure'
-        forecasts['level'].attrs['units'] = 'Pa'
-        forecasts['geopotential'] = forecasts['geopotential'] / 9.80665
-        if 'total_precipitation_6hr' in forecasts:
-            forecasts['total_precipitation_6hr'] = (forecasts['total_precipitation_6hr'].clip(min=0)) * 1000
-            forecasts['total_precipitation_cumsum'] = forecasts['total_precipitation_6hr'].cumsum(axis=0)
+            # Update units
+            if 'level' in forecasts.coords:
+                forecasts['level'] = forecasts['level'] * 100
+                forecasts['level'].attrs['long_name'] = 'pressure'
+                forecasts['level'].attrs['units'] = 'Pa'
+            if 'geopotential' in forecasts:
+                forecasts['geopotential'] = forecasts['geopotential'] / 9.80665
+            if 'total_precipitation_6hr' in forecasts:
+                forecasts['total_precipitation_6hr'] = (forecasts['total_precipitation_6hr'].clip(min=0)) * 1000
+                # A precomputed accumulation (e.g. a single lead of an ensemble product) is kept as is
+                if 'total_precipitation_cumsum' in forecasts:
+                    forecasts['total_precipitation_cumsum'] = forecasts['total_precipitation_cumsum'] * 1000
+                else:
+                    forecasts['total_precipitation_cumsum'] = forecasts['total_precipitation_6hr'].cumsum(axis=0)
 
         #filename = os.path.join(outdir, "forecast_to_grib2.nc")
-        filename = os.path.join(outdir, f"forecast_to_grib2_{gefs_member}.nc")
-        forecasts.to_netcdf(filename)
+        filename = os.path.join(outdir, f"forecast_to_grib2_{gefs_member}_{os.getpid()}.nc")
+        with self.timer('netcdf_write'):
+            forecasts.to_netcdf(filename)
 
         # Load cubes from netCDF file
-        cubes = iris.load(filename)
+        with self.timer('iris_load'):
+            cubes = iris.load(filename)
         times = cubes[0].coord('time').points
         forecast_starttime = dates[0][1]
         cycle = forecast_starttime.hour
@@ -111,59 +276,74 @@ class Netcdf2Grib:
             outfile = os.path.join(outdir, f'pmlgefs{gefs_member}.t{cycle:02d}z.pgrb2.0p25.f{hrs:03d}')
             print(outfile)
 
-            for cube in sorted(cubes, key=lambda cube: cube.name()):
-                var_name = cube.name()
-
-                # Adjust cube for different variables
-                time_coord_dim = cube.coord_dims('time')
-                cube.remove_coord('time')
-                cube.add_dim_coord(new_time_coord, time_coord_dim)
-
-                hour_6 = iris.Constraint(time=iris.time.PartialDateTime(month=date.month, day=date.day, hour=date.hour))
-                cube_slice = cube.extract(hour_6)
-                cube_slice.coord('latitude').coord_system = iris.coord_systems.GeogCS(4326)
-                cube_slice.coord('longitude').coord_system = iris.coord_systems.GeogCS(4326)
-
-                if len(cube_slice.data.shape) == 3:
-                    levels = cube_slice.coord('pressure').points
-                    for level in levels:
-                        cube_slice_level = cube_slice.extract(iris.Constraint(pressure=level))
-                        cube_slice_level.add_aux_coord(iris.coords.DimCoord(hrs, standard_name='forecast_period', units='hours'))
-                        cube_slice_level.standard_name = self.ATTR_MAPS[var_name][1]
-                        cube_slice_level.units = self.ATTR_MAPS[var_name][2]
-                        iris.save(cube_slice_level, outfile, saver='grib2', append=True)
-                else:
-                    cube_slice.add_aux_coord(iris.coords.DimCoord(hrs, standard_name='forecast_period', units='hours'))
-                    cube_slice.standard_name = self.ATTR_MAPS[var_name][1]
-                    cube_slice.units = self.ATTR_MAPS[var_name][2]
-
-                    if var_name not in ['mean_sea_level_pressure', 'total_precipitation_6hr', 'total_precipitation_cumsum']:
-                        cube_slice.add_aux_coord(iris.coords.DimCoord(self.ATTR_MAPS[var_name][0], standard_name='height', units='m'))
-                        iris.save(cube_slice, outfile, saver='grib2', append=True)
-                    elif var_name == 'total_precipitation_6hr':
-                        iris_grib.save_messages(self.tweaked_messages(cube_slice, f'{hrs-6}-{hrs}'), outfile, append=True)
-                    elif var_name == 'total_precipitation_cumsum':
-                        iris_grib.save_messages(self.tweaked_messages(cube_slice, f'0-{hrs}'), outfile, append=True)
-                    elif var_name == 'mean_sea_level_pressure':
-                        cube_slice.add_aux_coord(iris.coords.DimCoord(self.ATTR_MAPS[var_name][0], standard_name='altitude', units='m'))
-                        iris_grib.save_messages(self.tweaked_messages(cube_slice, f'{hrs-6}-{hrs}'), outfile, append=True)
+            if skip_file is not None and skip_file(outfile):
+                print(f'{outfile} is complete, skipping')
+                if on_file_written is not None:
+                    on_file_written(*[f for f in [outfile, f"{outfile}.idx"] if os.path.isfile(f)])
+                continue
+
+            # Messages are appended, remove a partial file left by an interrupted run
+            if os.path.isfile(outfile):
+                os.remove(outfile)
+
+            with self.timer(f'encode_f{hrs:03d}'):
+                for cube in sorted(cubes, key=lambda cube: cube.name()):
+                    var_name = cube.name()
+
+                    # Adjust cube for different variables
+                    time_coord_dim = cube.coord_dims('time')
+                    cube.remove_coord('time')
+                    cube.add_dim_coord(new_time_coord, time_coord_dim)
+
+                    hour_6 = iris.Constraint(time=iris.time.PartialDateTime(month=date.month, day=date.day, hour=date.hour))
+                    cube_slice = cube.extract(hour_6)
+                    cube_slice.coord('latitude').coord_system = iris.coord_systems.GeogCS(4326)
+                    cube_slice.coord('longitude').coord_system = iris.coord_systems.GeogCS(4326)
+
+                    if len(cube_slice.data.shape) == 3:
+                        levels = cube_slice.coord('pressure').points
+                        for level in levels:
+                            cube_slice_level = cube_slice.extract(iris.Constraint(pressure=level))
+                            cube_slice_level.add_aux_coord(iris.coords.DimCoord(hrs, standard_name='forecast_period', units='hours'))
+                            cube_slice_level.standard_name = self.ATTR_MAPS[var_name][1]
+                            cube_slice_level.units = self.ATTR_MAPS[var_name][2]
+                            iris_grib.save_messages(self.packed_messages(cube_slice_level, var_name), outfile, append=True)
+                    else:
+                        cube_slice.add_aux_coord(iris.coords.DimCoord(hrs, standard_name='forecast_period', units='hours'))
+                        cube_slice.standard_name = self.ATTR_MAPS[var_name][1]
+                        cube_slice.units = self.ATTR_MAPS[var_name][2]
+
+                        if var_name not in ['mean_sea_level_pressure', 'total_precipitation_6hr', 'total_precipitation_cumsum']:
+                            cube_slice.add_aux_coord(iris.coords.DimCoord(self.ATTR_MAPS[var_name][0], standard_name='height', units='m'))
+                            iris_grib.save_messages(self.packed_messages(cube_slice, var_name), outfile, append=True)
+                        elif var_name == 'total_precipitation_6hr':
+                            iris_grib.save_messages(self.tweaked_messages(cube_slice, f'{hrs-6}-{hrs}', var_name), outfile, append=True)
+                        elif var_name == 'total_precipitation_cumsum':
+                            iris_grib.save_messages(self.tweaked_messages(cube_slice, f'0-{hrs}', var_name), outfile, append=True)
+                        elif var_name == 'mean_sea_level_pressure':
+                            cube_slice.add_aux_coord(iris.coords.DimCoord(self.ATTR_MAPS[var_name][0], standard_name='altitude', units='m'))
+                            iris_grib.save_messages(self.tweaked_messages(cube_slice, f'{hrs-6}-{hrs}', var_name), outfile, append=True)
 
             # Use wgrib2 to generate index files
             output_idx_file = f"{outfile}.idx"
             
-            # Construct the wgrib2 command
-            wgrib2_command = ['wgrib2', '-s', outfile]
+            with self.timer('idx'):
+                # Construct the wgrib2 command
+                wgrib2_command = ['wgrib2', '-s', outfile]
             
-            try:
-                # Open the output file for writing
-                with open(output_idx_file, "w") as f_out:
-                    # Execute the wgrib2 command and redirect stdout to the output file
-                    subprocess.run(wgrib2_command, stdout=f_out, check=True)
+                try:
+                    # Open the output file for writing
+                    with open(output_idx_file, "w") as f_out:
+                        # Execute the wgrib2 command and redirect stdout to the output file
+                        subprocess.run(wgrib2_command, stdout=f_out, check=True)
             
-                print(f"Index file created successfully: {output_idx_file}")
+                    print(f"Index file created successfully: {output_idx_file}")
             
-            except subprocess.CalledProcessError as e:
-                print(f"Error running wgrib2 command: {e}")
+                except subprocess.CalledProcessError as e:
+                    print(f"Error running wgrib2 command: {e}")
+
+            if on_file_written is not None:
+                on_file_written(*[f for f in [outfile, output_idx_file] if os.path.isfile(f)])
     
 
         # Remove intermediate netCDF file
@@ -0,0 +1,218 @@
+'''
+Description: Benchmark Netcdf2Grib.save_grib2 on synthetic forecast datasets shaped like GraphCast output
+             (13 or 37 pressure levels, 0.25 degree or reduced grids, any number of 6-hourly leads, with
+             total_precipitation_6hr). save_grib2 is timed end to end and by phase: preprocessing, the
+             intermediate netcdf write, the iris load, the encoding of every lead and the wgrib2 index.
+             The output is validated with eccodes (message count, grid, steps, no missing values, index
+             lines, decoded 2m temperature against the source), e.g.
+                 python utils/nc2grib_benchmark.py -l 13 -r 0.25 -n 4 -p simple,complex -o nc2grib.json
+Revision history:
+    -20261019: initial code
+'''
+import os
+import json
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+from time import perf_counter
+
+import eccodes
+import numpy as np
+import xarray
+
+from nc2grib import Netcdf2Grib, PACKING_TYPES
+from profiling import Profiler
+
+PRESSURE_LEVELS = {
+    13: [50, 100, 150, 200, 250, 300, 400, 500, 600, 700, 850, 925, 1000],
+    37: [1, 2, 3, 5, 7, 10, 20, 30, 50, 70, 100, 125, 150, 175, 200, 225, 250, 300, 350, 400, 450, 500,
+         550, 600, 650, 700, 750, 775, 800, 825, 850, 875, 900, 925, 950, 975, 1000],
+}
+
+# (mean, amplitude) of the synthetic fields in GraphCast units, so the packed values have realistic ranges
+SURFACE_VARIABLES = {
+    '2m_temperature': (280.0, 30.0),
+    'mean_sea_level_pressure': (101325.0, 2000.0),
+    '10m_u_component_of_wind': (0.0, 10.0),
+    '10m_v_component_of_wind': (0.0, 10.0),
+}
+ATMOSPHERIC_VARIABLES = {
+    'temperature': (250.0, 30.0),
+    'geopotential': (50000.0, 5000.0),
+    'u_component_of_wind': (5.0, 15.0),
+    'v_component_of_wind': (0.0, 10.0),
+    'vertical_velocity': (0.0, 0.5),
+    'specific_humidity': (0.005, 0.004),
+}
+
+
+def synthetic_forecasts(num_levels=13, resolution=0.25, num_leads=4, seed=0):
+    """
+    Forecasts dataset in the layout of the rollout predictions: (batch, time, [level], lat, lon) with time
+    relative to the forecast start (6h, 12h, ...), smooth large-scale fields plus noise.
+    """
+    rng = np.random.default_rng(seed)
+    lat = np.linspace(-90, 90, int(round(180 / resolution)) + 1, dtype=np.float32)
+    lon = np.arange(0, 360, resolution, dtype=np.float32)
+    level = np.array(PRESSURE_LEVELS[num_levels], dtype=np.int32)
+    time = (np.arange(1, num_leads + 1) * np.timedelta64(6, 'h')).astype('timedelta64[ns]')
+    pattern = (np.cos(np.deg2rad(lat))[:, np.newaxis] * np.sin(np.deg2rad(lon))[np.newaxis, :]).astype(np.float32)
+
+    def field(shape, mean, amplitude):
+        noise = rng.standard_normal(shape, dtype=np.float32)
+        return (mean + amplitude * (pattern + 0.1 * noise)).astype(np.float32)
+
+    data_vars = {}
+    for var, (mean, amplitude) in SURFACE_VARIABLES.items():
+        data_vars[var] = (('batch', 'time', 'lat', 'lon'), field((1, num_leads, len(lat), len(lon)), mean, amplitude))
+    for var, (mean, amplitude) in ATMOSPHERIC_VARIABLES.items():
+        data_vars[var] = (('batch', 'time', 'level', 'lat', 'lon'), field((1, num_leads, len(level), len(lat), len(lon)), mean, amplitude))
+    # Precipitation in m, mostly dry
+    precip = rng.exponential(0.002, (1, num_leads, len(lat), len(lon))) * (rng.random((1, num_leads, len(lat), len(lon))) > 0.6)
+    data_vars['total_precipitation_6hr'] = (('batch', 'time', 'lat', 'lon'), precip.astype(np.float32))
+
+    return xarray.Dataset(data_vars, coords={'lat': lat, 'lon': lon, 'level': level, 'time': time})
+
+
+def expected_messages(forecasts):
+    """Number of grib2 messages per lead: one per level of the atmospheric variables, plus the precipitation accumulation."""
+    count = 0
+    for var in forecasts.data_vars:
+        count += len(forecasts['level']) if 'level' in forecasts[var].dims else 1
+    if 'total_precipitation_6hr' in forecasts:
+        count += 1
+    return count
+
+
+def validate(outfile, forecasts, lead):
+    """
+    Check one lead's grib2 file and index with eccodes.
+        Returns:
+          list of error messages, empty if the file is valid
+    """
+    errors = []
+    nlat, nlon = len(forecasts['lat']), len(forecasts['lon'])
+    messages = 0
+    fields = set()
+    t2m = None
+    with open(outfile, 'rb') as f:
+        while True:
+            gid = eccodes.codes_grib_new_from_file(f)
+            if gid is None:
+                break
+            try:
+                messages += 1
+                key = (eccodes.codes_get(gid, 'shortName'), eccodes.codes_get(gid, 'typeOfLevel'),
+                       eccodes.codes_get(gid, 'level'), eccodes.codes_get(gid, 'stepRange'))
+                if key in fields:
+                    errors.append(f'duplicate message {key}')
+                fields.add(key)
+                if (eccodes.codes_get(gid, 'Ni'), eccodes.codes_get(gid, 'Nj')) != (nlon, nlat):
+                    errors.append(f'{key}: grid {eccodes.codes_get(gid, "Ni")}x{eccodes.codes_get(gid, "Nj")}, expected {nlon}x{nlat}')
+                if eccodes.codes_get(gid, 'endStep') != lead:
+                    errors.append(f'{key}: end step {eccodes.codes_get(gid, "endStep")}, expected {lead}')
+                if eccodes.codes_get(gid, 'numberOfMissing') != 0:
+                    errors.append(f'{key}: {eccodes.codes_get(gid, "numberOfMissing")} missing values')
+                if key[0] == '2t':
+                    t2m = eccodes.codes_get_values(gid)
+            finally:
+                eccodes.codes_release(gid)
+
+    expected = expected_messages(forecasts)
+    if messages != expected:
+        errors.append(f'{messages} messages, expected {expected}')
+
+    idx_file = f'{outfile}.idx'
+    if not os.path.isfile(idx_file):
+        errors.append('index file is missing')
+    else:
+        with open(idx_file) as f:
+            lines = sum(1 for line in f if line.strip())
+        if lines != messages:
+            errors.append(f'{lines} index lines for {messages} messages')
+
+    if t2m is None:
+        errors.append('2m temperature is missing')
+    else:
+        source = forecasts['2m_temperature'].sel(time=np.timedelta64(lead, 'h')).values
+        # The grib2 file is north to south, compare the field statistics
+        if abs(float(np.mean(t2m)) - float(np.mean(source))) > 0.1 or abs(float(np.max(t2m)) - float(np.max(source))) > 0.1:
+            errors.append(f'2m temperature mean/max {np.mean(t2m):.2f}/{np.max(t2m):.2f} differ from the source {np.mean(source):.2f}/{np.max(source):.2f}')
+    return errors
+
+
+def run_case(num_levels, resolution, num_leads, packing='simple', precision=None, seed=0):
+    forecasts = synthetic_forecasts(num_levels, resolution, num_leads, seed)
+    start = datetime(2025, 1, 1, 0)
+    dates = [[start - timedelta(hours=6), start]]
+    profiler = Profiler(True)
+    converter = Netcdf2Grib(packing=packing, precision=precision, profiler=profiler)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        files = []
+        begin = perf_counter()
+        converter.save_grib2(dates, forecasts.copy(), 'c00', tmpdir, on_file_written=lambda *written: files.append(written[0]))
+        total = perf_counter() - begin
+
+        errors = {}
+        for outfile in files:
+            lead = int(outfile[-3:])
+            file_errors = validate(outfile, forecasts, lead)
+            if file_errors:
+                errors[os.path.basename(outfile)] = file_errors
+        size = sum(os.path.getsize(f) for f in files)
+
+    phases = profiler.phases
+    encode = {phase: seconds for phase, seconds in phases.items() if phase.startswith('encode_')}
+    return {
+        'levels': num_levels,
+        'resolution': resolution,
+        'leads': num_leads,
+        'packing': packing,
+        'messages_per_lead': expected_messages(forecasts),
+        'total_seconds': total,
+        'phases': {phase: seconds for phase, seconds in phases.items() if not phase.startswith('encode_')},
+        'encode_seconds_by_lead': encode,
+        'encode_seconds': sum(encode.values()),
+        'seconds_per_lead': total / num_leads,
+        'size_bytes': size,
+        'valid': not errors and len(files) == num_leads,
+        'errors': errors,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark Netcdf2Grib on synthetic GraphCast forecasts")
+    parser.add_argument("-l", "--levels", help="comma separated numbers of pressure levels (13, 37)", default="13")
+    parser.add_argument("-r", "--resolution", help="comma separated grid resolutions in degrees", default="0.25")
+    parser.add_argument("-n", "--leads", help="number of 6-hourly leads", default=2)
+    parser.add_argument("-p", "--packing", help="comma separated packing types", default="simple")
+    parser.add_argument("--precision", help="json file with bitsPerValue per variable", default=None)
+    parser.add_argument("-o", "--output", help="write results to a json file", default=None)
+    args = parser.parse_args()
+
+    precision = None
+    if args.precision is not None:
+        with open(args.precision, 'r') as f:
+            precision = json.load(f)
+
+    results = []
+    for num_levels in [int(n) for n in args.levels.split(',')]:
+        for resolution in [float(r) for r in args.resolution.split(',')]:
+            for packing in args.packing.split(','):
+                if packing not in PACKING_TYPES:
+                    raise ValueError(f"Packing {packing} is not supported, options: {list(PACKING_TYPES)}")
+                results.append(run_case(num_levels, resolution, int(args.leads), packing, precision))
+
+    print(f"{'levels':>6} {'res':>5} {'packing':>8} {'total (s)':>10} {'nc write':>9} {'iris':>7} {'encode':>8} {'idx':>7} {'MB':>8} {'valid':>6}")
+    for r in results:
+        print(f"{r['levels']:>6} {r['resolution']:>5} {r['packing']:>8} {r['total_seconds']:>10.2f} {r['phases'].get('netcdf_write', 0):>9.2f} "
+              f"{r['phases'].get('iris_load', 0):>7.2f} {r['encode_seconds']:>8.2f} {r['phases'].get('idx', 0):>7.2f} "
+              f"{r['size_bytes'] / 1e6:>8.1f} {str(r['valid']):>6}")
+        for file, errors in r['errors'].items():
+            for error in errors:
+                print(f"  {file}: {error}")
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=4)
@@ -0,0 +1,118 @@
+""" Minimal staged pipeline with bounded queues.
+
+    Jobs (dicts) flow through a list of stages, each served by its own pool of workers.
+    Stages are connected by bounded queues, so an upstream stage can work ahead on the
+    next jobs while a downstream stage is busy, but only by queue_size jobs. Workers are
+    local processes (backend='process') or threads (backend='thread').
+
+    A stage function takes a job dict and returns it (updated). A failed job is marked
+    with job['error'] and passed through the remaining stages untouched; the time spent
+    in each stage is recorded in job['timings'].
+
+    History:
+        10/19/2026: initial code
+"""
+
+import time
+import queue
+import threading
+import multiprocessing
+
+
+class Stage:
+    def __init__(self, name, fn, num_workers=1, queue_size=2):
+        """
+            Args:
+              name: stage name used in timings and errors
+              fn: picklable function job -> job
+              num_workers: number of workers serving this stage
+              queue_size: maximum number of jobs waiting in front of this stage
+        """
+        self.name = name
+        self.fn = fn
+        self.num_workers = num_workers
+        self.queue_size = queue_size
+
+
+def _worker(stage_name, fn, in_queue, out_queue):
+    while True:
+        job = in_queue.get()
+        if job is None:
+            break
+
+        if 'error' not in job:
+            start = time.time()
+            try:
+                job = fn(job)
+            except Exception as e:
+                print(f"{stage_name} failed for {job.get('name')}: {str(e)}")
+                job['error'] = f'{stage_name}: {str(e)}'
+            job.setdefault('timings', {})[stage_name] = time.time() - start
+
+        out_queue.put(job)
+
+
+class Pipeline:
+    def __init__(self, stages, backend='process'):
+        if backend not in ('process', 'thread'):
+            raise ValueError(f"Backend {backend} is not supported, options: process, thread")
+        self.stages = stages
+        self.backend = backend
+
+    def _queue(self, maxsize=0):
+        if self.backend == 'process':
+            return self.ctx.Queue(maxsize)
+        return queue.Queue(maxsize)
+
+    def _start(self, stage, in_queue, out_queue):
+        workers = []
+        for i in range(stage.num_workers):
+            args = (stage.name, stage.fn, in_queue, out_queue)
+            if self.backend == 'process':
+                worker = self.ctx.Process(target=_worker, args=args, name=f'{stage.name}-{i}')
+            else:
+                worker = threading.Thread(target=_worker, args=args, name=f'{stage.name}-{i}')
+            worker.start()
+            workers.append(worker)
+        return workers
+
+    def run(self, jobs):
+        """
+        Push jobs through all stages.
+            Returns:
+              list of finished job dicts, in completion order
+        """
+        # spawn, so that workers do not inherit state (e.g. an initialized jax runtime) from the parent
+        self.ctx = multiprocessing.get_context('spawn')
+        queues = [self._queue(stage.queue_size) for stage in self.stages] + [self._queue()]
+        workers = [self._start(stage, queues[i], queues[i + 1]) for i, stage in enumerate(self.stages)]
+
+        def feed_and_join():
+            for job in jobs:
+                queues[0].put(job)
+            # Once all workers of a stage are done, stop the next stage
+            for i, stage in enumerate(self.stages):
+                for _ in range(stage.num_workers):
+                    queues[i].put(None)
+                for worker in workers[i]:
+                    worker.join()
+            queues[-1].put(None)
+
+        start = time.time()
+        orchestrator = threading.Thread(target=feed_and_join, daemon=True)
+        orchestrator.start()
+
+        results = []
+        while True:
+            job = queues[-1].get()
+            if job is None:
+                break
+            status = 'failed' if 'error' in job else 'done'
+            timings = ', '.join(f'{name} {seconds:.1f}s' for name, seconds in job.get('timings', {}).items())
+            print(f"{job.get('name')} {status} ({timings})")
+            results.append(job)
+        orchestrator.join()
+
+        failed = sum('error' in job for job in results)
+        print(f'Pipeline finished {len(results)} jobs in {time.time() - start:.1f} s, {failed} failed')
+        return results
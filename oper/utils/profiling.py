@@ -0,0 +1,182 @@
+""" Optional timing and device-memory instrumentation of a GraphCast run.
+
+    Phases (checkpoint, stats and IC loading, grib2 encoding, ...) are timed with the
+    timed decorator or the timer context manager, rollout steps by wrapping the
+    prediction generator with steps(). Device memory is sampled after every step. The
+    first step includes the jit compilation, which is estimated as its excess over the
+    median step. A jax.profiler trace can be recorded for a window of steps. Everything
+    is written as json per member, e.g.
+        {
+            "member": "c00", "cycle": "2025010100",
+            "phases": {"checkpoint_load": 4.1, "ic_load": 2.0, ...},
+            "compile_seconds": 35.2,
+            "steps": [{"step": 1, "seconds": 36.0, "bytes_in_use": ..., "peak_bytes_in_use": ...}, ...],
+            "memory": {"peak_bytes_in_use": ..., "bytes_limit": ..., "peak_fraction": 0.71},
+            "warnings": []
+        }
+
+    History:
+        10/19/2026: initial code
+        10/19/2026: wait for each step's arrays, so step timings measure computation and not dispatch
+"""
+
+import json
+import socket
+import functools
+import statistics
+from time import perf_counter
+from contextlib import contextmanager
+
+# Warn when the device memory high-water mark exceeds this fraction of the device limit
+MEMORY_WARNING_FRACTION = 0.9
+
+
+def timed(phase):
+    """Method decorator timing the call as a phase of self.profiler."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(self, *args, **kwargs):
+            with self.profiler.timer(phase):
+                return fn(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class Profiler:
+    def __init__(self, enabled=False, member=None, cycle=None, output_file=None, trace_steps=None, trace_dir=None):
+        """
+            Args:
+              enabled: record anything at all, a disabled profiler only passes calls through
+              output_file: json file written by write()
+              trace_steps: (first, last) rollout steps recorded with jax.profiler, 1-based
+              trace_dir: directory of the jax.profiler trace (tensorboard format)
+        """
+        self.enabled = enabled
+        self.member = member
+        self.cycle = cycle
+        self.output_file = output_file
+        self.trace_steps = trace_steps
+        self.trace_dir = trace_dir
+        self.phases = {}
+        self.records = []
+        self.warnings = []
+        self.tracing = False
+
+    @contextmanager
+    def timer(self, phase):
+        """Time a block, repeated phases are summed."""
+        if not self.enabled:
+            yield
+            return
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[phase] = self.phases.get(phase, 0.0) + perf_counter() - start
+
+    @staticmethod
+    def memory_stats():
+        """Memory statistics of the local devices that report them (e.g. GPUs), summed over devices."""
+        import jax
+
+        totals = {}
+        for device in jax.local_devices():
+            stats = device.memory_stats() if hasattr(device, 'memory_stats') else None
+            for key in ('bytes_in_use', 'peak_bytes_in_use', 'bytes_limit'):
+                if stats and key in stats:
+                    totals[key] = totals.get(key, 0) + stats[key]
+        return totals
+
+    def _trace(self, step, before):
+        """Start the jax.profiler trace before the first step of the window, stop it after the last."""
+        import jax
+
+        first, last = self.trace_steps
+        if before and step == first and not self.tracing:
+            jax.profiler.start_trace(self.trace_dir)
+            self.tracing = True
+        elif not before and step == last and self.tracing:
+            jax.profiler.stop_trace()
+            self.tracing = False
+
+    @staticmethod
+    def block_until_ready(prediction):
+        """Wait for the device arrays of a prediction dataset (host arrays are returned at once)."""
+        import jax
+        from graphcast import xarray_jax
+        jax.block_until_ready([xarray_jax.unwrap_data(da, require_jax=False) for da in prediction.data_vars.values()])
+
+    def steps(self, predictions):
+        """Pass the rollout predictions through, timing the computation of each step."""
+        if not self.enabled:
+            yield from predictions
+            return
+
+        iterator = iter(predictions)
+        step = 0
+        try:
+            while True:
+                if self.trace_steps is not None:
+                    self._trace(step + 1, before=True)
+                start = perf_counter()
+                try:
+                    prediction = next(iterator)
+                except StopIteration:
+                    break
+                # next() returns once the step is dispatched, wait for its computation
+                self.block_until_ready(prediction)
+                step += 1
+                record = {'step': step, 'seconds': perf_counter() - start}
+                record.update(self.memory_stats())
+                self.records.append(record)
+                if self.trace_steps is not None:
+                    self._trace(step, before=False)
+                yield prediction
+        finally:
+            if self.tracing:
+                import jax
+                jax.profiler.stop_trace()
+                self.tracing = False
+
+    def summary(self):
+        seconds = [r['seconds'] for r in self.records]
+        summary = {
+            'member': self.member,
+            'cycle': self.cycle,
+            'host': socket.gethostname(),
+            'phases': self.phases,
+            'num_steps': len(seconds),
+            'compile_seconds': None,
+            'median_step_seconds': None,
+            'steps': self.records,
+            'memory': {},
+            'warnings': list(self.warnings),
+        }
+        if len(seconds) > 1:
+            median = statistics.median(seconds[1:])
+            summary['median_step_seconds'] = median
+            summary['compile_seconds'] = max(seconds[0] - median, 0.0)
+
+        peaks = [r['peak_bytes_in_use'] for r in self.records if 'peak_bytes_in_use' in r]
+        limits = [r['bytes_limit'] for r in self.records if 'bytes_limit' in r]
+        if peaks:
+            summary['memory']['peak_bytes_in_use'] = max(peaks)
+        if peaks and limits:
+            fraction = max(peaks) / limits[-1]
+            summary['memory'].update({'bytes_limit': limits[-1], 'peak_fraction': fraction})
+            if fraction > MEMORY_WARNING_FRACTION:
+                summary['warnings'].append(f'device memory high-water mark at {100 * fraction:.0f}% of the limit')
+        return summary
+
+    def write(self):
+        """Write the json summary, returns it (None if disabled)."""
+        if not self.enabled:
+            return None
+        summary = self.summary()
+        for warning in summary['warnings']:
+            print(f"Warning: {warning}")
+        if self.output_file is not None:
+            with open(self.output_file, 'w') as f:
+                json.dump(summary, f, indent=4)
+            print(f"Saved timings and memory statistics to {self.output_file}")
+        return summary
@@ -0,0 +1,101 @@
+""" Paginated S3 listing index of a prefix, shared by processes through a disk cache.
+
+    A GEFS cycle prefix (.../gefs.YYYYMMDD/HH/atmos/) holds the files of all 31 members and
+    can exceed the 1000 keys of a single list_objects_v2 response. The index lists the prefix
+    once with full pagination and maps object basenames to keys, so the files of a member are
+    looked up without further requests. The listing is cached in a json file for a short time
+    and rebuilt by one process at a time (file lock), so the prep jobs of all members of a
+    cycle share a single listing:
+        index = S3ListingIndex(s3, bucket, prefix, cache_dir='/path/to/downloads')
+        key = index.get('gec00.t00z.pgrb2.0p25.f000')
+
+    History:
+        10/19/2026: initial code
+        10/19/2026: list_objects with sizes and modification times, for the input watcher
+"""
+
+import os
+import json
+import fcntl
+import re
+from time import time
+
+
+class S3ListingIndex:
+    def __init__(self, s3, bucket_name, prefix, cache_dir=None, ttl=300):
+        """
+            Args:
+              s3: boto3 s3 client
+              bucket_name, prefix: listed bucket and prefix
+              cache_dir: directory of the listing cache, not cached on disk if None
+              ttl: seconds a cached listing is used before the prefix is listed again
+        """
+        self.s3 = s3
+        self.bucket_name = bucket_name
+        self.prefix = prefix
+        self.ttl = ttl
+        self.path = None
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            name = re.sub(r'[^A-Za-z0-9.-]+', '_', f'{bucket_name}/{prefix}').strip('_')
+            self.path = os.path.join(cache_dir, f's3_listing_{name}.json')
+        self.keys = None
+        self.listed = 0
+
+    def list_objects(self):
+        """All objects (list_objects_v2 entries) under the prefix, following the continuation tokens."""
+        objects = []
+        paginator = self.s3.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket_name, Prefix=self.prefix):
+            objects.extend(page.get('Contents', []))
+        return objects
+
+    def list_keys(self):
+        return [obj['Key'] for obj in self.list_objects()]
+
+    def _read_cache(self):
+        """Cached (listing time, keys) if the cache is younger than the ttl, else None."""
+        try:
+            with open(self.path, 'r') as f:
+                cached = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        if time() - cached['listed'] > self.ttl:
+            return None
+        return cached['listed'], cached['keys']
+
+    def refresh(self, force=False):
+        """Load the listing from the cache or list the prefix (one process at a time) and cache it."""
+        if self.path is None:
+            self.listed, keys = time(), self.list_keys()
+        else:
+            cached = None if force else self._read_cache()
+            if cached is None:
+                with open(f'{self.path}.lock', 'w') as lock_file:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                    # Another process may have listed while this one waited for the lock
+                    cached = None if force else self._read_cache()
+                    if cached is None:
+                        cached = (time(), self.list_keys())
+                        # Write to a temporary file and rename, so a reader never sees a partial listing
+                        tmp_path = f'{self.path}.{os.getpid()}.tmp'
+                        with open(tmp_path, 'w') as f:
+                            json.dump({'bucket': self.bucket_name, 'prefix': self.prefix, 'listed': cached[0], 'keys': cached[1]}, f)
+                        os.replace(tmp_path, self.path)
+                        print(f"Listed {len(cached[1])} objects under s3://{self.bucket_name}/{self.prefix}")
+            self.listed, keys = cached
+        self.keys = {os.path.basename(key): key for key in keys}
+
+    def get(self, basename):
+        """
+        Key of an object by its basename, None if it is not in the listing. A missing object is
+        looked up again in a new listing once the current one is older than the ttl (e.g. a file
+        uploaded after the listing).
+        """
+        if self.keys is None:
+            self.refresh()
+        key = self.keys.get(basename)
+        if key is None and time() - self.listed > self.ttl:
+            self.refresh()
+            key = self.keys.get(basename)
+        return key
@@ -0,0 +1,242 @@
+""" Parallel S3 upload with multipart transfers and skip-unchanged.
+
+    Files are fanned out across a thread pool, large files use tuned multipart settings,
+    and objects whose size and md5 already match the local file are skipped, so a rerun
+    only uploads what changed. Can replace `aws s3 sync` in the cycle scripts:
+        python utils/s3_upload.py -s /path/to/forecasts -b bucket -p prefix --profile gcgfs
+
+    IncrementalPublisher uploads files in the background while they are still being
+    produced, e.g. each forecast lead right after Netcdf2Grib closes it.
+
+    History:
+        10/19/2026: initial code
+        10/19/2026: IncrementalPublisher with bounded queue and completion marker
+        10/19/2026: record uploads in the stage manifest
+"""
+
+import os
+import argparse
+import hashlib
+import json
+import queue
+import threading
+from datetime import datetime, timezone
+from time import perf_counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+MB = 1024 * 1024
+
+
+class S3Uploader:
+    def __init__(self, bucket_name, profile_name=None, max_workers=16, multipart_threshold=16 * MB,
+                 multipart_chunksize=16 * MB, max_concurrency=4, skip_unchanged=True, manifest=None):
+        """
+            Args:
+              bucket_name: destination bucket
+              profile_name: aws profile, default credentials if None
+              max_workers: number of files uploaded in parallel
+              multipart_threshold, multipart_chunksize: multipart transfer settings in bytes
+              max_concurrency: parts uploaded in parallel for one file
+              skip_unchanged: skip objects whose size and md5 match the local file
+              manifest: optional StageManifest, uploads recorded there are skipped without a request
+        """
+        self.bucket_name = bucket_name
+        self.max_workers = max_workers
+        self.skip_unchanged = skip_unchanged
+        self.manifest = manifest
+
+        session = boto3.Session(profile_name=profile_name)
+        self.s3 = session.client('s3', config=Config(max_pool_connections=max_workers * max_concurrency))
+        self.transfer_config = TransferConfig(
+            multipart_threshold=multipart_threshold,
+            multipart_chunksize=multipart_chunksize,
+            max_concurrency=max_concurrency,
+            use_threads=True,
+        )
+
+    @staticmethod
+    def file_md5(local_path, blocksize=8 * MB):
+        md5 = hashlib.md5()
+        with open(local_path, 'rb') as f:
+            for block in iter(lambda: f.read(blocksize), b''):
+                md5.update(block)
+        return md5.hexdigest()
+
+    def is_unchanged(self, local_path, s3_key, md5):
+        """Compare size and md5 (object metadata, or ETag of single-part uploads) with the local file."""
+        try:
+            head = self.s3.head_object(Bucket=self.bucket_name, Key=s3_key)
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
+
+        if head['ContentLength'] != os.path.getsize(local_path):
+            return False
+        remote_md5 = head.get('Metadata', {}).get('md5') or head['ETag'].strip('"')
+        return remote_md5 == md5
+
+    def upload_file(self, local_path, s3_key):
+        """
+        Upload a single file.
+            Returns:
+              number of bytes uploaded, 0 if the object was unchanged
+        """
+        md5 = self.file_md5(local_path)
+        stage = f'upload:{s3_key}'
+        if self.skip_unchanged and self.manifest is not None and self.manifest.is_done(stage, {local_path: md5}):
+            return 0
+        if self.skip_unchanged and self.is_unchanged(local_path, s3_key, md5):
+            return 0
+
+        self.s3.upload_file(local_path, self.bucket_name, s3_key, Config=self.transfer_config,
+                            ExtraArgs={'Metadata': {'md5': md5}})
+        if self.manifest is not None:
+            self.manifest.mark_done(stage, [local_path], {local_path: md5})
+        return os.path.getsize(local_path)
+
+    def upload_files(self, files):
+        """
+        Upload (local_path, s3_key) pairs in parallel.
+            Returns:
+              dict with uploaded/skipped/failed counts, bytes, seconds and throughput in MB/s
+        """
+        stats = {'uploaded': 0, 'skipped': 0, 'failed': 0, 'bytes': 0}
+        start = perf_counter()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {executor.submit(self.upload_file, local_path, s3_key): local_path for local_path, s3_key in files}
+            for future in as_completed(futures):
+                try:
+                    nbytes = future.result()
+                except Exception as e:
+                    print(f"Error uploading {futures[future]}: {str(e)}")
+                    stats['failed'] += 1
+                    continue
+                if nbytes:
+                    stats['uploaded'] += 1
+                    stats['bytes'] += nbytes
+                else:
+                    stats['skipped'] += 1
+
+        stats['seconds'] = perf_counter() - start
+        stats['MB/s'] = stats['bytes'] / MB / stats['seconds'] if stats['seconds'] > 0 else 0.0
+        print(f"Uploaded {stats['uploaded']} files ({stats['bytes'] / MB:.1f} MB) in {stats['seconds']:.1f} s "
+              f"({stats['MB/s']:.1f} MB/s), skipped {stats['skipped']} unchanged, {stats['failed']} failed")
+        return stats
+
+    def upload_directory(self, local_dir, s3_prefix):
+        """Upload every file under local_dir, keeping the relative paths under s3_prefix."""
+        files = []
+        for root, dirs, filenames in os.walk(local_dir):
+            for filename in filenames:
+                local_path = os.path.join(root, filename)
+                relative_path = os.path.relpath(local_path, local_dir)
+                files.append((local_path, os.path.join(s3_prefix, relative_path)))
+
+        return self.upload_files(files)
+
+
+class IncrementalPublisher:
+    def __init__(self, uploader, local_dir, s3_prefix, max_queue=8, num_threads=4, marker_name='_COMPLETE'):
+        """
+        Background uploader draining a bounded queue; publish() blocks when the queue is full
+        so that encoding cannot run arbitrarily far ahead of the upload.
+            Args:
+              uploader: S3Uploader
+              local_dir: local root, keys are relative to it under s3_prefix
+              s3_prefix: destination prefix
+              max_queue: maximum number of queued file groups
+              num_threads: number of upload threads
+              marker_name: object written under s3_prefix by close() once everything is uploaded
+        """
+        self.uploader = uploader
+        self.local_dir = local_dir
+        self.s3_prefix = s3_prefix
+        self.marker_name = marker_name
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.lock = threading.Lock()
+        self.uploaded = []
+        self.failed = []
+        self.bytes = 0
+        self.start = perf_counter()
+        self.threads = [threading.Thread(target=self._worker, daemon=True) for _ in range(num_threads)]
+        for thread in self.threads:
+            thread.start()
+
+    def s3_key(self, local_path):
+        return os.path.join(self.s3_prefix, os.path.relpath(local_path, self.local_dir))
+
+    def publish(self, *local_paths):
+        """Queue a group of files, uploaded in the given order (e.g. grib2 file, then its .idx)."""
+        self.queue.put(local_paths)
+
+    def _worker(self):
+        while True:
+            local_paths = self.queue.get()
+            if local_paths is None:
+                self.queue.task_done()
+                break
+            for local_path in local_paths:
+                try:
+                    nbytes = self.uploader.upload_file(local_path, self.s3_key(local_path))
+                except Exception as e:
+                    print(f"Error uploading {local_path}: {str(e)}")
+                    with self.lock:
+                        self.failed.append(local_path)
+                    # Do not publish an index whose grib2 file failed
+                    break
+                with self.lock:
+                    self.uploaded.append(self.s3_key(local_path))
+                    self.bytes += nbytes
+            self.queue.task_done()
+
+    def close(self, extra_files=()):
+        """
+        Drain the queue, upload extra_files and write the completion marker.
+            Returns:
+              True if all files were uploaded and the marker was written
+        """
+        if extra_files:
+            self.publish(*extra_files)
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+
+        seconds = perf_counter() - self.start
+        print(f"Published {len(self.uploaded)} files ({self.bytes / MB:.1f} MB) in {seconds:.1f} s, {len(self.failed)} failed")
+        if self.failed:
+            print(f"Completion marker not written, failed files: {self.failed}")
+            return False
+
+        marker = {
+            'completed': datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'files': sorted(self.uploaded),
+        }
+        self.uploader.s3.put_object(Bucket=self.uploader.bucket_name, Key=os.path.join(self.s3_prefix, self.marker_name),
+                                    Body=json.dumps(marker, indent=4).encode())
+        return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Parallel upload of a directory to s3")
+    parser.add_argument("-s", "--source", help="local directory to upload", required=True)
+    parser.add_argument("-b", "--bucket", help="s3 bucket name", required=True)
+    parser.add_argument("-p", "--prefix", help="s3 prefix (destination directory)", required=True)
+    parser.add_argument("--profile", help="aws profile name", default=None)
+    parser.add_argument("-n", "--workers", help="number of files uploaded in parallel", default=16)
+    parser.add_argument("--chunksize", help="multipart chunk size in MB", default=16)
+    parser.add_argument("-f", "--force", help="upload even if the object is unchanged (yes or no)", default="no")
+
+    args = parser.parse_args()
+    chunksize = int(args.chunksize) * MB
+    uploader = S3Uploader(args.bucket, args.profile, int(args.workers), chunksize, chunksize,
+                          skip_unchanged=args.force.lower() != "yes")
+    stats = uploader.upload_directory(args.source, args.prefix)
+    if stats['failed']:
+        exit(1)
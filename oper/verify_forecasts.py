@@ -0,0 +1,373 @@
+'''
+Description: Verification of MLGEFS ensemble forecasts against GEFS analyses. The analyses are the ICs
+             written by gen_gefs_ics.py (the IC of cycle D holds the analyses at D-6h and D, in GraphCast
+             units and layout), the forecasts are either the pmlgefs<member> grib2 files, of which only
+             the verified messages are read through the byte offsets of their wgrib2 .idx files, or
+             in-memory forecast datasets from run_graphcast_ens.py. Scores per variable, level and lead:
+                 rmse, bias      latitude-weighted, of the ensemble mean
+                 acc             anomaly correlation of the ensemble mean, against a climatology file if
+                                 given, else against the latitude-weighted spatial means (pattern correlation)
+                 spread          latitude-weighted ensemble standard deviation
+                 spread_skill    spread / rmse, with the sqrt((n+1)/n) finite ensemble correction
+                 crps            latitude-weighted ensemble CRPS
+             Each field is scored with all members stacked in one array (sorted once for the CRPS), one
+             variable and level at a time, so memory is bounded by members x one field per worker, and
+             the leads are verified in parallel, e.g.
+                 python verify_forecasts.py 2025010100 -i /path/to/cycle/output -a /path/to/analysis/ics -l 64
+Revision history:
+    -20261019: initial code
+'''
+import os
+import glob
+import argparse
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+import numpy as np
+import xarray as xr
+import pygrib
+
+# (wgrib2 variable, level type) of the .idx lines of pmlgefs grib2 files -> GraphCast variable names
+IDX_VARIABLES = {
+    ('HGT', 'mb'): 'geopotential',
+    ('TMP', 'mb'): 'temperature',
+    ('SPFH', 'mb'): 'specific_humidity',
+    ('VVEL', 'mb'): 'vertical_velocity',
+    ('UGRD', 'mb'): 'u_component_of_wind',
+    ('VGRD', 'mb'): 'v_component_of_wind',
+    ('TMP', '2 m above ground'): '2m_temperature',
+    ('UGRD', '10 m above ground'): '10m_u_component_of_wind',
+    ('VGRD', '10 m above ground'): '10m_v_component_of_wind',
+    ('PRMSL', 'mean sea level'): 'mean_sea_level_pressure',
+}
+# Precipitation is not verified: the ICs carry no analysed precipitation
+VARIABLES = list(IDX_VARIABLES.values())
+METRICS = ['rmse', 'bias', 'acc', 'spread', 'spread_skill', 'crps']
+
+
+def read_idx(idx_file):
+    """
+    Byte ranges of the messages of a grib2 file from its wgrib2 -s index.
+        Returns:
+          dict of {(GraphCast variable, level or None): (offset, length)}, length None for the last message
+    """
+    entries = []
+    with open(idx_file, 'r') as f:
+        for line in f:
+            fields = line.strip().split(':')
+            if len(fields) < 5:
+                continue
+            offset, name, level = int(fields[1]), fields[3], fields[4]
+            if level.endswith(' mb'):
+                var_name, value = IDX_VARIABLES.get((name, 'mb')), int(float(level[:-len(' mb')]))
+            else:
+                var_name, value = IDX_VARIABLES.get((name, level)), None
+            entries.append((var_name, value, offset))
+
+    index = {}
+    for i, (var_name, level, offset) in enumerate(entries):
+        if var_name is not None:
+            length = entries[i + 1][2] - offset if i + 1 < len(entries) else None
+            index[(var_name, level)] = (offset, length)
+    return index
+
+
+def read_message(grib_file, offset, length):
+    """Decode one grib2 message at a byte offset, returns the field south to north."""
+    with open(grib_file, 'rb') as f:
+        f.seek(offset)
+        grb = pygrib.fromstring(f.read(length) if length is not None else f.read())
+    values = grb.values.astype('float32')
+    if grb['jScansPositively'] == 0:
+        values = values[::-1]
+    return values
+
+
+def find_analysis(analysis_dir, valid_time, member='c00'):
+    """
+    Analysis at a valid time from the ICs of gen_gefs_ics.py (the IC of cycle D holds D-6h and D).
+        Returns:
+          dataset (lat, lon, [level]) with ascending latitude, None if no IC holds the valid time
+    """
+    for date in (valid_time, valid_time + timedelta(hours=6)):
+        pattern = os.path.join(analysis_dir, f'source-ge{member}_date-{date.strftime("%Y%m%d%H")}_res-0.25_levels-*_steps-*.nc')
+        for ic_file in sorted(glob.glob(pattern)):
+            ds = xr.open_dataset(ic_file)
+            if 'batch' in ds.dims:
+                ds = ds.isel(batch=0)
+            steps = np.nonzero(ds['datetime'].values == np.datetime64(valid_time))[0]
+            if len(steps) > 0:
+                return ds.isel(time=steps[0]).sortby('lat')
+    return None
+
+
+def latitude_weights(lat):
+    """cos(latitude) weights normalized to a mean of 1, shaped to broadcast over (lat, lon)."""
+    weights = np.cos(np.deg2rad(np.asarray(lat, dtype=np.float64)))
+    return (weights / weights.mean()).astype(np.float32)[:, np.newaxis]
+
+
+def weighted_mean(x, weights):
+    """Latitude-weighted mean over the last two (lat, lon) axes."""
+    return (x * weights).mean(axis=(-2, -1), dtype=np.float64)
+
+
+def crps_ensemble(members, obs):
+    """
+    CRPS of an ensemble at every grid point, E|X - y| - E|X - X'| / 2. The pairwise term is computed
+    from the sorted members, sum_ij |x_i - x_j| = 2 sum_i (2i - n - 1) x_(i), in O(n log n).
+        Args:
+          members: (member, ...) array
+          obs: array of the trailing shape
+    """
+    n = members.shape[0]
+    skill = np.abs(members - obs).mean(axis=0)
+    ranks = (2 * np.arange(1, n + 1) - n - 1).astype(np.float32).reshape((n,) + (1,) * (members.ndim - 1))
+    return skill - (ranks * np.sort(members, axis=0)).sum(axis=0) / n ** 2
+
+
+def field_scores(members, analysis, weights, climatology=None):
+    """
+    Scores of one field.
+        Args:
+          members: (member, lat, lon) forecasts
+          analysis: (lat, lon) verifying analysis
+          weights: latitude weights (see latitude_weights)
+          climatology: (lat, lon) climatology for the ACC, None for the pattern correlation
+        Returns:
+          dict of {metric: float}
+    """
+    n = members.shape[0]
+    mean = members.mean(axis=0)
+    error = mean - analysis
+    rmse = np.sqrt(weighted_mean(error ** 2, weights))
+    spread = np.sqrt(weighted_mean(members.var(axis=0, ddof=1), weights)) if n > 1 else 0.0
+
+    if climatology is not None:
+        forecast_anomaly, analysis_anomaly = mean - climatology, analysis - climatology
+    else:
+        forecast_anomaly, analysis_anomaly = mean - weighted_mean(mean, weights), analysis - weighted_mean(analysis, weights)
+    norm = np.sqrt(weighted_mean(forecast_anomaly ** 2, weights) * weighted_mean(analysis_anomaly ** 2, weights))
+
+    return {
+        'rmse': rmse,
+        'bias': weighted_mean(error, weights),
+        'acc': weighted_mean(forecast_anomaly * analysis_anomaly, weights) / norm if norm > 0 else np.nan,
+        'spread': spread,
+        'spread_skill': np.sqrt((n + 1) / n) * spread / rmse if rmse > 0 else np.nan,
+        'crps': weighted_mean(crps_ensemble(members, analysis), weights),
+    }
+
+
+class EnsembleVerification:
+    def __init__(self, forecast_datetime, forecast_length, analysis_dir, variables=None, levels=None, climatology=None,
+                 num_workers=8, analysis_member='c00'):
+        """
+            Args:
+              forecast_datetime: datetime of the cycle (t0)
+              forecast_length: number of 6-hourly steps
+              analysis_dir: directory with the ICs of gen_gefs_ics.py used as analyses
+              variables: GraphCast variables to verify, default: all but precipitation
+              levels: pressure levels to verify, default: all levels of the forecasts
+              climatology: netcdf file with the variables on (lat, lon, [level]), optionally by 'month', for the ACC
+              num_workers: number of lead times verified in parallel
+              analysis_member: GEFS member whose ICs are the analyses
+        """
+        self.forecast_datetime = forecast_datetime
+        self.forecast_length = forecast_length
+        self.analysis_dir = analysis_dir
+        self.variables = variables or VARIABLES
+        self.levels = levels
+        self.climatology = climatology
+        self.num_workers = num_workers
+        self.analysis_member = analysis_member
+        self.leads = [6 * step for step in range(1, forecast_length + 1)]
+
+    def grib_file(self, member_dir, member, lead):
+        return os.path.join(member_dir, f'pmlgefs{member}.t{self.forecast_datetime.hour:02d}z.pgrb2.0p25.f{lead:03d}')
+
+    def _references(self, lead):
+        """Verifying analysis and climatology of a lead, (None, None) if the analysis is missing."""
+        valid_time = self.forecast_datetime + timedelta(hours=lead)
+        analysis = find_analysis(self.analysis_dir, valid_time, self.analysis_member)
+        if analysis is None:
+            print(f'f{lead:03d}: no analysis at {valid_time:%Y%m%d%H} in {self.analysis_dir}, skipped')
+            return None, None
+        climatology = None
+        if self.climatology is not None:
+            climatology = xr.open_dataset(self.climatology)
+            if 'month' in climatology.dims:
+                climatology = climatology.sel(month=valid_time.month)
+            climatology = climatology.sortby('lat')
+        return analysis, climatology
+
+    def _fields(self, analysis, levels_of):
+        """(variable, level) fields to verify, level None for surface variables."""
+        fields = []
+        for var_name in self.variables:
+            if var_name not in analysis:
+                continue
+            if 'level' in analysis[var_name].dims:
+                levels = [int(level) for level in levels_of(var_name) if level in analysis['level'].values]
+                if self.levels is not None:
+                    levels = [level for level in levels if level in self.levels]
+                fields.extend((var_name, level) for level in levels)
+            else:
+                fields.append((var_name, None))
+        return fields
+
+    @staticmethod
+    def _reference_field(ds, var_name, level):
+        if ds is None or var_name not in ds:
+            return None
+        da = ds[var_name] if level is None else ds[var_name].sel(level=level)
+        return da.values.astype('float32')
+
+    def verify_grib_lead(self, lead, member_dirs):
+        """
+        Verify one lead over the members' grib2 files, reading each verified message through the .idx byte offsets.
+            Returns:
+              (lead, {(variable, level): {metric: value}})
+        """
+        analysis, climatology = self._references(lead)
+        if analysis is None:
+            return lead, {}
+
+        indexes = {}
+        for member, member_dir in member_dirs.items():
+            grib_file = self.grib_file(member_dir, member, lead)
+            if os.path.exists(grib_file + '.idx'):
+                indexes[grib_file] = read_idx(grib_file + '.idx')
+            else:
+                print(f'f{lead:03d}: {os.path.basename(grib_file)} or its index is missing, member {member} skipped')
+        if not indexes:
+            return lead, {}
+
+        available = {key for index in indexes.values() for key in index}
+        weights = latitude_weights(analysis['lat'].values)
+        scores = {}
+        for var_name, level in self._fields(analysis, lambda var: sorted(lvl for var_, lvl in available if var_ == var)):
+            if not all((var_name, level) in index for index in indexes.values()):
+                continue
+            members = np.stack([read_message(grib_file, *index[(var_name, level)]) for grib_file, index in indexes.items()])
+            if var_name == 'geopotential':
+                # Geopotential height in the grib2 files, geopotential in the analyses
+                members *= 9.80665
+            reference = self._reference_field(analysis, var_name, level)
+            if members.shape[1:] != reference.shape:
+                raise ValueError(f'{var_name}: forecast grid {members.shape[1:]} differs from the analysis grid {reference.shape}')
+            scores[(var_name, level)] = field_scores(members, reference, weights, self._reference_field(climatology, var_name, level))
+
+        print(f'f{lead:03d}: {len(scores)} fields verified from {len(indexes)} members')
+        return lead, scores
+
+    def run_grib(self, member_dirs):
+        """Verify the members' grib2 files, parallel over leads (one worker process holds one lead)."""
+        with ProcessPoolExecutor(max_workers=self.num_workers) as executor:
+            futures = [executor.submit(self.verify_grib_lead, lead, member_dirs) for lead in self.leads]
+            return self.to_dataset(dict(future.result() for future in futures), len(member_dirs))
+
+    def run_datasets(self, forecasts):
+        """
+        Verify in-memory forecast datasets (output of rollout.chunked_prediction), parallel over leads.
+            Args:
+              forecasts: dict of {member: dataset}
+        """
+        forecasts = {member: ds.squeeze('batch', drop=True) if 'batch' in ds.dims else ds for member, ds in forecasts.items()}
+
+        def verify(lead):
+            analysis, climatology = self._references(lead)
+            if analysis is None:
+                return lead, {}
+            members = [ds.sel(time=np.timedelta64(lead, 'h')) for ds in forecasts.values()
+                       if np.timedelta64(lead, 'h') in ds['time'].values]
+            if not members:
+                return lead, {}
+            weights = latitude_weights(analysis['lat'].values)
+            scores = {}
+            for var_name, level in self._fields(analysis, lambda var: members[0]['level'].values if var in members[0] and 'level' in members[0][var].dims else []):
+                if var_name not in members[0]:
+                    continue
+                stacked = np.stack([self._reference_field(ds, var_name, level) for ds in members])
+                scores[(var_name, level)] = field_scores(stacked, self._reference_field(analysis, var_name, level), weights,
+                                                         self._reference_field(climatology, var_name, level))
+            return lead, scores
+
+        with ThreadPoolExecutor(max_workers=self.num_workers) as executor:
+            return self.to_dataset(dict(executor.map(verify, self.leads)), len(forecasts))
+
+    def to_dataset(self, scores_by_lead, num_members):
+        """Scores as a dataset of one variable per verified GraphCast variable, dims (metric, lead, [level])."""
+        leads = [lead for lead in self.leads if scores_by_lead.get(lead)]
+        fields = sorted({key for scores in scores_by_lead.values() for key in scores}, key=lambda key: (key[0], key[1] or 0))
+        arrays = []
+        for var_name in dict.fromkeys(var_name for var_name, _ in fields):
+            levels = [level for var_, level in fields if var_ == var_name]
+            values = np.full((len(METRICS), len(leads), len(levels)), np.nan, dtype=np.float32)
+            for i, lead in enumerate(leads):
+                for j, level in enumerate(levels):
+                    scores = scores_by_lead[lead].get((var_name, level))
+                    if scores is not None:
+                        values[:, i, j] = [scores[metric] for metric in METRICS]
+            if levels == [None]:
+                arrays.append(xr.DataArray(values[:, :, 0], dims=('metric', 'lead'), name=var_name))
+            else:
+                arrays.append(xr.DataArray(values, dims=('metric', 'lead', 'level'), name=var_name,
+                                           coords={'level': np.array(levels, dtype='int32')}))
+        # Variables verified on different levels are aligned with NaN
+        ds = xr.merge(arrays).assign_coords(metric=METRICS, lead=np.array(leads, dtype='int32'))
+        ds['lead'].attrs['units'] = 'hours'
+        ds.attrs.update({
+            'cycle': self.forecast_datetime.strftime('%Y%m%d%H'),
+            'members': num_members,
+            'analysis': f'gen_gefs_ics.py ICs of ge{self.analysis_member}',
+            'acc_reference': 'climatology' if self.climatology is not None else 'latitude-weighted spatial mean',
+        })
+        return ds
+
+
+def print_summary(scores, fields=(('geopotential', 500), ('temperature', 850), ('2m_temperature', None))):
+    for var_name, level in fields:
+        if var_name not in scores:
+            continue
+        if level is not None and ('level' not in scores[var_name].dims or level not in scores['level'].values):
+            continue
+        da = scores[var_name] if level is None else scores[var_name].sel(level=level)
+        print(f"{var_name}{'' if level is None else f' {level} hPa'}")
+        print(f"{'lead':>6}" + ''.join(f'{metric:>14}' for metric in METRICS))
+        for lead in da['lead'].values:
+            print(f'{lead:>6}' + ''.join(f'{float(da.sel(metric=metric, lead=lead)):>14.4g}' for metric in METRICS))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Verify MLGEFS ensemble forecasts against GEFS analyses")
+    parser.add_argument("datetime", help="forecast cycle in the format 'YYYYMMDDHH'")
+    parser.add_argument("-i", "--input", help="directory with forecasts_<levels>_levels_<member>_model_<id> folders", required=True)
+    parser.add_argument("-a", "--analysis", help="directory with the ICs of gen_gefs_ics.py covering the valid times", required=True)
+    parser.add_argument("-o", "--output", help="output netcdf file of the scores", default=None)
+    parser.add_argument("-l", "--length", help="length of forecast (6-hourly steps)", default=64)
+    parser.add_argument("-p", "--pressure", help="number of pressure levels", default=13)
+    parser.add_argument("-v", "--variables", help="comma separated GraphCast variables to verify", default=None)
+    parser.add_argument("--levels", help="comma separated pressure levels to verify", default=None)
+    parser.add_argument("-c", "--climatology", help="netcdf climatology for the ACC", default=None)
+    parser.add_argument("--analysis-member", help="GEFS member of the analysis ICs", default="c00")
+    parser.add_argument("-n", "--workers", help="number of lead times verified in parallel", default=8)
+
+    args = parser.parse_args()
+
+    forecast_datetime = datetime.strptime(args.datetime, "%Y%m%d%H")
+    output = args.output if args.output is not None else os.path.join(args.input, f'verification_{args.datetime}.nc')
+
+    member_dirs = {}
+    for member_dir in sorted(glob.glob(os.path.join(args.input, f'forecasts_{args.pressure}_levels_*_model_*'))):
+        member = os.path.basename(member_dir).split('_')[3]
+        member_dirs[member] = member_dir
+
+    verification = EnsembleVerification(forecast_datetime, int(args.length), args.analysis,
+                                        None if args.variables is None else args.variables.split(','),
+                                        None if args.levels is None else [int(level) for level in args.levels.split(',')],
+                                        args.climatology, int(args.workers), args.analysis_member)
+    scores = verification.run_grib(member_dirs)
+    scores.to_netcdf(output)
+    print_summary(scores)
+    print(f"Scores of {len(member_dirs)} members written to {output}")
@@ -0,0 +1,239 @@
+'''
+Description: Event-driven start of the MLGEFS members. Instead of assuming that the GEFS files of a cycle are
+             in the bucket at a fixed cron time, the watcher polls the source (the S3 bucket of gen_gefs_ics.py
+             or a local/Lustre mirror with the same layout) for the files each member's prep needs: the
+             FILE_FORMATS of gen_gefs_ics.py at the previous and the current cycle. A member is launched as
+             soon as its files are complete, the others keep being watched. Polling backs off while nothing
+             arrives and is reset by every new file. Per member, the arrival of the last input (object or
+             file modification time), its detection and the launch are recorded in a metrics file. Members whose
+             inputs timed out or whose launch failed are returned and make the command exit nonzero, e.g.
+                 python watch_gefs_inputs.py 2025010100 -m c00,p01 --command "sbatch --export=gefs_member={member},curr_datetime={curr_datetime},prev_datetime={prev_datetime} mlgefs_prepdata_ursa.sh"
+                 python watch_gefs_inputs.py 2025010100 -m c00 --local /lustre/gefs_mirror --command "echo {member}"
+             S3 objects appear complete, a local file is complete once its size is unchanged between two polls.
+Revision history:
+    -20261019: initial code
+    -20261019: return the failed launches with the timed out members, the latency ends at the submission
+'''
+import os
+import sys
+import json
+import shlex
+import argparse
+import subprocess
+from time import time, sleep
+from datetime import datetime, timedelta
+
+import boto3
+
+from gen_gefs_ics import BUCKET_NAME, ROOT_DIRECTORY, S3_PREFIX, FILE_FORMATS
+from utils.s3_listing import S3ListingIndex
+
+
+class S3Source:
+    """Cycle prefixes of a bucket, one paginated listing per cycle and poll for all members."""
+    atomic = True
+
+    def __init__(self, bucket_name=BUCKET_NAME, prefix=S3_PREFIX, profile_name=None):
+        self.bucket_name = bucket_name
+        self.prefix = prefix
+        self.s3 = boto3.Session(profile_name=profile_name).client('s3')
+
+    def __str__(self):
+        return f's3://{self.bucket_name}/{self.prefix}'
+
+    def list(self, cycle):
+        """{basename: (size, modification time)} of the objects of a cycle."""
+        prefix = self.prefix.format(root=ROOT_DIRECTORY, date=cycle.strftime('%Y%m%d'), hour=cycle.strftime('%H'))
+        objects = S3ListingIndex(self.s3, self.bucket_name, prefix).list_objects()
+        return {os.path.basename(obj['Key']): (obj['Size'], obj['LastModified'].timestamp()) for obj in objects}
+
+
+class LocalSource:
+    """Cycle directories of a local or Lustre mirror of the bucket (or any directory standing in for it)."""
+    atomic = False
+
+    def __init__(self, root, prefix='{root}.{date}/{hour}/atmos/'):
+        self.root = root
+        self.prefix = prefix
+
+    def __str__(self):
+        return os.path.join(self.root, self.prefix)
+
+    def list(self, cycle):
+        """{basename: (size, modification time)} of the files of a cycle."""
+        directory = os.path.join(self.root, self.prefix.format(root=ROOT_DIRECTORY, date=cycle.strftime('%Y%m%d'), hour=cycle.strftime('%H')))
+        files = {}
+        try:
+            entries = list(os.scandir(directory))
+        except FileNotFoundError:
+            return files
+        for entry in entries:
+            if entry.is_file() and not entry.name.endswith('.tmp'):
+                stat = entry.stat()
+                files[entry.name] = (stat.st_size, stat.st_mtime)
+        return files
+
+
+class InputWatcher:
+    def __init__(self, source, curr_datetime, num_pressure_levels=13, min_interval=30, max_interval=300, backoff=1.5,
+                 timeout=6 * 3600, metrics_file=None):
+        """
+            Args:
+              source: S3Source or LocalSource
+              curr_datetime: datetime of the cycle, the member's prep also needs the cycle 6 hours earlier
+              min_interval, max_interval: seconds between polls, from right after an arrival to the longest wait
+              backoff: factor the interval grows by after a poll without new files
+              timeout: seconds to wait for all members
+              metrics_file: json lines file the per-member arrival and launch times are appended to
+        """
+        self.source = source
+        self.curr_datetime = curr_datetime
+        self.prev_datetime = curr_datetime - timedelta(hours=6)
+        self.file_formats = FILE_FORMATS[13] if num_pressure_levels == 13 else FILE_FORMATS[37]
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.timeout = timeout
+        self.metrics_file = metrics_file
+        # Last size of every seen file, a file of a non-atomic source is complete once its size is unchanged
+        self.sizes = {}
+        self.polls = 0
+
+    def required(self, member):
+        """(cycle, file name) of the inputs of a member's prep."""
+        return [(cycle, f'ge{member}.t{cycle.strftime("%H")}z.{file_format}')
+                for cycle in (self.prev_datetime, self.curr_datetime) for file_format in self.file_formats]
+
+    def poll(self):
+        """
+        List the cycles once and update the file sizes.
+            Returns:
+              ({(cycle, name): modification time} of the complete files, True if a file appeared or grew)
+        """
+        self.polls += 1
+        complete = {}
+        changed = False
+        for cycle in (self.prev_datetime, self.curr_datetime):
+            for name, (size, mtime) in self.source.list(cycle).items():
+                previous = self.sizes.get((cycle, name))
+                self.sizes[(cycle, name)] = size
+                if size != previous:
+                    changed = True
+                if size > 0 and (self.source.atomic or size == previous):
+                    complete[(cycle, name)] = mtime
+        return complete, changed
+
+    def record(self, metrics):
+        print(json.dumps(metrics))
+        if self.metrics_file is not None:
+            with open(self.metrics_file, 'a') as f:
+                f.write(json.dumps(metrics) + '\n')
+
+    def run(self, members, launch):
+        """
+        Watch the inputs of the members and launch each one as soon as they are complete.
+            Args:
+              members: list of gefs members, e.g. ['c00', 'p01']
+              launch: callable, launch(member), e.g. submits the member's prep job
+            Returns:
+              list of the members that were not launched: those whose inputs were not complete before the
+              timeout, then those whose launch raised
+        """
+        print(f"Watching {self.source} for the inputs of {len(members)} members, cycle {self.curr_datetime:%Y%m%d%H}")
+        pending = {member: self.required(member) for member in members}
+        failed = []
+        start = time()
+        interval = self.min_interval
+        while pending:
+            complete, changed = self.poll()
+            detected = time()
+            for member, files in list(pending.items()):
+                if not all(file in complete for file in files):
+                    continue
+                del pending[member]
+                arrived = max(complete[file] for file in files)
+                metrics = {
+                    'member': member,
+                    'cycle': self.curr_datetime.strftime('%Y%m%d%H'),
+                    'inputs': len(files),
+                    'arrived': arrived,
+                    'detected': detected,
+                    'polls': self.polls,
+                }
+                try:
+                    launch(member)
+                    metrics['status'] = 'launched'
+                except Exception as e:
+                    metrics['status'] = f'failed: {type(e).__name__}: {e}'
+                    failed.append(member)
+                metrics['launched'] = time()
+                # Arrival of the last input to the return of launch (e.g. the sbatch submission, not the start of the
+                # prep job, which also waits in the queue), and the part of it spent waiting for the next poll
+                metrics['arrival_to_submission_seconds'] = metrics['launched'] - arrived
+                metrics['detection_delay_seconds'] = detected - arrived
+                self.record(metrics)
+
+            if not pending:
+                break
+            elapsed = time() - start
+            if elapsed > self.timeout:
+                print(f"Timed out after {elapsed:.0f} s waiting for the inputs of {sorted(pending)}")
+                for member in sorted(pending):
+                    missing = [name for cycle, name in pending[member] if (cycle, name) not in complete]
+                    self.record({'member': member, 'cycle': self.curr_datetime.strftime('%Y%m%d%H'), 'status': 'timeout',
+                                 'missing': missing, 'polls': self.polls})
+                break
+
+            interval = self.min_interval if changed else min(interval * self.backoff, self.max_interval)
+            sleep(min(interval, max(self.timeout - elapsed, 0)))
+        return sorted(pending) + failed
+
+
+def command_launcher(command, curr_datetime, prev_datetime):
+    """launch(member) running a command template with {member}, {curr_datetime} and {prev_datetime}, without waiting for it."""
+    processes = []
+
+    def launch(member):
+        args = shlex.split(command.format(member=member, curr_datetime=curr_datetime.strftime('%Y%m%d%H'),
+                                          prev_datetime=prev_datetime.strftime('%Y%m%d%H')))
+        processes.append(subprocess.Popen(args))
+
+    launch.processes = processes
+    return launch
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Launch the MLGEFS members as soon as their GEFS inputs arrive")
+    parser.add_argument("datetime", help="forecast cycle in the format 'YYYYMMDDHH'")
+    parser.add_argument("-m", "--members", help="comma separated gefs members [c00, p01, ..., p30]", default=None)
+    parser.add_argument("-l", "--levels", help="number of pressure levels, options: 13, 37", default=13)
+    parser.add_argument("--command", help="command launched per member, with {member}, {curr_datetime} and {prev_datetime}", default=None)
+    parser.add_argument("--local", help="local or Lustre directory standing in for the bucket", default=None)
+    parser.add_argument("--prefix", help="cycle prefix template with {root}, {date} and {hour}", default=None)
+    parser.add_argument("--profile", help="aws profile used for listing the bucket", default=None)
+    parser.add_argument("--min-interval", help="seconds between polls right after an arrival", default=30)
+    parser.add_argument("--max-interval", help="longest seconds between polls", default=300)
+    parser.add_argument("--timeout", help="seconds to wait for all members", default=6 * 3600)
+    parser.add_argument("--metrics", help="json lines file of the arrival and launch times", default=None)
+    args = parser.parse_args()
+
+    curr_datetime = datetime.strptime(args.datetime, "%Y%m%d%H")
+    members = args.members.split(',') if args.members is not None else ['c00'] + [f'p{i:02d}' for i in range(1, 31)]
+    if args.local is not None:
+        source = LocalSource(args.local) if args.prefix is None else LocalSource(args.local, args.prefix)
+    else:
+        source = S3Source(prefix=args.prefix or S3_PREFIX, profile_name=args.profile)
+
+    watcher = InputWatcher(source, curr_datetime, int(args.levels), float(args.min_interval), float(args.max_interval),
+                           timeout=float(args.timeout), metrics_file=args.metrics)
+    if args.command is not None:
+        launch = command_launcher(args.command, curr_datetime, watcher.prev_datetime)
+    else:
+        launch = lambda member: print(f"Inputs of {member} are complete")
+    not_launched = watcher.run(members, launch)
+
+    # Launched commands are not waited for by the watch loop
+    failed = [p.args for p in getattr(launch, 'processes', []) if p.wait() != 0]
+    for cmd in failed:
+        print(f"Launch command failed: {' '.join(cmd)}")
+    sys.exit(1 if not_launched or failed else 0)
@@ -0,0 +1,199 @@
+'''
+Description: Prefetching iterator of GraphCast training examples over the generated GEFS batches, either the
+             netcdf batch files (YYYYMMDDHH.1p00.<levels>lvl.nc) or a zarr store written by
+             generate_batch_files.py -s. Cycles are indexed once; every window of two input times plus
+             num_targets target times (6-hourly, all available) is an example, split into
+             (inputs, targets, forcings) with data_utils.extract_inputs_targets_forcings.
+             The next batches are read and decoded by background workers while the current one is used,
+             so the training step does not wait on input. The time the consumer still waits is reported
+             with the throughput. Run as a script to measure the loader alone:
+                 python batch_loader.py -s /path/to/store.zarr -c /path/to/params.npz -t 1 -b 4 -n 8
+Revision history:
+    -20261019: initial code
+'''
+import os
+import re
+import time
+import argparse
+import dataclasses
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+import numpy as np
+import xarray as xr
+
+from graphcast import data_utils
+from training_store import TrainingStore, to_store_layout, to_batch_layout
+
+STEP = np.timedelta64(6, 'h')
+
+
+def index_batch_files(directory):
+    """{cycle datetime: path} of the netcdf batch files (YYYYMMDDHH.1p00.<levels>lvl.nc) of a directory."""
+    files = {}
+    for file in os.listdir(directory):
+        match = re.match(r"(\d{10})\.\dp\d{2}\.\d+lvl\.nc$", file)
+        if match:
+            cycle = np.datetime64(f'{match.group(1)[:4]}-{match.group(1)[4:6]}-{match.group(1)[6:8]}T{match.group(1)[8:]}:00', 'ns')
+            files[cycle] = os.path.join(directory, file)
+    return files
+
+
+class BatchLoader:
+    def __init__(self, source, task_config, num_targets=1, batch_size=1, shuffle=True, seed=0, num_workers=4, prefetch=8, backend='thread', log_every=50):
+        """
+            Args:
+              source: directory of netcdf batch files, or a zarr training store
+              task_config: graphcast TaskConfig, defines input, target and forcing variables
+              num_targets: number of 6-hourly target times per example
+              batch_size: examples concatenated along the batch dimension
+              shuffle: shuffle the examples every epoch, seeded with seed + epoch
+              num_workers: number of background workers reading and decoding examples
+              prefetch: number of batches read ahead
+              backend: thread or process workers
+              log_every: print throughput every log_every batches, 0 to disable
+        """
+        if backend not in ('process', 'thread'):
+            raise ValueError(f"Backend {backend} is not supported, options: process, thread")
+        self.source = source
+        self.task_config = task_config
+        self.num_targets = num_targets
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.seed = seed
+        self.num_workers = num_workers
+        self.prefetch = prefetch
+        self.backend = backend
+        self.log_every = log_every
+
+        self.store = TrainingStore(source) if self.is_store(source) else None
+        self.files = {}
+        self.cycles = self.index_cycles()
+        self.starts = self.index_examples()
+        print(f"{len(self.cycles)} cycles, {len(self.starts)} examples of 2 inputs + {num_targets} targets, {len(self)} batches of {batch_size}")
+
+    @staticmethod
+    def is_store(path):
+        return os.path.isfile(os.path.join(path, '.zmetadata')) or os.path.isfile(os.path.join(path, '.zgroup'))
+
+    def index_cycles(self):
+        """Sorted datetimes of the available cycles."""
+        if self.store is not None:
+            return np.array(sorted(self.store.completed()), dtype='datetime64[ns]')
+
+        self.files = index_batch_files(self.source)
+        return np.array(sorted(self.files), dtype='datetime64[ns]')
+
+    def window(self, start):
+        return start + np.arange(self.num_targets + 2) * STEP
+
+    def index_examples(self):
+        """First datetimes of all windows whose cycles are all available."""
+        available = set(self.cycles)
+        return [start for start in self.cycles if all(t in available for t in self.window(start))]
+
+    def __len__(self):
+        return len(self.starts) // self.batch_size
+
+    def load_example(self, start):
+        """Read the cycles of one window and split them into (inputs, targets, forcings)."""
+        datetimes = self.window(start)
+        if self.store is not None:
+            ds = self.store.open().sel(datetime=datetimes).load()
+        else:
+            cycles = [to_store_layout(xr.load_dataset(self.files[t])) for t in datetimes]
+            ds = xr.concat(cycles, dim='datetime', data_vars='minimal', coords='minimal', compat='override')
+
+        return data_utils.extract_inputs_targets_forcings(
+            to_batch_layout(ds), target_lead_times=slice("6h", f"{self.num_targets * 6}h"), **dataclasses.asdict(self.task_config)
+        )
+
+    def load_batch(self, starts):
+        """Load batch_size examples and concatenate them along the batch dimension."""
+        examples = [self.load_example(start) for start in starts]
+        if len(examples) == 1:
+            return examples[0]
+        return tuple(xr.concat([example[i] for example in examples], dim='batch', data_vars='minimal', coords='minimal', compat='override')
+                     for i in range(3))
+
+    def batches(self, epoch=0):
+        """Start datetimes of the batches of an epoch, shuffled with seed + epoch."""
+        starts = self.starts
+        if self.shuffle:
+            order = np.random.default_rng(self.seed + epoch).permutation(len(starts))
+            starts = [starts[i] for i in order]
+        return [starts[i:i + self.batch_size] for i in range(0, len(self) * self.batch_size, self.batch_size)]
+
+    def epoch(self, epoch=0):
+        """
+        Yield (inputs, targets, forcings) batches of one epoch in order, with up to prefetch batches
+        read ahead by the workers.
+        """
+        executor_class = ProcessPoolExecutor if self.backend == 'process' else ThreadPoolExecutor
+        batches = iter(self.batches(epoch))
+        pending = deque()
+        start = time.time()
+        wait = 0.0
+        num_batches = 0
+        with executor_class(max_workers=self.num_workers) as executor:
+            for starts in batches:
+                pending.append(executor.submit(self.load_batch, starts))
+                if len(pending) >= self.prefetch:
+                    break
+
+            try:
+                while pending:
+                    before = time.time()
+                    batch = pending.popleft().result()
+                    wait += time.time() - before
+
+                    # Keep the queue full before handing the batch over
+                    starts = next(batches, None)
+                    if starts is not None:
+                        pending.append(executor.submit(self.load_batch, starts))
+
+                    yield batch
+                    num_batches += 1
+                    if self.log_every and num_batches % self.log_every == 0:
+                        self.report(num_batches, time.time() - start, wait)
+            finally:
+                # Also reached when the consumer stops early, the batches read ahead are dropped
+                for future in pending:
+                    future.cancel()
+                self.report(num_batches, time.time() - start, wait)
+
+    def __iter__(self):
+        return self.epoch(0)
+
+    def report(self, num_batches, elapsed, wait):
+        samples = num_batches * self.batch_size
+        print(f"{num_batches} batches, {samples / max(elapsed, 1e-9):.2f} samples/s, "
+              f"waited for input {wait:.1f} s of {elapsed:.1f} s ({100 * wait / max(elapsed, 1e-9):.0f}%)")
+
+
+if __name__ == "__main__":
+    from graphcast import checkpoint
+    from graphcast import graphcast
+
+    parser = argparse.ArgumentParser(description="Measure the throughput of the training batch loader")
+    parser.add_argument("-s", "--source", help="directory of netcdf batch files or zarr training store", required=True)
+    parser.add_argument("-c", "--checkpoint", help="graphcast params file (.npz) providing the task config", required=True)
+    parser.add_argument("-t", "--targets", help="number of 6-hourly target times per example", default=1)
+    parser.add_argument("-b", "--batch-size", help="examples per batch", default=1)
+    parser.add_argument("-n", "--num-workers", help="number of background workers", default=4)
+    parser.add_argument("--prefetch", help="number of batches read ahead", default=8)
+    parser.add_argument("--backend", help="worker backend: thread or process", default="thread")
+    parser.add_argument("--seed", help="shuffle seed", default=0)
+    parser.add_argument("--steps", help="number of batches to read, default: one epoch", default=None)
+    parser.add_argument("--step-time", help="seconds of simulated training step per batch", default=0)
+    args = parser.parse_args()
+
+    with open(args.checkpoint, "rb") as f:
+        task_config = checkpoint.load(f, graphcast.CheckPoint).task_config
+
+    loader = BatchLoader(args.source, task_config, int(args.targets), int(args.batch_size), seed=int(args.seed),
+                         num_workers=int(args.num_workers), prefetch=int(args.prefetch), backend=args.backend)
+    for i, (inputs, targets, forcings) in enumerate(loader):
+        time.sleep(float(args.step_time))
+        if args.steps is not None and i + 1 >= int(args.steps):
+            break
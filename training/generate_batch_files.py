@@ -3,47 +3,75 @@ Description
 @uthor: Sadegh Sadeghi Tabas (sadegh.tabas@noaa.gov)
 Revision history:
     -20240201: Sadegh Tabas, initial commit, this script generates batch files in netcdf format from GEFS grib2 data for every cycle.
+    -20261019: process pool with per-file temporary directories, skip existing outputs, progress and throughput
+    -20261019: optional output to one consolidated zarr store (training_store.py)
+    -20261019: optional in-memory regridding of 0.25 degree input (regrid.py)
 '''
 import os
+import time
+import tempfile
 import subprocess
 import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import xarray as xr
 import numpy as np
 import copy
 import re
 
+from training_store import TrainingStore
+from regrid import regrid_dataset
+
 class GEFSDataProcessor:
-    def __init__(self, input_directory, output_directory, variables, num_pressure_levels=13):
+    def __init__(self, input_directory, output_directory, variables, num_pressure_levels=13, tmp_directory=None, store_path=None, regrid=False):
         self.input_directory = input_directory
         self.output_directory = output_directory
         self.variables = variables
         self.num_levels = num_pressure_levels
-        self.file_formats = ['1p00.f000']
+        # With regrid, 0.25 degree files are read and the extracted fields regridded to 1.0 degree in memory,
+        # instead of reading files downsampled by downsampler.sh
+        self.regrid = regrid
+        self.file_formats = ['0p25.f000'] if regrid else ['1p00.f000']
+        # wgrib2 netcdf extracts go to a private directory per file under tmp_directory (default: the output directory),
+        # so concurrent workers and concurrent instances never share temporary file names
+        self.tmp_directory = tmp_directory or output_directory
+        # All cycles are written to one zarr store instead of a netcdf file per cycle if store_path is set
+        self.store = None if store_path is None else TrainingStore(store_path)
         os.makedirs(self.output_directory, exist_ok=True)
 
-    def process_data(self):
-        data_directory = self.input_directory
-        grib2_file_extension = self.file_formats[0]
+    def output_path(self, grib2_file):
+        base_name, _ = os.path.splitext(grib2_file)
+        output_file_name = self.generate_new_file_name(base_name)
+        if output_file_name is None:
+            return None
+        return os.path.join(self.output_directory, output_file_name)
 
-        grib2_file_list = [file for file in os.listdir(data_directory) if file.endswith(grib2_file_extension)]
+    def cycle_datetime(self, grib2_file):
+        """Cycle of a grib2 file as numpy datetime64, None if the file name can not be parsed."""
+        match = re.match(r"gec\d{2}\.t(\d{2})z\.pgrb2\.(\d{8})\.", grib2_file)
+        if match is None:
+            return None
+        return np.datetime64(f'{match.group(2)[:4]}-{match.group(2)[4:6]}-{match.group(2)[6:]}T{match.group(1)}:00', 'ns')
 
-        for grib2_file in grib2_file_list:
-            variables_to_extract = copy.deepcopy(self.variables)
-            extracted_datasets = []
-            files = []
+    def build_dataset(self, grib2_file):
+        """Extract the variables of one grib2 file into a dataset in the batch file layout."""
+        variables_to_extract = copy.deepcopy(self.variables)
+        extracted_datasets = []
+        num_extracts = 0
+        grib2_file_path = os.path.join(self.input_directory, grib2_file)
 
+        with tempfile.TemporaryDirectory(prefix=f'{grib2_file}.', dir=self.tmp_directory) as work_dir:
             for file_extension, variable_data in variables_to_extract.items():
                 for variable, data in variable_data.items():
                     levels = data['levels']
                     first_time_step_only = data.get('first_time_step_only', False)
 
                     for level in levels:
-                        output_file = f'{variable}_{level}_{file_extension}_{grib2_file}.nc'
-                        files.append(output_file)
-                        grib2_file_path = os.path.join(data_directory, grib2_file)
+                        output_file = os.path.join(work_dir, f'extract_{num_extracts}.nc')
+                        num_extracts += 1
                         wgrib2_command = ['wgrib2', '-nc_nlev', f'{self.num_levels}', grib2_file_path, '-match', f'{variable}', '-match', f'{level}', '-netcdf', output_file]
-                        subprocess.run(wgrib2_command, check=True)
-                        ds = xr.open_dataset(output_file)
+                        subprocess.run(wgrib2_command, check=True, stdout=subprocess.DEVNULL)
+                        # Load into memory, the temporary directory is removed at the end of the file
+                        ds = xr.load_dataset(output_file)
 
                         if variable not in [':LAND:', ':HGT:']:
                             extracted_datasets.append(ds)
@@ -53,24 +81,91 @@ class GEFSDataProcessor:
                                 extracted_datasets.append(ds)
                                 variables_to_extract[file_extension][variable]['first_time_step_only'] = False
 
-            print("Merging grib2 files:")
-            ds = xr.merge(extracted_datasets)
-            print("Merging process completed.")
+        ds = xr.merge(extracted_datasets)
+        if self.regrid:
+            ds = regrid_dataset(ds, resolution=1.0)
+        return self.reshape_ds(ds)
+
+    def process_file(self, grib2_file):
+        """Write the batch file (or store region) of one grib2 file, returns the output path."""
+        ds = self.build_dataset(grib2_file)
+
+        if self.store is not None:
+            self.store.write(ds)
+            return f"{self.store.path} at {ds['datetime'].values[0, 0]}"
+
+        # Write next to the final file and rename, so that a partial file is never taken as done
+        output_netcdf = self.output_path(grib2_file)
+        tmp_netcdf = f'{output_netcdf}.{os.getpid()}.tmp'
+        ds.to_netcdf(tmp_netcdf)
+        os.replace(tmp_netcdf, output_netcdf)
+        return output_netcdf
+
+    def process_data(self, num_workers=1, overwrite=False):
+        """
+        Generate batch files for all grib2 files of the input directory.
+            Args:
+              num_workers: number of files processed in parallel
+              overwrite: regenerate batch files that already exist
+            Returns:
+              dict with the number of processed, skipped and failed files
+        """
+        grib2_file_extension = self.file_formats[0]
+        grib2_file_list = sorted(file for file in os.listdir(self.input_directory) if file.endswith(grib2_file_extension))
+
+        todo = []
+        stats = {'processed': 0, 'skipped': 0, 'failed': 0}
+        completed = set() if self.store is None or overwrite else self.store.completed()
+        for grib2_file in grib2_file_list:
+            output_netcdf = self.output_path(grib2_file)
+            if output_netcdf is None:
+                stats['failed'] += 1
+            elif self.store is not None and self.cycle_datetime(grib2_file) in completed:
+                stats['skipped'] += 1
+            elif self.store is None and os.path.isfile(output_netcdf) and not overwrite:
+                stats['skipped'] += 1
+            else:
+                todo.append(grib2_file)
+        print(f"{len(grib2_file_list)} grib2 files, {stats['skipped']} batch files exist, {len(todo)} to process with {num_workers} workers")
 
-            print("Processing, Renaming and Reshaping the data")
-            ds = self.reshape_ds(ds)
+        start = time.time()
+        input_bytes = 0
 
-            base_name, _ = os.path.splitext(grib2_file)
-            output_file_name = self.generate_new_file_name(base_name)
-            output_netcdf = os.path.join(self.output_directory, output_file_name)
+        # The store is laid out for all cycles from the first file, before the workers write their regions
+        if self.store is not None and todo:
+            sample = self.build_dataset(todo[0])
+            self.store.initialize(sample, [self.cycle_datetime(grib2_file) for grib2_file in todo])
+            self.store.write(sample)
+            stats['processed'] += 1
+            input_bytes += os.path.getsize(os.path.join(self.input_directory, todo[0]))
+            todo = todo[1:]
 
-            ds.to_netcdf(output_netcdf)
-            print(f"Saved output to {output_netcdf}")
+        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+            futures = {executor.submit(self.process_file, grib2_file): grib2_file for grib2_file in todo}
+            done = 0
+            for future in as_completed(futures):
+                grib2_file = futures[future]
+                try:
+                    output_netcdf = future.result()
+                    stats['processed'] += 1
+                    input_bytes += os.path.getsize(os.path.join(self.input_directory, grib2_file))
+                except Exception as e:
+                    stats['failed'] += 1
+                    done += 1
+                    print(f"Failed to process {grib2_file}: {str(e)}")
+                    continue
 
-            for file in files:
-                os.remove(file)
+                done += 1
+                elapsed = time.time() - start
+                rate = stats['processed'] / elapsed
+                eta = (len(todo) - done) / rate if rate > 0 else float('nan')
+                print(f"[{done}/{len(todo)}] {output_netcdf} ({rate:.2f} files/s, eta {eta / 60:.1f} min)")
 
-            print(f"Process completed successfully, your inputs for GraphCast model generated at:\n {output_netcdf}")
+        elapsed = time.time() - start
+        stats['seconds'] = elapsed
+        print(f"Processed {stats['processed']} files in {elapsed:.1f} s ({stats['processed'] / max(elapsed, 1e-9):.2f} files/s, "
+              f"{input_bytes / 1024**2 / max(elapsed, 1e-9):.1f} MB/s of grib2), skipped {stats['skipped']}, failed {stats['failed']}")
+        return stats
 
     def reshape_ds(self, ds):
         ds = ds.drop_dims('level')
@@ -122,7 +217,7 @@ class GEFSDataProcessor:
             model_run = match.group(1)
             forecast_time = match.group(2)
             date = match.group(3)
-            resolution = match.group(4)
+            resolution = '1p00' if self.regrid else match.group(4)
             
             new_file_name = f"{date}{forecast_time}.{resolution}.{self.num_levels}lvl.nc"
             return new_file_name
@@ -137,6 +232,11 @@ if __name__ == "__main__":
     parser.add_argument("-i", "--input", help="directory to grib2 files")
     parser.add_argument("-o", "--output", help="Output directory for processed data")
     parser.add_argument("-l", "--levels", help="number of pressure levels, options: 13, 31", default="13")
+    parser.add_argument("-n", "--num-workers", help="number of grib2 files processed in parallel, default: all cores", default=os.cpu_count())
+    parser.add_argument("-t", "--tmpdir", help="directory for temporary wgrib2 extracts, default: the output directory", default=None)
+    parser.add_argument("--overwrite", help="regenerate batch files that already exist (yes or no)", default="no")
+    parser.add_argument("-r", "--regrid", help="read 0.25 degree files and regrid them to 1.0 degree in memory (yes or no)", default="no")
+    parser.add_argument("-s", "--store", help="write all cycles to this zarr store instead of a netcdf file per cycle", default=None)
 
     args = parser.parse_args()
     input_directory = args.input
@@ -158,6 +258,8 @@ if __name__ == "__main__":
     if num_pressure_levels == 31:
         variables['.f000'][':SPFH|VVEL|VGRD|UGRD|HGT|TMP:']['levels'] = [':(1|2|3|5|7|10|20|30|50|70|100|150|200|250|300|350|400|450|500|550|600|650|700|750|800|850|900|925|950|975|1000) mb:']
 
-    data_processor = GEFSDataProcessor(input_directory, output_directory, variables, num_pressure_levels)
-    data_processor.process_data()
+    data_processor = GEFSDataProcessor(input_directory, output_directory, variables, num_pressure_levels, args.tmpdir, args.store, args.regrid.lower() == "yes")
+    stats = data_processor.process_data(int(args.num_workers), args.overwrite.lower() == "yes")
+    if stats['failed']:
+        exit(1)
 
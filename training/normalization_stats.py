@@ -0,0 +1,199 @@
+'''
+Description: Compute the normalization statistics of GEFS training data in one streaming pass:
+                 mean_by_level.nc, stddev_by_level.nc   mean and standard deviation of every variable
+                 diffs_stddev_by_level.nc               standard deviation of the 6h differences
+             in the format read by GraphCastModel.load_normalization_stats and normalization.InputsAndResiduals
+             (one variable per input, reduced over all dimensions except level). The derived variables
+             (year/day progress, and toa_incident_solar_radiation where data_utils can compute it) are included.
+             Cycles are split into contiguous blocks processed by a process pool; each worker keeps only the
+             current and the previous cycle in memory and per-level moments, which are merged with Chan's formula:
+                 python normalization_stats.py -s /path/to/batches_or_store.zarr -o /path/to/stats -n 32
+Revision history:
+    -20261019: initial code
+'''
+import os
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import xarray as xr
+
+from batch_loader import BatchLoader, index_batch_files
+from training_store import TrainingStore, to_batch_layout
+
+STEP = np.timedelta64(6, 'h')
+
+
+class Moments:
+    """Count, mean and sum of squared deviations per level, updated in chunks and mergeable (Welford/Chan)."""
+
+    def __init__(self):
+        self.count = None
+        self.mean = None
+        self.m2 = None
+
+    def update(self, values, level_axis=None):
+        """Add all values of an array, reduced over every axis except level_axis. NaNs are ignored."""
+        values = np.asarray(values, dtype=np.float64)
+        if level_axis is None:
+            values = values.reshape(1, -1)
+        else:
+            values = np.moveaxis(values, level_axis, 0).reshape(values.shape[level_axis], -1)
+
+        count = np.sum(~np.isnan(values), axis=1)
+        mean = np.nanmean(values, axis=1)
+        m2 = np.nansum((values - mean[:, np.newaxis]) ** 2, axis=1)
+        self.combine(count, mean, m2)
+
+    def combine(self, count, mean, m2):
+        if self.count is None:
+            self.count, self.mean, self.m2 = count.astype(np.float64), mean, m2
+            return
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean = self.mean + delta * count / total
+        self.m2 = self.m2 + m2 + delta ** 2 * self.count * count / total
+        self.count = total
+
+    def merge(self, other):
+        if other.count is not None:
+            self.combine(other.count, other.mean, other.m2)
+        return self
+
+    def stddev(self):
+        return np.sqrt(self.m2 / self.count)
+
+
+def add_derived_variables(ds):
+    """Add the variables that data_utils derives from the datetime (and toa radiation, if this graphcast version can)."""
+    from graphcast import data_utils
+
+    data_utils.add_derived_vars(ds)
+    if hasattr(data_utils, 'add_tisr_var'):
+        data_utils.add_tisr_var(ds)
+    return ds
+
+
+def read_cycle(source, cycle):
+    """One cycle in the batch file layout, source is a TrainingStore or a {datetime: netcdf file} dict."""
+    if isinstance(source, TrainingStore):
+        return to_batch_layout(source.open().sel(datetime=[cycle]).load())
+    return xr.load_dataset(source[cycle])
+
+
+def accumulate_block(source, cycles, previous=None):
+    """
+    Moments of the values and 6h differences of a contiguous block of cycles.
+        Args:
+          previous: cycle before the block, read only to difference the first cycle of the block
+        Returns:
+          ({var: Moments}, {var: Moments}, {var: dims}, level coordinate)
+    """
+    values, diffs, dims = {}, {}, {}
+    prev_ds = None if previous is None else add_derived_variables(read_cycle(source, previous))
+    prev_cycle = previous
+    level = None
+    for cycle in cycles:
+        ds = add_derived_variables(read_cycle(source, cycle))
+        if level is None and 'level' in ds.coords:
+            level = ds['level'].values
+
+        consecutive = prev_ds is not None and cycle - prev_cycle == STEP
+        for var in ds.data_vars:
+            da = ds[var]
+            level_axis = da.dims.index('level') if 'level' in da.dims else None
+            dims[var] = ('level',) if level_axis is not None else ()
+            values.setdefault(var, Moments()).update(da.values, level_axis)
+
+            # Static fields have no 6h differences
+            if consecutive and 'time' in da.dims and var in prev_ds:
+                diffs.setdefault(var, Moments()).update(da.values - prev_ds[var].values, level_axis)
+
+        prev_ds, prev_cycle = ds, cycle
+    return values, diffs, dims, level
+
+
+def to_dataset(moments, dims, level, statistic):
+    data_vars = {}
+    for var, m in moments.items():
+        result = m.mean if statistic == 'mean' else m.stddev()
+        data_vars[var] = (dims[var], result if dims[var] else result[0])
+    coords = {} if level is None else {'level': level}
+    return xr.Dataset(data_vars, coords=coords)
+
+
+def compute_stats(source_path, output_directory, num_workers=8, num_blocks=None, start=None, end=None):
+    """
+    Compute and write the three statistics files for all cycles of a directory of batch files or a store.
+        Args:
+          num_blocks: number of contiguous blocks of cycles, default: 4 per worker
+          start, end: optional numpy datetime64 limits of the cycles used
+    """
+    if BatchLoader.is_store(source_path):
+        source = TrainingStore(source_path)
+        cycles = np.array(sorted(source.completed()), dtype='datetime64[ns]')
+    else:
+        source = index_batch_files(source_path)
+        cycles = np.array(sorted(source), dtype='datetime64[ns]')
+    if start is not None:
+        cycles = cycles[cycles >= start]
+    if end is not None:
+        cycles = cycles[cycles <= end]
+
+    if len(cycles) == 0:
+        raise ValueError(f"No cycles found in {source_path}")
+
+    num_blocks = num_blocks or 4 * num_workers
+    blocks = [block for block in np.array_split(cycles, min(num_blocks, len(cycles))) if len(block)]
+    print(f"{len(cycles)} cycles in {len(blocks)} blocks, {num_workers} workers")
+
+    values, diffs, dims, level = {}, {}, {}, None
+    begin = time.time()
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        futures = []
+        position = 0
+        for block in blocks:
+            # The cycle before the block, so differences across block boundaries are not lost
+            previous = cycles[position - 1] if position > 0 else None
+            futures.append(executor.submit(accumulate_block, source, block, previous))
+            position += len(block)
+
+        for done, future in enumerate(as_completed(futures), start=1):
+            block_values, block_diffs, block_dims, block_level = future.result()
+            for var, m in block_values.items():
+                values.setdefault(var, Moments()).merge(m)
+            for var, m in block_diffs.items():
+                diffs.setdefault(var, Moments()).merge(m)
+            dims.update(block_dims)
+            level = block_level if level is None else level
+            print(f"[{done}/{len(blocks)}] blocks done, {time.time() - begin:.1f} s")
+
+    os.makedirs(output_directory, exist_ok=True)
+    outputs = {
+        'mean_by_level.nc': to_dataset(values, dims, level, 'mean'),
+        'stddev_by_level.nc': to_dataset(values, dims, level, 'stddev'),
+        'diffs_stddev_by_level.nc': to_dataset(diffs, dims, level, 'stddev'),
+    }
+    for name, ds in outputs.items():
+        ds.to_netcdf(os.path.join(output_directory, name))
+        print(f"Saved {len(ds.data_vars)} variables to {os.path.join(output_directory, name)}")
+    elapsed = time.time() - begin
+    print(f"Processed {len(cycles)} cycles in {elapsed:.1f} s ({len(cycles) / max(elapsed, 1e-9):.2f} cycles/s)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compute normalization statistics of GEFS training data")
+    parser.add_argument("-s", "--source", help="directory of netcdf batch files or zarr training store", required=True)
+    parser.add_argument("-o", "--output", help="output directory of the statistics files", required=True)
+    parser.add_argument("-n", "--num-workers", help="number of worker processes", default=os.cpu_count())
+    parser.add_argument("-b", "--blocks", help="number of contiguous blocks of cycles, default: 4 per worker", default=None)
+    parser.add_argument("--start", help="first cycle 'YYYYMMDDHH', default: all", default=None)
+    parser.add_argument("--end", help="last cycle 'YYYYMMDDHH', default: all", default=None)
+    args = parser.parse_args()
+
+    def parse(cycle):
+        return None if cycle is None else np.datetime64(f'{cycle[:4]}-{cycle[4:6]}-{cycle[6:8]}T{cycle[8:]}:00', 'ns')
+
+    compute_stats(args.source, args.output, int(args.num_workers), None if args.blocks is None else int(args.blocks),
+                  parse(args.start), parse(args.end))
@@ -0,0 +1,320 @@
+'''
+Description: Regrid GEFS grib2 files from 0.25 to 1.0 degree in Python, replacing the per-file
+             `wgrib2 -new_grid ncep grid 3` calls of downsampler.sh. Interpolation weights are computed
+             once per source/target grid and method as sparse matrices:
+                 bilinear   default
+                 neighbor   VGTYP, SOTYP
+                 budget     APCP, PRATE (average of bilinear values on a 5x5 subgrid of each target box, as ipolates)
+             and applied to all fields of a method of a file in one sparse matmul. Files are processed in parallel:
+                 python regrid.py -i /path/to/0p25 -o /path/to/1p00 -n 16
+             --compare checks the output against files regridded by wgrib2. regrid_dataset is also used by
+             generate_batch_files.py --regrid, so the 1.0 degree grib2 files are never written.
+Revision history:
+    -20261019: initial code
+    -20261019: regrid grib2 bytes streamed from tar archives
+'''
+import os
+import time
+import fnmatch
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import scipy.sparse
+
+# wgrib2 variable names (grib2 shortName in brackets) that are not interpolated bilinearly
+METHODS = {
+    'VGTYP': 'neighbor', 'SOTYP': 'neighbor', 'vgtyp': 'neighbor', 'slt': 'neighbor',
+    'APCP': 'budget', 'PRATE': 'budget', 'tp': 'budget', 'prate': 'budget',
+}
+# Sub-points per direction of a target box for budget interpolation, 2 * 2 + 1 as the ipolates default
+BUDGET_POINTS = 5
+
+_regridders = {}
+
+
+def target_grid(src_lat, resolution=1.0):
+    """Global regular lat-lon target grid (ncep grid 3 for 1.0 degree), latitudes in the order of the source."""
+    lat = np.linspace(90, -90, int(round(180 / resolution)) + 1)
+    if src_lat[0] < src_lat[-1]:
+        lat = lat[::-1]
+    lon = np.arange(int(round(360 / resolution))) * resolution
+    return lat, lon
+
+
+class Regridder:
+    def __init__(self, src_lat, src_lon, dst_lat, dst_lon):
+        """
+            Args:
+              src_lat, src_lon: 1d coordinates of the regular, global source grid
+              dst_lat, dst_lon: 1d coordinates of the regular target grid
+        """
+        self.src_lat = np.asarray(src_lat, dtype=np.float64)
+        self.src_lon = np.asarray(src_lon, dtype=np.float64)
+        self.dst_lat = np.asarray(dst_lat, dtype=np.float64)
+        self.dst_lon = np.asarray(dst_lon, dtype=np.float64)
+        self.src_shape = (len(self.src_lat), len(self.src_lon))
+        self.dst_shape = (len(self.dst_lat), len(self.dst_lon))
+        self.weights = {}
+
+    def _indices(self, lat, lon):
+        """Fractional source indices of points, latitudes clipped to the grid, longitudes periodic."""
+        ny, nx = self.src_shape
+        fi = (lat - self.src_lat[0]) / (self.src_lat[1] - self.src_lat[0])
+        fi = np.clip(fi, 0, ny - 1)
+        fj = np.mod(lon - self.src_lon[0], 360) / (self.src_lon[1] - self.src_lon[0])
+        return fi, fj
+
+    def _bilinear(self, lat, lon):
+        """Rows, columns and weights of the bilinear interpolation matrix for flattened points."""
+        ny, nx = self.src_shape
+        fi, fj = self._indices(lat, lon)
+        i0 = np.minimum(np.floor(fi).astype(np.int64), ny - 2)
+        j0 = np.floor(fj).astype(np.int64) % nx
+        wi = fi - i0
+        wj = fj - np.floor(fj)
+        i1, j1 = i0 + 1, (j0 + 1) % nx
+
+        rows = np.tile(np.arange(lat.size), 4)
+        cols = np.concatenate([i0 * nx + j0, i0 * nx + j1, i1 * nx + j0, i1 * nx + j1])
+        vals = np.concatenate([(1 - wi) * (1 - wj), (1 - wi) * wj, wi * (1 - wj), wi * wj])
+        return rows, cols, vals
+
+    def build(self, method):
+        """Sparse (target points x source points) weight matrix of a method."""
+        ny, nx = self.src_shape
+        lat, lon = np.meshgrid(self.dst_lat, self.dst_lon, indexing='ij')
+        lat, lon = lat.ravel(), lon.ravel()
+
+        if method == 'bilinear':
+            rows, cols, vals = self._bilinear(lat, lon)
+        elif method == 'neighbor':
+            fi, fj = self._indices(lat, lon)
+            rows = np.arange(lat.size)
+            cols = np.rint(fi).astype(np.int64) * nx + np.rint(fj).astype(np.int64) % nx
+            vals = np.ones(lat.size)
+        elif method == 'budget':
+            dlat = abs(self.dst_lat[1] - self.dst_lat[0])
+            dlon = abs(self.dst_lon[1] - self.dst_lon[0])
+            offsets = (np.arange(BUDGET_POINTS) - BUDGET_POINTS // 2) / BUDGET_POINTS
+            parts = [self._bilinear(lat + di * dlat, lon + dj * dlon) for di in offsets for dj in offsets]
+            rows = np.concatenate([p[0] for p in parts])
+            cols = np.concatenate([p[1] for p in parts])
+            vals = np.concatenate([p[2] for p in parts]) / len(parts)
+        else:
+            raise ValueError(f"Interpolation method {method} is not supported, options: bilinear, neighbor, budget")
+
+        # Duplicate entries (e.g. budget sub-points sharing source points) are summed
+        return scipy.sparse.coo_matrix((vals, (rows, cols)), shape=(lat.size, ny * nx)).tocsr()
+
+    def __call__(self, fields, method='bilinear'):
+        """
+        Regrid a stack of fields with one sparse matmul.
+            Args:
+              fields: array (..., nlat, nlon) on the source grid, NaN for missing values
+            Returns:
+              float32 array (..., nlat, nlon) on the target grid, weights renormalized around missing values
+        """
+        if method not in self.weights:
+            self.weights[method] = self.build(method)
+        weights = self.weights[method]
+
+        fields = np.asarray(fields)
+        lead_shape = fields.shape[:-2]
+        flat = fields.reshape(-1, fields.shape[-2] * fields.shape[-1]).T
+        missing = np.isnan(flat)
+        if missing.any():
+            valid = weights @ (~missing).astype(np.float64)
+            result = weights @ np.where(missing, 0, flat)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                result = np.where(valid > 0, result / valid, np.nan)
+        else:
+            result = weights @ flat
+        return result.T.reshape(lead_shape + self.dst_shape).astype(np.float32)
+
+
+def get_regridder(src_lat, src_lon, resolution=1.0):
+    """Regridder for a source grid, cached per process so the weights are computed once."""
+    key = (len(src_lat), len(src_lon), float(src_lat[0]), float(src_lon[0]), resolution)
+    if key not in _regridders:
+        dst_lat, dst_lon = target_grid(src_lat, resolution)
+        _regridders[key] = Regridder(src_lat, src_lon, dst_lat, dst_lon)
+    return _regridders[key]
+
+
+def method_of(name):
+    return METHODS.get(name.split('_')[0], 'bilinear')
+
+
+def regrid_dataset(ds, resolution=1.0, lat_name='latitude', lon_name='longitude'):
+    """Regrid all variables of an xarray dataset (e.g. wgrib2 netcdf extracts), fields of a method in one matmul."""
+    import xarray as xr
+
+    regridder = get_regridder(ds[lat_name].values, ds[lon_name].values, resolution)
+    coords = {lat_name: regridder.dst_lat.astype(ds[lat_name].dtype), lon_name: regridder.dst_lon.astype(ds[lon_name].dtype)}
+
+    gridded = [var for var in ds.data_vars if ds[var].dims[-2:] == (lat_name, lon_name)]
+    out = ds.drop_vars(gridded).drop_dims([lat_name, lon_name], errors='ignore').assign_coords(coords)
+    for method in set(method_of(var) for var in gridded):
+        names = [var for var in gridded if method_of(var) == method]
+        sizes = [int(np.prod(ds[var].shape[:-2])) for var in names]
+        stacked = np.concatenate([ds[var].values.reshape(-1, *ds[var].shape[-2:]) for var in names])
+        result = np.split(regridder(stacked, method), np.cumsum(sizes)[:-1])
+        for var, values in zip(names, result):
+            out[var] = xr.DataArray(values.reshape(ds[var].shape[:-2] + regridder.dst_shape), dims=ds[var].dims, attrs=ds[var].attrs)
+    return out
+
+
+def grid_keys(lat, lon):
+    return {
+        'Ni': len(lon), 'Nj': len(lat),
+        'latitudeOfFirstGridPointInDegrees': float(lat[0]), 'longitudeOfFirstGridPointInDegrees': float(lon[0]),
+        'latitudeOfLastGridPointInDegrees': float(lat[-1]), 'longitudeOfLastGridPointInDegrees': float(lon[-1]),
+        'iDirectionIncrementInDegrees': abs(float(lon[1] - lon[0])), 'jDirectionIncrementInDegrees': abs(float(lat[1] - lat[0])),
+        'jScansPositively': int(lat[-1] > lat[0]),
+    }
+
+
+def split_messages(data):
+    """Split grib2 bytes (e.g. streamed from an archive) into messages, using the total length of section 0."""
+    messages = []
+    start = data.find(b'GRIB')
+    while start != -1 and start + 16 <= len(data):
+        length = int.from_bytes(data[start + 8:start + 16], 'big')
+        messages.append(data[start:start + length])
+        start = data.find(b'GRIB', start + length)
+    return messages
+
+
+def regrid_grib(infile, outfile, resolution=1.0, data=None):
+    """
+    Regrid all messages of a grib2 file and write them with complex packing and 2nd order spatial differencing (wgrib2 c3).
+        Args:
+          data: grib2 bytes to regrid instead of reading infile
+    """
+    import eccodes
+
+    gids, fields = [], []
+    if data is not None:
+        gids = [eccodes.codes_new_from_message(message) for message in split_messages(data)]
+    else:
+        with open(infile, 'rb') as fin:
+            while True:
+                gid = eccodes.codes_grib_new_from_file(fin)
+                if gid is None:
+                    break
+                gids.append(gid)
+
+    try:
+        if not gids:
+            return 0
+        # Latitudes and longitudes of the first message define the source grid of the file
+        nj, ni = eccodes.codes_get(gids[0], 'Nj'), eccodes.codes_get(gids[0], 'Ni')
+        lat = np.linspace(eccodes.codes_get(gids[0], 'latitudeOfFirstGridPointInDegrees'), eccodes.codes_get(gids[0], 'latitudeOfLastGridPointInDegrees'), nj)
+        lon = eccodes.codes_get(gids[0], 'longitudeOfFirstGridPointInDegrees') + np.arange(ni) * eccodes.codes_get(gids[0], 'iDirectionIncrementInDegrees')
+        regridder = get_regridder(lat, lon, resolution)
+
+        methods = []
+        for gid in gids:
+            values = eccodes.codes_get_values(gid).reshape(nj, ni)
+            if eccodes.codes_get(gid, 'bitmapPresent'):
+                values = np.where(values == eccodes.codes_get(gid, 'missingValue'), np.nan, values)
+            fields.append(values)
+            methods.append(method_of(eccodes.codes_get(gid, 'shortName')))
+        fields = np.stack(fields)
+
+        regridded = np.empty((len(gids),) + regridder.dst_shape, dtype=np.float32)
+        for method in set(methods):
+            index = [i for i, m in enumerate(methods) if m == method]
+            regridded[index] = regridder(fields[index], method)
+
+        tmp_file = f'{outfile}.{os.getpid()}.tmp'
+        with open(tmp_file, 'wb') as fout:
+            for gid, values in zip(gids, regridded):
+                clone = eccodes.codes_clone(gid)
+                try:
+                    for key, value in grid_keys(regridder.dst_lat, regridder.dst_lon).items():
+                        eccodes.codes_set(clone, key, value)
+                    eccodes.codes_set(clone, 'packingType', 'grid_complex_spatial_differencing')
+                    missing = np.isnan(values)
+                    if missing.any():
+                        eccodes.codes_set(clone, 'bitmapPresent', 1)
+                        values = np.where(missing, eccodes.codes_get(clone, 'missingValue'), values)
+                    eccodes.codes_set_values(clone, values.ravel().astype(np.float64))
+                    fout.write(eccodes.codes_get_message(clone))
+                finally:
+                    eccodes.codes_release(clone)
+        os.replace(tmp_file, outfile)
+    finally:
+        for gid in gids:
+            eccodes.codes_release(gid)
+
+    return len(gids)
+
+
+def compare_grib(file, reference):
+    """Largest absolute difference per message between two grib2 files with the same messages."""
+    import pygrib
+
+    differences = {}
+    with pygrib.open(file) as grbs, pygrib.open(reference) as refs:
+        for grb, ref in zip(grbs, refs):
+            differences[f'{grb.shortName}:{grb.level}:{grb.typeOfLevel}'] = float(np.nanmax(np.abs(grb.values - ref.values)))
+    return differences
+
+
+def output_name(file, resolution=1.0):
+    """gec00.t00z.pgrb2.20000101.0p25.f000 -> gec00.t00z.pgrb2.20000101.1p00.f000, as downsampler.sh."""
+    prefix, suffix = file.split('.0p25.')
+    return f"{prefix}.{f'{resolution:.2f}'.replace('.', 'p')}.{suffix}"
+
+
+def process_file(infile, outfile, resolution=1.0, reference=None):
+    start = time.time()
+    num_messages = regrid_grib(infile, outfile, resolution)
+    result = {'file': outfile, 'messages': num_messages, 'seconds': time.time() - start}
+    if reference is not None and os.path.isfile(reference):
+        result['max_abs_diff'] = compare_grib(outfile, reference)
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Regrid 0.25 degree GEFS grib2 files to 1.0 degree")
+    parser.add_argument("-i", "--input", help="directory of 0.25 degree grib2 files", required=True)
+    parser.add_argument("-o", "--output", help="output directory", required=True)
+    parser.add_argument("-f", "--pattern", help="file name pattern", default="*.0p25.f000")
+    parser.add_argument("-n", "--num-workers", help="number of files regridded in parallel", default=os.cpu_count())
+    parser.add_argument("-c", "--compare", help="directory of the same files regridded by wgrib2, to report differences", default=None)
+    parser.add_argument("-t", "--tolerance", help="largest accepted absolute difference from wgrib2 for --compare", default=None)
+    args = parser.parse_args()
+
+    os.makedirs(args.output, exist_ok=True)
+    files = sorted(f for f in os.listdir(args.input) if fnmatch.fnmatch(f, args.pattern))
+
+    start = time.time()
+    failed = 0
+    with ProcessPoolExecutor(max_workers=int(args.num_workers)) as executor:
+        futures = {}
+        for file in files:
+            name = output_name(file)
+            reference = None if args.compare is None else os.path.join(args.compare, name)
+            futures[executor.submit(process_file, os.path.join(args.input, file), os.path.join(args.output, name), 1.0, reference)] = file
+        for done, future in enumerate(as_completed(futures), start=1):
+            try:
+                result = future.result()
+            except Exception as e:
+                failed += 1
+                print(f"Failed to regrid {futures[future]}: {str(e)}")
+                continue
+            print(f"[{done}/{len(files)}] Downsampled {futures[future]} to {result['file']} ({result['messages']} messages, {result['seconds']:.1f} s)")
+            exceeded = False
+            for name, diff in result.get('max_abs_diff', {}).items():
+                if args.tolerance is None or diff > float(args.tolerance):
+                    print(f"    {name}: max abs diff from wgrib2 {diff:.4g}")
+                    exceeded = args.tolerance is not None
+            failed += exceeded
+
+    elapsed = time.time() - start
+    print(f"Regridded {len(files) - failed} of {len(files)} files in {elapsed:.1f} s ({len(files) / max(elapsed, 1e-9):.2f} files/s)")
+    if failed:
+        exit(1)
@@ -0,0 +1,145 @@
+'''
+Description: Selective extraction from GEFSv12 tar archives, replacing tar_extract.sh which untars every
+             archive completely. The member table of each archive is read from its .tar.idx when that is a
+             text index ("name offset size" per line), otherwise from the tar headers alone (seeking over the
+             data). Only members matching the patterns are read, with one seek and one read each, and either
+             written to the output directory or regridded to 1.0 degree on the fly (regrid.py), so the
+             0.25 degree files never reach the disk. Archives are processed in parallel:
+                 python tar_stream.py -a /lustre/Sadegh.Tabas/GEFSv12 -o /lustre/GEFSv12_1p00 -f "gec00*.f000" -r yes
+             The output is ready for generate_batch_files.py.
+Revision history:
+    -20261019: initial code
+'''
+import os
+import time
+import fnmatch
+import tarfile
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from regrid import regrid_grib, output_name
+
+
+def read_text_index(idx_file):
+    """Member table from a text index, None if the index is not in that format (e.g. a binary htar index)."""
+    members = []
+    try:
+        with open(idx_file, 'r') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                name, offset, size = line.rsplit(maxsplit=2)
+                members.append((name, int(offset), int(size)))
+    except (UnicodeDecodeError, ValueError):
+        return None
+    return members
+
+
+def read_member_table(archive):
+    """
+    List of (name, data offset, size) of the regular files of an archive.
+    Without a usable .tar.idx only the 512 byte headers are read, the member data is skipped.
+    """
+    idx_file = f'{archive}.idx'
+    if os.path.isfile(idx_file):
+        members = read_text_index(idx_file)
+        if members is not None:
+            return members
+
+    with tarfile.open(archive, mode='r:') as tar:
+        return [(member.name, member.offset_data, member.size) for member in tar if member.isfile()]
+
+
+def write_text_index(archive, members, idx_file=None):
+    """Write a text index, so the headers are not scanned again (kept next to the archive by default)."""
+    idx_file = idx_file or f'{archive}.idx'
+    with open(idx_file, 'w') as f:
+        for name, offset, size in members:
+            f.write(f'{name} {offset} {size}\n')
+
+
+def matches(name, patterns):
+    return any(fnmatch.fnmatch(os.path.basename(name), pattern) for pattern in patterns)
+
+
+def extract_archive(archive, output_directory, patterns, regrid=False, overwrite=False, save_index=False):
+    """
+    Extract (and optionally regrid) the members of one archive that match the patterns into
+    output_directory/<archive name>/.
+        Returns:
+          dict with counts and bytes read
+    """
+    start = time.time()
+    members = read_member_table(archive)
+    if save_index and not os.path.isfile(f'{archive}.idx'):
+        write_text_index(archive, members)
+
+    folder = os.path.join(output_directory, os.path.basename(archive)[:-len('.tar')])
+    os.makedirs(folder, exist_ok=True)
+
+    stats = {'archive': archive, 'members': len(members), 'matched': 0, 'skipped': 0, 'bytes_read': 0}
+    with open(archive, 'rb') as f:
+        for name, offset, size in members:
+            if not matches(name, patterns):
+                continue
+            stats['matched'] += 1
+
+            file = os.path.basename(name)
+            outfile = os.path.join(folder, output_name(file) if regrid and '.0p25.' in file else file)
+            if os.path.isfile(outfile) and not overwrite:
+                stats['skipped'] += 1
+                continue
+
+            f.seek(offset)
+            data = f.read(size)
+            stats['bytes_read'] += size
+            if regrid:
+                regrid_grib(None, outfile, data=data)
+            else:
+                tmp_file = f'{outfile}.{os.getpid()}.tmp'
+                with open(tmp_file, 'wb') as fout:
+                    fout.write(data)
+                os.replace(tmp_file, outfile)
+
+    stats['archive_bytes'] = os.path.getsize(archive)
+    stats['seconds'] = time.time() - start
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract matching members from GEFSv12 tar archives")
+    parser.add_argument("-a", "--archives", help="directory of the .tar archives", required=True)
+    parser.add_argument("-o", "--output", help="output directory, one folder per archive", required=True)
+    parser.add_argument("-f", "--patterns", help="comma separated file name patterns of the members to extract", default="*.f000")
+    parser.add_argument("-r", "--regrid", help="regrid 0.25 degree members to 1.0 degree while extracting (yes or no)", default="no")
+    parser.add_argument("-n", "--num-workers", help="number of archives processed in parallel", default=8)
+    parser.add_argument("--overwrite", help="extract members that already exist in the output (yes or no)", default="no")
+    parser.add_argument("--save-index", help="write a text .tar.idx next to archives without one (yes or no)", default="no")
+    args = parser.parse_args()
+
+    archives = sorted(os.path.join(args.archives, f) for f in os.listdir(args.archives) if f.endswith('.tar'))
+    patterns = args.patterns.split(',')
+
+    start = time.time()
+    totals = {'matched': 0, 'skipped': 0, 'bytes_read': 0, 'archive_bytes': 0}
+    failed = 0
+    with ProcessPoolExecutor(max_workers=int(args.num_workers)) as executor:
+        futures = {executor.submit(extract_archive, archive, args.output, patterns, args.regrid.lower() == "yes",
+                                   args.overwrite.lower() == "yes", args.save_index.lower() == "yes"): archive for archive in archives}
+        for done, future in enumerate(as_completed(futures), start=1):
+            try:
+                stats = future.result()
+            except Exception as e:
+                failed += 1
+                print(f"Failed to extract {futures[future]}: {str(e)}")
+                continue
+            for key in totals:
+                totals[key] += stats[key]
+            print(f"[{done}/{len(archives)}] {stats['archive']}: {stats['matched']} of {stats['members']} members matched, "
+                  f"{stats['bytes_read'] / 1024**2:.1f} MB read in {stats['seconds']:.1f} s")
+
+    elapsed = time.time() - start
+    print(f"Extracted {totals['matched'] - totals['skipped']} members ({totals['skipped']} existed) from {len(archives) - failed} archives in {elapsed:.1f} s, "
+          f"read {totals['bytes_read'] / 1024**3:.2f} GB of {totals['archive_bytes'] / 1024**3:.2f} GB archived")
+    if failed:
+        exit(1)
@@ -0,0 +1,138 @@
+'''
+Description: Consolidated zarr store of GEFS training data, instead of one netcdf batch file per cycle.
+             Layout:
+                 datetime                    cycle index (absolute time)
+                 <variable>(datetime, [level,] lat, lon)
+                                             one chunk per (datetime, variable), so reading a variable
+                                             of a cycle is a single chunk fetch
+                 land_sea_mask, geopotential_at_surface (lat, lon)
+                                             static fields, stored once
+                 cycle_complete(datetime)    1 once a cycle has been written
+             The store is created (or extended) for all cycles up front by one process, then parallel
+             workers fill in their own cycles with region writes. Workers never touch the same chunk,
+             so concurrent writes need no locking. The store is append-only: datetimes are kept in increasing
+             order (readers take consecutive cycles by index), so an existing store is only extended with
+             cycles after its last datetime; earlier cycles need a new store.
+             Requires zarr and dask.
+Revision history:
+    -20261019: initial code
+    -20261019: extend only after the last datetime, so the store stays in time order
+'''
+import os
+import numpy as np
+import xarray as xr
+
+STATIC_VARIABLES = ['geopotential_at_surface', 'land_sea_mask']
+
+
+def to_store_layout(ds):
+    """Batch file layout (batch, time relative to the cycle, datetime coordinate) to the store layout (datetime)."""
+    ds = ds.squeeze('batch', drop=True)
+    return ds.swap_dims({'time': 'datetime'}).drop_vars('time')
+
+
+def to_batch_layout(ds):
+    """
+    Store layout to the batch file layout read by data_utils.extract_inputs_targets_forcings:
+    a batch dimension, time relative to the first datetime and an absolute datetime coordinate.
+    """
+    ds = ds.drop_vars('cycle_complete', errors='ignore').rename({'datetime': 'time'})
+    ds = ds.assign_coords(datetime=ds['time'])
+    ds['time'] = ds['time'] - ds.time[0]
+
+    ds = ds.expand_dims(dim='batch')
+    ds['datetime'] = ds['datetime'].expand_dims(dim='batch')
+    for var in STATIC_VARIABLES:
+        if var in ds:
+            ds[var] = ds[var].squeeze('batch')
+    return ds
+
+
+class TrainingStore:
+    def __init__(self, path):
+        self.path = path
+
+    def exists(self):
+        return os.path.isdir(self.path)
+
+    def open(self):
+        """Open the store lazily, variables are read chunk by chunk."""
+        return xr.open_zarr(self.path)
+
+    def datetimes(self):
+        if not self.exists():
+            return np.array([], dtype='datetime64[ns]')
+        return self.open()['datetime'].values
+
+    def completed(self):
+        """Datetimes of the cycles already written."""
+        if not self.exists():
+            return set()
+        ds = self.open()
+        complete = ds['cycle_complete'].values == 1
+        return set(ds['datetime'].values[complete])
+
+    def initialize(self, sample, datetimes):
+        """
+        Create the store, or extend an existing one, so it holds all datetimes. Only metadata, coordinates
+        and static fields are written here; must be called by a single process before the parallel writes.
+            Args:
+              sample: one cycle in the batch file layout, defines variables, shapes and static fields
+              datetimes: datetimes of all cycles to be written, in any order
+            Raises:
+              ValueError: if a datetime not yet in an existing store is before its last datetime
+        """
+        import dask.array
+
+        sample = to_store_layout(sample)
+        existing = self.datetimes()
+        # Sorted and unique, appended in time order
+        new_datetimes = np.setdiff1d(np.asarray(datetimes, dtype='datetime64[ns]'), existing)
+        if len(new_datetimes) == 0:
+            return
+        if len(existing) > 0 and new_datetimes[0] < existing.max():
+            earlier = new_datetimes[new_datetimes < existing.max()]
+            raise ValueError(f"{self.path} is append-only and ends at {existing.max()}, "
+                             f"{len(earlier)} cycles from {earlier[0]} need a new store")
+
+        data_vars = {}
+        encoding = {}
+        for var in sample.data_vars:
+            if var in STATIC_VARIABLES:
+                continue
+            other_dims = sample[var].dims[1:]
+            shape = (len(new_datetimes),) + tuple(sample.sizes[dim] for dim in other_dims)
+            chunks = (1,) + shape[1:]
+            data_vars[var] = (sample[var].dims, dask.array.full(shape, np.nan, dtype=sample[var].dtype, chunks=chunks), sample[var].attrs)
+            encoding[var] = {'chunks': chunks}
+        data_vars['cycle_complete'] = (('datetime',), dask.array.zeros(len(new_datetimes), dtype='int8', chunks=1))
+        # Unwritten chunks read as the fill value, i.e. missing
+        encoding['cycle_complete'] = {'chunks': (1,), '_FillValue': 0}
+
+        coords = {'datetime': new_datetimes}
+        coords.update({dim: sample[dim] for dim in sample.dims if dim != 'datetime'})
+        template = xr.Dataset(data_vars, coords=coords)
+
+        if self.exists():
+            # Arrays are resized for the new cycles, nothing but metadata is written
+            template.to_zarr(self.path, mode='a', append_dim='datetime', compute=False, consolidated=True)
+        else:
+            for var in STATIC_VARIABLES:
+                if var in sample:
+                    template[var] = sample[var]
+            template.to_zarr(self.path, mode='w', encoding=encoding, compute=False, consolidated=True)
+
+    def write(self, ds):
+        """Write one cycle (batch file layout) into its region of the store, safe to call from parallel workers."""
+        ds = to_store_layout(ds)
+        ds = ds.drop_vars(STATIC_VARIABLES + [dim for dim in ds.dims if dim != 'datetime'], errors='ignore')
+
+        index = np.flatnonzero(self.datetimes() == ds['datetime'].values[0])
+        if len(index) == 0:
+            raise ValueError(f"{ds['datetime'].values[0]} is not in {self.path}, initialize the store first")
+        region = {'datetime': slice(int(index[0]), int(index[0]) + 1)}
+
+        ds.to_zarr(self.path, region=region)
+        # Marked after the data, so a cycle interrupted while writing is redone
+        complete = xr.Dataset({'cycle_complete': (('datetime',), np.ones(1, dtype='int8'))}, coords={'datetime': ds['datetime'].values})
+        complete.to_zarr(self.path, region=region)